@@ -2,6 +2,9 @@
 ASGI config for PauliCode project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSockets (the playground terminal) go to User.routing. In production this
+only serves /ws/ (the `terminal` process in the Procfile) and gunicorn serves
+HTTP through wsgi.py; HTTP is routed here too for the development server.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'PauliCode.settings')
 
-application = get_asgi_application()
+# Initialise Django before importing anything that touches models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+from channels.sessions import SessionMiddlewareStack
+
+from User.routing import websocket_urlpatterns
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        SessionMiddlewareStack(URLRouter(websocket_urlpatterns))
+    ),
+})
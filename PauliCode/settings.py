@@ -20,6 +20,7 @@ ALLOWED_HOSTS = ['paulicode.onrender.com', 'localhost', '127.0.0.1']
 # Application definition
 # =======================
 INSTALLED_APPS = [
+    'daphne',  # ASGI runserver in development (HTTP + WebSockets)
     'jazzmin',
     'django.contrib.admin',
     'django.contrib.auth',
@@ -34,11 +35,14 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # must be directly after SecurityMiddleware
+    'User.media.MediaFilesMiddleware',  # serves MEDIA_URL before sessions are loaded
+    'User.metrics.MetricsMiddleware',  # per-view latency and SQL counts, for /metrics
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'User.middleware.CurrentUserMiddleware',  # request.current_user, needs the session
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -55,6 +59,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'User.fragments.fragment_versions',
             ],
         },
     },
@@ -108,6 +113,202 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # =======================
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Cache lifetime for media without a random token in its name (see User/media.py); tokened names are immutable
+MEDIA_MAX_AGE = config('MEDIA_MAX_AGE', default=3600, cast=int)
+
+# =======================
+# Cache (Redis when REDIS_URL is set, local memory otherwise)
+# =======================
+REDIS_URL = config('REDIS_URL', default='')
+# Metric counters (see User/metrics.py) must never be evicted; defaults to REDIS_URL
+METRICS_REDIS_URL = config('METRICS_REDIS_URL', default=REDIS_URL)
+EXECUTION_CACHE_ENABLED = config('EXECUTION_CACHE_ENABLED', default=True, cast=bool)
+EXECUTION_CACHE_TTL = config('EXECUTION_CACHE_TTL', default=3600, cast=int)
+# Results with more stdout+stderr than this are not cached
+EXECUTION_CACHE_MAX_BYTES = config('EXECUTION_CACHE_MAX_BYTES', default=256 * 1024, cast=int)
+
+if REDIS_URL:
+    # Redis evicts by its own maxmemory-policy. Use volatile-lru: cache entries all
+    # have a TTL and are evicted LRU, while metric counters (no TTL) are never evicted.
+    # A separate METRICS_REDIS_URL instance can use noeviction instead.
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'execution': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'exec',
+            'TIMEOUT': EXECUTION_CACHE_TTL,
+        },
+        'metrics': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': METRICS_REDIS_URL,
+            'KEY_PREFIX': 'metrics',
+            'TIMEOUT': None,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'execution': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'execution',
+            'TIMEOUT': EXECUTION_CACHE_TTL,
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
+        # Never culled: a culled counter would read as a reset (this process's metrics only)
+        'metrics': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'metrics',
+            'TIMEOUT': None,
+            'OPTIONS': {'MAX_ENTRIES': 10 ** 9},
+        },
+    }
+
+# The current-user, problem-details and fragment caches are invalidated by version tokens
+# (User/versioning.py), which every process must share: a bump in one process's local
+# memory leaves the others serving stale data. They are only on with Redis by default,
+# and the "User.E001" system check refuses to turn them on over a local-memory cache.
+VERSIONED_CACHES = config('VERSIONED_CACHES', default=bool(REDIS_URL), cast=bool)
+# How long a logged-in user's row is cached (entries are also dropped when the row changes)
+CURRENT_USER_CACHE_TTL = config('CURRENT_USER_CACHE_TTL', default=300, cast=int)
+# Serialised problem details (dropped on edit/delete)
+PROBLEM_DETAILS_CACHE_TTL = config('PROBLEM_DETAILS_CACHE_TTL', default=3600, cast=int)
+# Cached class cards and sidebar profile blocks (keys change when the data does, see User/fragments.py)
+FRAGMENT_CACHE_TTL = config('FRAGMENT_CACHE_TTL', default=3600, cast=int)
+
+# =======================
+# Channels (playground terminal WebSockets)
+# =======================
+# In production HTTP is served by gunicorn (WSGI) and only the terminal's /ws/ by the
+# separate daphne process (`terminal` in the Procfile): under ASGI, Django runs every sync
+# view of a process on one thread, so long code runs would queue behind each other.
+# The proxy in front routes /ws/ to daphne; if it is on another host instead, set
+# TERMINAL_WS_URL (e.g. wss://terminal.example.com) and a SESSION_COOKIE_DOMAIN both share.
+TERMINAL_WS_URL = config('TERMINAL_WS_URL', default='')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+# Wall-clock limit for one interactive terminal run (CPU time is still capped by rlimits)
+TERMINAL_SESSION_TIMEOUT = config('TERMINAL_SESSION_TIMEOUT', default=300, cast=int)
+
+# =======================
+# Code execution
+# =======================
+# 'piston' posts code to the public Piston API, 'local' compiles and runs it on
+# this machine under rlimits. A dotted path to an ExecutionBackend also works.
+CODE_RUNNER_BACKEND = config('CODE_RUNNER_BACKEND', default='piston')
+# Command the local backend starts every compiler and program through; it must give
+# them an unprivileged user of their own, no network, only the work dir writable and
+# a per-run process limit. {workdir} and the CODE_RUNNER_LIMITS keys are filled in, and
+# `prlimit` must be available inside it. With nsjail, for example:
+#   nsjail -Mo --quiet --user 65534 --group 65534 -R /usr -R /lib -R /lib64 -R /bin -R /etc
+#   -B {workdir}:/work --cwd /work -E PATH=/usr/bin:/bin -E HOME=/work -E LANG=C.UTF-8
+#   --cgroup_pids_max {processes} --time_limit 0 --rlimit_as inf --rlimit_cpu inf --rlimit_fsize inf --
+# Without one the local backend is for development only; the User.E002 check refuses
+# it when DEBUG is off.
+CODE_RUNNER_SANDBOX = config('CODE_RUNNER_SANDBOX', default='')
+CODE_RUNNER_PISTON_URL = config('CODE_RUNNER_PISTON_URL', default='https://emkc.org/api/v2/piston')
+# Piston client: keep-alive pool, in-flight cap (beyond it callers get a 503),
+# retries for connection errors / 429 / 5xx, and the circuit breaker
+CODE_RUNNER_HTTP_POOL_SIZE = config('CODE_RUNNER_HTTP_POOL_SIZE', default=10, cast=int)
+CODE_RUNNER_MAX_IN_FLIGHT = config('CODE_RUNNER_MAX_IN_FLIGHT', default=20, cast=int)
+CODE_RUNNER_RETRIES = config('CODE_RUNNER_RETRIES', default=2, cast=int)
+CODE_RUNNER_BREAKER_THRESHOLD = config('CODE_RUNNER_BREAKER_THRESHOLD', default=5, cast=int)
+CODE_RUNNER_BREAKER_RESET = config('CODE_RUNNER_BREAKER_RESET', default=30, cast=int)
+CODE_RUNNER_POOL_SIZE = config('CODE_RUNNER_POOL_SIZE', default=4, cast=int)
+CODE_RUNNER_LIMITS = {
+    'cpu_seconds': config('CODE_RUNNER_CPU_SECONDS', default=5, cast=int),
+    'memory_mb': config('CODE_RUNNER_MEMORY_MB', default=256, cast=int),
+    'file_size_mb': config('CODE_RUNNER_FILE_SIZE_MB', default=16, cast=int),
+    # Enforced by CODE_RUNNER_SANDBOX ({processes}) per run; RLIMIT_NPROC would count
+    # every process of the user, including other runs
+    'processes': config('CODE_RUNNER_PROCESSES', default=64, cast=int),
+    # Output kept per run; the rest is counted and dropped (result["truncated"])
+    'stdout_max_bytes': config('CODE_RUNNER_STDOUT_MAX_BYTES', default=1024 * 1024, cast=int),
+    'stderr_max_bytes': config('CODE_RUNNER_STDERR_MAX_BYTES', default=64 * 1024, cast=int),
+}
+
+# =======================
+# Grading queue
+# =======================
+# Submissions are saved as Pending and graded by `python manage.py grade_worker`.
+# Turn off to grade inline in the request (e.g. local development without a worker).
+GRADING_QUEUE = config('GRADING_QUEUE', default=True, cast=bool)
+GRADING_POLL_INTERVAL = config('GRADING_POLL_INTERVAL', default=1.0, cast=float)
+# Running submissions not finished after this many seconds are re-queued
+GRADING_CLAIM_TIMEOUT = config('GRADING_CLAIM_TIMEOUT', default=300, cast=int)
+# Test cases of one submission run in parallel up to the first limit; the second
+# caps test-case runs in flight across all submissions in one process.
+GRADING_MAX_PARALLEL_CASES = config('GRADING_MAX_PARALLEL_CASES', default=4, cast=int)
+GRADING_MAX_CONCURRENT_RUNS = config('GRADING_MAX_CONCURRENT_RUNS', default=16, cast=int)
+# Submissions regraded at once by `python manage.py regrade`
+REGRADE_WORKERS = config('REGRADE_WORKERS', default=8, cast=int)
+
+# Limits for test cases imported from a CSV/zip upload
+TESTCASE_MAX_COUNT = config('TESTCASE_MAX_COUNT', default=500, cast=int)
+TESTCASE_MAX_BYTES = config('TESTCASE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+# Total uncompressed size of the test case files in one zip
+TESTCASE_IMPORT_MAX_BYTES = config('TESTCASE_IMPORT_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+# Test data larger than this is stored under MEDIA_ROOT/testdata and streamed when grading
+TESTCASE_INLINE_MAX_BYTES = config('TESTCASE_INLINE_MAX_BYTES', default=64 * 1024, cast=int)
+TESTCASE_PREVIEW_CHARS = 1000
+
+# =======================
+# Admission control
+# =======================
+# Playground runs per student and per class (token buckets: refill per minute, burst size)
+THROTTLE_USER_PER_MINUTE = config('THROTTLE_USER_PER_MINUTE', default=12, cast=int)
+THROTTLE_USER_BURST = config('THROTTLE_USER_BURST', default=5, cast=int)
+THROTTLE_CLASS_PER_MINUTE = config('THROTTLE_CLASS_PER_MINUTE', default=240, cast=int)
+THROTTLE_CLASS_BURST = config('THROTTLE_CLASS_BURST', default=60, cast=int)
+# Concurrent runner calls across all workers; playground runs can't use the reserved share
+RUNNER_MAX_CONCURRENCY = config('RUNNER_MAX_CONCURRENCY', default=16, cast=int)
+RUNNER_RESERVED_FOR_GRADING = config('RUNNER_RESERVED_FOR_GRADING', default=4, cast=int)
+# Lease on a runner slot: one never released (a crashed worker) frees itself after this.
+# A slot is held for one runner call; terminal sessions take their own lease.
+RUNNER_SLOT_TTL = config('RUNNER_SLOT_TTL', default=600, cast=int)
+# How long a grading worker waits for a free slot before requeueing
+GRADING_SLOT_WAIT = config('GRADING_SLOT_WAIT', default=30, cast=int)
+# How long a playground run waits for a free slot before answering 429
+PLAYGROUND_SLOT_WAIT = config('PLAYGROUND_SLOT_WAIT', default=2, cast=int)
+
+# =======================
+# Roster import
+# =======================
+# Rows accepted in one CSV roster upload (see User/roster.py)
+ROSTER_IMPORT_MAX_ROWS = config('ROSTER_IMPORT_MAX_ROWS', default=2000, cast=int)
+# Largest roster CSV read at all; checked before the file is decoded and parsed
+ROSTER_IMPORT_MAX_BYTES = config('ROSTER_IMPORT_MAX_BYTES', default=1024 * 1024, cast=int)
+
+# =======================
+# Metrics
+# =======================
+# /metrics answers only requests with "Authorization: Bearer <METRICS_TOKEN>"; it is off while unset
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# How often each process's background thread adds its counts to the shared counters in the cache
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5.0, cast=float)
+
+# =======================
+# Uploaded images
+# =======================
+# Profile pictures and class icons; resized WebP/JPEG variants are written in the background (see User/images.py)
+IMAGE_MAX_PIXELS = config('IMAGE_MAX_PIXELS', default=40_000_000, cast=int)
+# Originals are scaled down to fit this many pixels on their longest side
+IMAGE_MAX_DIMENSION = config('IMAGE_MAX_DIMENSION', default=1600, cast=int)
+IMAGE_QUALITY = config('IMAGE_QUALITY', default=82, cast=int)
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
 
 # =======================
 # Default primary key field
@@ -130,10 +331,3 @@ JAZZMIN_UI_TWEAKS = {
     "dark_mode_theme": "solar",
     "sidebar_fixed": True,
 }
-
-# =======================
-# Extra for Render (optional fallback)
-# =======================
-# Allow Django to serve media during Render (since free plan can't use Nginx)
-if not DEBUG:
-    MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
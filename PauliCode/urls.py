@@ -12,6 +12,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
 ]
 
-# Serve static and media in both development and Render (temporary workaround)
+# Serve static in development; media is served by User.media.MediaFilesMiddleware
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
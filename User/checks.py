@@ -0,0 +1,38 @@
+"""
+System checks for settings that only work in some deployments.
+"""
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+LOCAL_CACHE_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+@register(Tags.caches)
+def check_versioned_caches(app_configs, **kwargs):
+    """Version tokens live in the default cache, so it must be shared by every process."""
+    if settings.VERSIONED_CACHES and settings.CACHES["default"]["BACKEND"] in LOCAL_CACHE_BACKENDS:
+        return [Error(
+            "VERSIONED_CACHES needs a shared default cache.",
+            hint="Set REDIS_URL, or turn VERSIONED_CACHES off: with a per-process cache, an update "
+                 "made in one process (a web worker, grade_worker, a management command) leaves "
+                 "the others serving stale users, problems and fragments.",
+            id="User.E001",
+        )]
+    return []
+
+
+@register()
+def check_local_runner(app_configs, **kwargs):
+    """The local backend only has real isolation inside CODE_RUNNER_SANDBOX."""
+    if settings.CODE_RUNNER_BACKEND == "local" and not settings.CODE_RUNNER_SANDBOX and not settings.DEBUG:
+        return [Error(
+            "The local code runner needs CODE_RUNNER_SANDBOX outside development.",
+            hint="Without it student programs run as the server's own user, with its environment, files "
+                 "and network. Configure a sandbox (see settings.py) or use the piston backend.",
+            id="User.E002",
+        )]
+    return []
@@ -0,0 +1,411 @@
+"""
+Incremental output comparison.
+
+A comparator is fed the program's stdout chunk by chunk and checks it against
+the expected output, which may be a memory-mapped file, so neither side is
+ever held in memory as a whole. feed() returns False as soon as the output
+can no longer match, letting the runner kill the program early; after a
+mismatch `difference` describes the first differing line. Line modes carry
+only the unfinished last line between chunks (at most MAX_LINE_BYTES, or the
+size of the expected output), and token modes only the unfinished token.
+
+Each problem picks a mode (Problem.comparator):
+
+    exact                equal after stripping leading/trailing whitespace (the original rule)
+    trailing_whitespace  line by line, ignoring whitespace at the end of lines and trailing blank lines
+    tokens               the same whitespace-separated tokens, however they are spaced
+    float                like tokens, but numbers may differ by an absolute or relative tolerance
+    unordered_lines      the same lines in any order (blank lines ignored)
+
+This module is imported by the runner pool processes and must not import
+Django models.
+"""
+
+import math, mmap
+from collections import Counter
+from contextlib import contextmanager
+
+WHITESPACE = b" \t\n\r\x0b\x0c"
+DIFF_PREVIEW_CHARS = 80
+# Longest unfinished line (or token) held while waiting for the rest of it, unless the
+# expected output is longer; nothing longer than the whole expected output can match
+MAX_LINE_BYTES = 1024 * 1024
+
+
+@contextmanager
+def open_mapped(path):
+    """Yields a read-only memory map of a file (or b"" for an empty file)."""
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def _show(line):
+    if line is None:
+        return "end of output"
+    text = bytes(line).decode("utf-8", errors="replace")
+    if len(text) > DIFF_PREVIEW_CHARS:
+        text = text[:DIFF_PREVIEW_CHARS] + "…"
+    return repr(text)
+
+
+def _describe(line_no, expected, actual):
+    return f"line {line_no}: expected {_show(expected)}, got {_show(actual)}"
+
+
+def _iter_lines(data):
+    """Lines of a bytes-like object (bytes or mmap) without copying the whole thing."""
+    start, size = 0, len(data)
+    while start < size:
+        end = data.find(b"\n", start)
+        if end == -1:
+            end = size
+        yield data[start:end].rstrip(b"\r")
+        start = end + 1
+
+
+def _iter_tokens(data, block=64 * 1024):
+    """Whitespace-separated tokens of a bytes-like object, split a block at a time."""
+    carry = b""
+    for start in range(0, len(data), block):
+        piece = data[start:start + block]
+        tokens = piece.split()
+        if carry:
+            if tokens and piece[0] not in WHITESPACE:
+                tokens[0] = carry + tokens[0]
+            else:
+                tokens.insert(0, carry)
+        carry = tokens.pop() if tokens and piece[-1] not in WHITESPACE else b""
+        yield from tokens
+    if carry:
+        yield carry
+
+
+class Comparator:
+    """Base class: feed() stdout chunks, then finish(). Both return whether the output still matches."""
+
+    def __init__(self, expected, **options):
+        self.expected = expected
+        self.ok = True
+        self.difference = None
+
+    def feed(self, chunk):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+    def fail(self, difference):
+        self.ok = False
+        self.difference = difference
+        return False
+
+
+class ExactComparator(Comparator):
+    """
+    Output must equal the expected output after stripping leading and trailing
+    whitespace from both, the same rule as `out.strip() == expected.strip()`.
+    """
+
+    def __init__(self, expected, **options):
+        super().__init__(expected)
+        start, end = 0, len(expected)
+        while start < end and expected[start] in WHITESPACE:
+            start += 1
+        while end > start and expected[end - 1] in WHITESPACE:
+            end -= 1
+        self.pos = start
+        self.end = end
+        self.line = expected[:start].count(b"\n") + 1
+        self.started = False
+
+    def feed(self, chunk):
+        if not self.ok:
+            return False
+        if not self.started:
+            chunk = chunk.lstrip(WHITESPACE)
+            if not chunk:
+                return True
+            self.started = True
+
+        head = chunk[:self.end - self.pos]
+        if head != self.expected[self.pos:self.pos + len(head)]:
+            return self._mismatch(chunk)
+        self.pos += len(head)
+        self.line += head.count(b"\n")
+
+        # Past the end of the expected output only trailing whitespace may follow
+        rest = chunk[len(head):]
+        extra = rest.lstrip(WHITESPACE)
+        if extra:
+            line = self.line + rest[:len(rest) - len(extra)].count(b"\n")
+            return self.fail(_describe(line, None, extra.split(b"\n", 1)[0]))
+        return True
+
+    def _mismatch(self, chunk):
+        # Everything before the first differing byte matched, so both lines start at the same place
+        at = 0
+        while self.pos + at < self.end and at < len(chunk) and chunk[at] == self.expected[self.pos + at]:
+            at += 1
+        line = self.line + chunk[:at].count(b"\n")
+        line_start = self.expected.rfind(b"\n", 0, self.pos + at) + 1
+        line_end = self.expected.find(b"\n", self.pos + at)
+        expected_line = self.expected[line_start:line_end if line_end != -1 else len(self.expected)]
+        prefix = self.expected[line_start:self.pos + at]
+        actual_line = prefix + chunk[at:].split(b"\n", 1)[0]
+        return self.fail(_describe(line, expected_line.rstrip(b"\r"), actual_line.rstrip(b"\r")))
+
+    def finish(self):
+        if self.ok and self.pos < self.end:
+            start = self.pos
+            while self.expected[start] in WHITESPACE:
+                start += 1
+            line_start = self.expected.rfind(b"\n", 0, start) + 1
+            line_end = self.expected.find(b"\n", start)
+            missing = self.expected[line_start:line_end if line_end != -1 else self.end]
+            line = self.line + self.expected[self.pos:start].count(b"\n")
+            self.fail(_describe(line, missing.rstrip(b"\r"), None))
+        return self.ok
+
+
+class LineComparator(Comparator):
+    """
+    Feeds complete lines of output to compare_line(); subclasses compare against self.expected_lines.
+    Only the unfinished last line is carried between chunks, as a list of pieces joined once it ends.
+    """
+
+    def __init__(self, expected, **options):
+        super().__init__(expected)
+        self.expected_lines = _iter_lines(expected)
+        self.expected_line = 0
+        self.partial = []
+        self.partial_bytes = 0
+        self.max_line = max(MAX_LINE_BYTES, len(expected))
+        self.line = 0
+
+    def next_expected(self):
+        line = next(self.expected_lines, None)
+        if line is not None:
+            self.expected_line += 1
+        return line
+
+    def feed(self, chunk):
+        if not self.ok:
+            return False
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            self.line += 1
+            if not self.compare_line(self.take_partial(chunk[start:end]).rstrip(b"\r")):
+                return False
+            start = end + 1
+        if start < len(chunk):
+            return self.hold(chunk[start:])
+        return True
+
+    def hold(self, piece):
+        """Keeps the start of an unfinished line (or token) until the rest of it arrives."""
+        self.partial.append(piece)
+        self.partial_bytes += len(piece)
+        if self.partial_bytes > self.max_line:
+            return self.fail(f"line {self.line + 1}: longer than {self.max_line} bytes")
+        return True
+
+    def take_partial(self, end=b""):
+        """The held pieces followed by end, emptying the holder."""
+        if not self.partial:
+            return end
+        joined = b"".join(self.partial) + end
+        self.partial, self.partial_bytes = [], 0
+        return joined
+
+    def finish(self):
+        if self.ok and self.partial:
+            self.line += 1
+            self.compare_line(self.take_partial().rstrip(b"\r"))
+        if self.ok:
+            self.finish_lines()
+        return self.ok
+
+    def compare_line(self, line):
+        raise NotImplementedError
+
+    def finish_lines(self):
+        pass
+
+
+class TrailingWhitespaceComparator(LineComparator):
+    """Lines must match except for whitespace at their end; trailing blank lines are ignored."""
+
+    def __init__(self, expected, **options):
+        super().__init__(expected)
+        self.pending_blank = 0  # blank output lines not yet matched against expected lines
+
+    def compare_line(self, line):
+        line = line.rstrip(WHITESPACE)
+        if not line:
+            self.pending_blank += 1
+            return True
+
+        # Blank lines only count once something follows them
+        for _ in range(self.pending_blank):
+            expected = self.next_expected()
+            if expected is None or expected.rstrip(WHITESPACE):
+                return self.fail(_describe(self.expected_line or self.line, expected, b""))
+        self.pending_blank = 0
+
+        expected = self.next_expected()
+        if expected is None or expected.rstrip(WHITESPACE) != line:
+            return self.fail(_describe(self.line, expected, line))
+        return True
+
+    def finish_lines(self):
+        while (expected := self.next_expected()) is not None:
+            if expected.rstrip(WHITESPACE):
+                self.fail(_describe(self.expected_line, expected, None))
+                return
+
+
+class TokenComparator(LineComparator):
+    """
+    The same whitespace-separated tokens in the same order, regardless of spacing and line breaks.
+    Tokens are compared as soon as they end, so a long line is never held; only an unfinished token is.
+    """
+
+    def __init__(self, expected, **options):
+        super().__init__(expected)
+        self.expected_tokens = _iter_tokens(expected)
+        self.in_line = False  # output has started a line that hasn't ended yet
+
+    def feed(self, chunk):
+        if not self.ok:
+            return False
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                return self.feed_segment(chunk[start:], line_done=False)
+            if not self.feed_segment(chunk[start:end], line_done=True):
+                return False
+            self.line += 1
+            self.in_line = False
+            start = end + 1
+
+    def feed_segment(self, segment, line_done):
+        """Compares the tokens of a piece of one line; line_done means a newline follows it."""
+        if not segment and not line_done:
+            return True
+        self.in_line = self.in_line or bool(segment)
+        tokens = segment.split()
+        if not line_done and len(tokens) == 1 and len(tokens[0]) == len(segment):
+            # No whitespace at all: the token carries on from the last chunk and into the next
+            return self.hold(segment)
+
+        if self.partial:
+            if tokens and segment[0] not in WHITESPACE:
+                tokens[0] = self.take_partial(tokens[0])
+            else:
+                tokens.insert(0, self.take_partial())
+        unfinished = tokens.pop() if tokens and not line_done and segment[-1] not in WHITESPACE else None
+
+        for token in tokens:
+            if not self.compare_token(token):
+                return False
+        return unfinished is None or self.hold(unfinished)
+
+    def compare_token(self, token):
+        expected = next(self.expected_tokens, None)
+        if expected is None or not self.tokens_equal(expected, token):
+            return self.fail(_describe(self.line + 1, expected, token))
+        return True
+
+    def tokens_equal(self, expected, actual):
+        return expected == actual
+
+    def finish(self):
+        if self.ok and self.partial:
+            self.compare_token(self.take_partial())
+        if self.in_line:
+            self.line += 1
+        if self.ok:
+            self.finish_lines()
+        return self.ok
+
+    def finish_lines(self):
+        expected = next(self.expected_tokens, None)
+        if expected is not None:
+            self.fail(_describe(self.line, expected, None))
+
+
+class FloatComparator(TokenComparator):
+    """Tokens, with numbers equal when within abs_tol or rel_tol of the expected value."""
+
+    def __init__(self, expected, abs_tol=1e-6, rel_tol=1e-6, **options):
+        super().__init__(expected)
+        self.abs_tol = abs_tol
+        self.rel_tol = rel_tol
+
+    def tokens_equal(self, expected, actual):
+        if expected == actual:
+            return True
+        try:
+            e, a = float(expected), float(actual)
+        except ValueError:
+            return False
+        if math.isnan(e) or math.isnan(a):
+            return math.isnan(e) and math.isnan(a)
+        return abs(e - a) <= max(self.abs_tol, self.rel_tol * abs(e))
+
+
+class UnorderedLinesComparator(LineComparator):
+    """
+    The same lines in any order (trailing whitespace and blank lines ignored).
+    Needs a count of the expected lines in memory; output is still checked as it arrives.
+    """
+
+    def __init__(self, expected, **options):
+        super().__init__(expected)
+        self.remaining = Counter(
+            line for line in (l.rstrip(WHITESPACE) for l in self.expected_lines) if line
+        )
+
+    def compare_line(self, line):
+        line = line.rstrip(WHITESPACE)
+        if not line:
+            return True
+        if self.remaining[line] <= 0:
+            return self.fail(f"line {self.line}: unexpected {_show(line)}")
+        self.remaining[line] -= 1
+        return True
+
+    def finish_lines(self):
+        missing = next((line for line, count in self.remaining.items() if count > 0), None)
+        if missing is not None:
+            self.fail(f"missing line {_show(missing)}")
+
+
+COMPARATORS = {
+    "exact": ExactComparator,
+    "trailing_whitespace": TrailingWhitespaceComparator,
+    "tokens": TokenComparator,
+    "float": FloatComparator,
+    "unordered_lines": UnorderedLinesComparator,
+}
+
+
+def make_comparator(expected, mode="exact", **options):
+    """Returns a comparator for the mode (unknown modes fall back to exact)."""
+    return COMPARATORS.get(mode, ExactComparator)(expected, **options)
+
+
+def compare_output(expected, actual, mode="exact", **options):
+    """Compares complete outputs (bytes or str). Returns (passed, difference)."""
+    if isinstance(expected, str):
+        expected = expected.encode("utf-8")
+    if isinstance(actual, str):
+        actual = actual.encode("utf-8")
+    comparator = make_comparator(expected, mode, **options)
+    passed = comparator.feed(actual) and comparator.finish()
+    return passed, comparator.difference
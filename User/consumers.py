@@ -0,0 +1,228 @@
+"""
+WebSocket terminal for the student playground (ws/playground/<problem_id>/).
+
+Messages from the browser (JSON):
+    {"type": "run", "code": "...", "language": "python", "stdin": "..."}
+    {"type": "stdin", "data": "..."}   interactive input
+    {"type": "eof"}                    close the program's stdin
+    {"type": "kill"}
+
+Messages to the browser:
+    {"type": "stdout" | "stderr" | "compile_error" | "error", "data": "..."}
+    {"type": "exit", "code": <int or null>}
+
+With a streaming backend (local) the program runs as a child of this process
+and its output is forwarded as it is produced; other backends run the program
+to completion and send the whole output at once. Streamed output has the
+same per-stream limits as a batch run (CODE_RUNNER_LIMITS); a program that
+goes past them is told so and killed.
+"""
+
+import asyncio, codecs, os, signal
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from .execution import COMPILE_TIMEOUT_SEC, get_backend, output_limits
+from .models import Problem
+from .runner_client import RunnerUnavailable
+from .throttling import PLAYGROUND, Throttled, acquire_slot, check_playground_rate, release_slot
+
+READ_CHUNK = 4096
+
+
+class TerminalConsumer(AsyncJsonWebsocketConsumer):
+
+    async def connect(self):
+        self.school_id = await self.session_school_id()
+        self.problem_id = int(self.scope["url_route"]["kwargs"]["problem_id"])
+        self.process = None
+        self.program = None
+        self.streamer = None
+        self.slot = None
+
+        self.class_id = await self.problem_class_id()
+        if not self.school_id or self.class_id is None:
+            await self.close(code=4403)
+            return
+        await self.accept()
+
+    async def disconnect(self, code):
+        await self.stop()
+
+    @database_sync_to_async
+    def session_school_id(self):
+        # The session is loaded lazily, from the database, on first access
+        session = self.scope.get("session")
+        return session.get("school_id") if session is not None else None
+
+    @database_sync_to_async
+    def problem_class_id(self):
+        return Problem.objects.filter(pk=self.problem_id).values_list("class_id", flat=True).first()
+
+    async def receive_json(self, content):
+        kind = content.get("type")
+
+        if kind == "run":
+            await self.start(content)
+        elif kind == "stdin" and self.process and self.process.stdin:
+            await self.write_stdin(content.get("data") or "")
+        elif kind == "eof" and self.process and self.process.stdin:
+            self.process.stdin.close()
+        elif kind == "kill":
+            await self.stop()
+
+    # ---------------- RUNNING ---------------- #
+
+    async def start(self, content):
+        await self.stop()
+
+        code = content.get("code", "")
+        language = (content.get("language") or "python").lower()
+        stdin_data = content.get("stdin") or ""
+        if not code.strip():
+            await self.send_json({"type": "error", "data": "Code cannot be empty."})
+            return
+
+        # Same admission control as run_playground_code; the slot is held for the whole session
+        try:
+            await sync_to_async(check_playground_rate)(self.school_id, self.class_id)
+            self.slot = await sync_to_async(acquire_slot)(
+                PLAYGROUND, lease=settings.TERMINAL_SESSION_TIMEOUT + COMPILE_TIMEOUT_SEC,
+            )
+        except Throttled as e:
+            await self.send_json({"type": "error", "data": str(e)})
+            await self.send_json({"type": "exit", "code": None})
+            return
+
+        backend = get_backend()
+        if not backend.supports_streaming:
+            try:
+                result = await sync_to_async(backend.execute, thread_sensitive=False)(
+                    language, code, stdin_data=stdin_data + "\n"
+                )
+            except RunnerUnavailable as e:
+                result = {"error": str(e)}
+            finally:
+                await self.release(backend)
+            for kind in ("compile_error", "stdout", "stderr", "error"):
+                if result.get(kind):
+                    await self.send_json({"type": kind, "data": result[kind]})
+            await self.send_json({"type": "exit", "code": None})
+            return
+
+        try:
+            self.program = await sync_to_async(backend.compile, thread_sensitive=False)(language, code)
+        except RunnerUnavailable as e:
+            await self.send_json({"type": "error", "data": str(e)})
+            await self.send_json({"type": "exit", "code": None})
+            await self.release(backend)
+            return
+        if self.program.compile_error:
+            await self.send_json({"type": "compile_error", "data": self.program.compile_error})
+            await self.send_json({"type": "exit", "code": None})
+            await self.release(backend)
+            return
+
+        # Until the streamer owns them, the work dir and the slot are released here
+        started = False
+        try:
+            popen = backend.popen_args(self.program)
+            self.process = await asyncio.create_subprocess_exec(
+                *popen["args"], cwd=popen["cwd"], env=popen["env"], start_new_session=popen["start_new_session"],
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+            self.streamer = asyncio.create_task(self.stream(backend))
+            started = True
+        except OSError as e:
+            await self.send_json({"type": "error", "data": f"⚠️ Code runner failed: {e}"})
+            await self.send_json({"type": "exit", "code": None})
+        finally:
+            if not started:
+                self.process = None
+                await self.release(backend)
+        if not started:
+            return
+        if stdin_data:
+            await self.write_stdin(stdin_data)
+
+    async def write_stdin(self, data):
+        try:
+            self.process.stdin.write(data.encode("utf-8"))
+            await self.process.stdin.drain()
+        except (OSError, AttributeError):
+            # The program already exited (or closed its stdin)
+            pass
+
+    async def stream(self, backend):
+        process = self.process
+        stdout_limit, stderr_limit = output_limits()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    self.forward(process, process.stdout, "stdout", stdout_limit),
+                    self.forward(process, process.stderr, "stderr", stderr_limit),
+                    process.wait(),
+                ),
+                timeout=settings.TERMINAL_SESSION_TIMEOUT,
+            )
+            await self.send_json({"type": "exit", "code": process.returncode})
+        except asyncio.TimeoutError:
+            self.kill(process)
+            await self.send_json({"type": "error", "data": "⏱️ Timed out."})
+            await self.send_json({"type": "exit", "code": None})
+        finally:
+            self.process = None
+            await self.release(backend)
+
+    async def forward(self, process, pipe, kind, limit):
+        """Sends the pipe's output as it arrives, up to limit bytes; past that the program is killed."""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        sent = 0
+        while True:
+            chunk = await pipe.read(READ_CHUNK)
+            over = sent + len(chunk) > limit
+            if over:
+                chunk = chunk[:limit - sent]
+            sent += len(chunk)
+            text = decoder.decode(chunk, final=not chunk or over)
+            if text:
+                await self.send_json({"type": kind, "data": text})
+            if over:
+                self.kill(process)
+                await self.send_json({
+                    "type": "error",
+                    "data": f"✂️ More than {limit} bytes of {kind}; output truncated and the program stopped.",
+                })
+                # Read to EOF: process.wait() only returns once every pipe is closed
+                while await pipe.read(READ_CHUNK):
+                    pass
+                return
+            if not chunk:
+                return
+
+    async def stop(self):
+        if self.process:
+            self.kill(self.process)
+        if self.streamer:
+            # The streamer sees EOF once the process is gone and cleans up
+            await asyncio.gather(self.streamer, return_exceptions=True)
+            self.streamer = None
+
+    def kill(self, process):
+        if process.returncode is None:
+            try:
+                # Programs run in their own session; kill any children too
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    async def release(self, backend):
+        if self.program:
+            program, self.program = self.program, None
+            await sync_to_async(backend.release, thread_sensitive=False)(program)
+        if self.slot:
+            slot, self.slot = self.slot, None
+            await sync_to_async(release_slot)(slot)
@@ -0,0 +1,580 @@
+"""
+Code execution backends.
+
+Every backend returns the same result dict (stdout, stderr, compile_error,
+error) so the playground and submission views don't care where the code ran.
+The backend is picked with the CODE_RUNNER_BACKEND setting.
+
+Failures of the runner itself (a crashed pool, a missing compiler, a bad
+response from Piston) raise RunnerUnavailable instead of coming back as a
+result, so they are never graded as the student's compile error.
+
+Only the first stdout_max_bytes / stderr_max_bytes of CODE_RUNNER_LIMITS are
+kept from a run; anything after that is read and counted but dropped. The
+result carries "truncated" and the full "stdout_bytes" / "stderr_bytes".
+
+The local backend starts every program and compiler through `prlimit`, so
+the rlimits are set by the child itself instead of a preexec_fn (which isn't
+safe in a threaded server), and inside the CODE_RUNNER_SANDBOX command, which
+gives it its own user, filesystem, network and process limit. Without a
+sandbox it is only fit for development (see the User.E002 check).
+
+run_checked() runs a test case stored as files: the input file is streamed
+to the program and its output is compared as it arrives against a memory
+map of the expected file, using the problem's comparator; the result gets
+"passed" and "difference" and only a preview of stdout.
+"""
+
+import os, selectors, shlex, shutil, signal, subprocess, tempfile, threading, time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .comparators import make_comparator, open_mapped
+from .execution_cache import cached_run, result_key
+from .metrics import MeteredBackend
+from .runner_client import CircuitBreaker, RunnerClient, RunnerUnavailable
+from .throttling import runner_slot
+
+
+def _result(stdout="", stderr="", compile_error="", error=""):
+    return {
+        "stdout": stdout, "stderr": stderr, "compile_error": compile_error, "error": error,
+        "truncated": False, "stdout_bytes": 0, "stderr_bytes": 0,
+    }
+
+
+# stdout/stderr kept from a checked run, for the failure message
+CHECKED_OUTPUT_PREVIEW_BYTES = 4096
+# Used when CODE_RUNNER_LIMITS doesn't set them
+STDOUT_MAX_BYTES = 1024 * 1024
+STDERR_MAX_BYTES = 64 * 1024
+READ_CHUNK = 64 * 1024
+
+
+class _Capture:
+    """Keeps the first max_bytes of a stream and counts the rest."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.head = bytearray()
+        self.total = 0
+
+    def add(self, chunk):
+        self.total += len(chunk)
+        if len(self.head) < self.max_bytes:
+            self.head += chunk[:self.max_bytes - len(self.head)]
+
+    @property
+    def truncated(self):
+        return self.total > len(self.head)
+
+    def text(self):
+        return self.head.decode("utf-8", errors="replace")
+
+
+def stdout_truncated(result):
+    """Whether stdout in the result was cut at the limit (so it can't be compared as is)."""
+    return result.get("stdout_bytes", 0) > _output_limits(settings.CODE_RUNNER_LIMITS)[0]
+
+
+def truncation_note(result):
+    """A line to show after output from a truncated result, or ""."""
+    if not result.get("truncated"):
+        return ""
+    return (
+        f"\n… output truncated ({result.get('stdout_bytes', 0)} bytes of stdout, "
+        f"{result.get('stderr_bytes', 0)} bytes of stderr)"
+    )
+
+
+def _output_limits(limits):
+    return limits.get("stdout_max_bytes", STDOUT_MAX_BYTES), limits.get("stderr_max_bytes", STDERR_MAX_BYTES)
+
+
+def output_limits():
+    """(stdout, stderr) bytes kept from one run under CODE_RUNNER_LIMITS."""
+    return _output_limits(settings.CODE_RUNNER_LIMITS)
+
+
+def _captured_result(stdout, stderr, **fields):
+    """A result from the stdout / stderr captures, with the truncation metadata."""
+    result = _result(stdout=stdout.text(), stderr=stderr.text(), **fields)
+    result.update(
+        truncated=stdout.truncated or stderr.truncated,
+        stdout_bytes=stdout.total,
+        stderr_bytes=stderr.total,
+    )
+    return result
+
+
+class Program:
+    """A submission built once by a backend so it can be run against many inputs."""
+
+    def __init__(self, language, code, workdir=None, compile_error=""):
+        self.language = language
+        self.code = code
+        self.workdir = workdir
+        self.compile_error = compile_error
+
+
+class ExecutionBackend:
+    """Base class for code runners."""
+
+    # Backends that can start a compiled program as a local child process
+    # (see LocalBackend.popen_args) let the playground terminal stream output.
+    supports_streaming = False
+
+    def execute(self, language, code, stdin_data="", timeout_sec=5):
+        raise NotImplementedError
+
+    # Backends that can't keep build artifacts around just hold on to the
+    # source and fall back to a full execute() per run.
+    def compile(self, language, code):
+        return Program(language, code)
+
+    def run(self, program, stdin_data="", timeout_sec=5):
+        return self.execute(program.language, program.code, stdin_data=stdin_data, timeout_sec=timeout_sec)
+
+    def run_checked(self, program, stdin_path, expected_path, timeout_sec=5, compare=None):
+        """
+        Runs against a stored test case and sets result["passed"] and result["difference"].
+        compare holds the comparator options (Problem.compare_options()).
+        Remote backends need the whole input in the request, so this default reads it
+        and compares the returned output afterwards.
+        """
+        with open(stdin_path, "r", encoding="utf-8", errors="replace") as f:
+            stdin_data = f.read()
+        result = self.run(program, stdin_data=stdin_data, timeout_sec=timeout_sec)
+
+        stdout = (result.get("stdout") or "").encode("utf-8")
+        with open_mapped(expected_path) as expected:
+            comparator = make_comparator(expected, **(compare or {}))
+            result["passed"] = comparator.feed(stdout) and comparator.finish()
+            result["difference"] = comparator.difference
+        result["stdout"] = stdout[:CHECKED_OUTPUT_PREVIEW_BYTES].decode("utf-8", errors="replace")
+        result["truncated"] = result.get("truncated") or len(stdout) > CHECKED_OUTPUT_PREVIEW_BYTES
+        return result
+
+    def release(self, program):
+        pass
+
+
+# ---------------- PISTON (REMOTE) ---------------- #
+
+class PistonBackend(ExecutionBackend):
+    """Executes code via the Piston API through the shared pooled RunnerClient."""
+
+    lang_map = {
+        "python": "python3",
+        "python3": "python3",
+        "c": "c",
+        "cpp": "cpp",
+        "java": "java",
+    }
+
+    def __init__(self, client=None):
+        self.client = client or RunnerClient(
+            settings.CODE_RUNNER_PISTON_URL,
+            pool_size=settings.CODE_RUNNER_HTTP_POOL_SIZE,
+            max_in_flight=settings.CODE_RUNNER_MAX_IN_FLIGHT,
+            retries=settings.CODE_RUNNER_RETRIES,
+            breaker=CircuitBreaker(
+                settings.CODE_RUNNER_BREAKER_THRESHOLD, settings.CODE_RUNNER_BREAKER_RESET,
+            ),
+        )
+
+    def execute(self, language, code, stdin_data="", timeout_sec=5):
+        lang = self.lang_map.get(language.lower(), "python3")
+
+        payload = {
+            "language": lang,
+            "version": self.client.runtime_version(lang),
+            "files": [{"name": "main", "content": code}],
+            "stdin": stdin_data or "",
+        }
+
+        try:
+            res = self.client.execute(payload, timeout=timeout_sec + 2)
+
+            # Ensure JSON response
+            if "application/json" not in res.headers.get("Content-Type", ""):
+                raise RunnerUnavailable(f"⚠️ Non-JSON from Piston ({res.status_code}): {res.text[:200]}")
+
+            data = res.json()
+
+            if res.status_code != 200:
+                raise RunnerUnavailable(f"⚠️ Piston API error {res.status_code}: {data}")
+
+            # Defensive key access
+            run_data = data.get("run", {})
+            compile_data = data.get("compile", {})
+
+            # Piston sends the whole output; keep the same amount a local run would
+            stdout, stderr = (_Capture(n) for n in _output_limits(settings.CODE_RUNNER_LIMITS))
+            stdout.add((run_data.get("stdout") or "").encode("utf-8"))
+            stderr.add((run_data.get("stderr") or "").encode("utf-8"))
+            return _captured_result(stdout, stderr, compile_error=compile_data.get("stderr", ""))
+
+        except RunnerUnavailable:
+            # Let the views answer 503 / the grading worker requeue
+            raise
+        except requests.Timeout:
+            return _result(error="⏱️ Timed out.")
+        except requests.RequestException as e:
+            raise RunnerUnavailable(f"🌐 Request error: {e}") from e
+        except Exception as e:
+            # A broken response is the runner's fault, never the program's
+            raise RunnerUnavailable(f"⚠️ Unexpected: {e}") from e
+
+
+# ---------------- LOCAL SANDBOX ---------------- #
+
+# How each language is built and started inside its work directory.
+# "address_space" is off for the JVM, which reserves far more virtual memory
+# than it uses; its heap is capped with -Xmx instead (javac gets the same treatment).
+LANGUAGES = {
+    "python": {
+        "source": "main.py",
+        "compile": None,
+        "run": ["python3", "main.py"],
+    },
+    "c": {
+        "source": "main.c",
+        "compile": ["gcc", "-O2", "-o", "main", "main.c", "-lm"],
+        "run": ["./main"],
+    },
+    "cpp": {
+        "source": "main.cpp",
+        "compile": ["g++", "-O2", "-o", "main", "main.cpp"],
+        "run": ["./main"],
+    },
+    "java": {
+        "source": "Main.java",
+        "compile": ["javac", "Main.java"],
+        "run": ["java", "-Xmx{memory_mb}m", "-cp", ".", "Main"],
+        "address_space": False,
+    },
+}
+LANGUAGE_ALIASES = {"python3": "python", "c++": "cpp"}
+
+COMPILE_TIMEOUT_SEC = 30
+
+
+def get_language(language):
+    """Returns the LANGUAGES key for a language name, defaulting to python like Piston does."""
+    language = (language or "python").lower()
+    language = LANGUAGE_ALIASES.get(language, language)
+    return language if language in LANGUAGES else "python"
+
+
+def _sandbox_env(workdir):
+    return {"PATH": os.environ.get("PATH", "/usr/bin:/bin"), "HOME": workdir, "LANG": "C.UTF-8"}
+
+
+def sandbox_prefix():
+    """The CODE_RUNNER_SANDBOX command as a list of arguments (empty when none is configured)."""
+    return shlex.split(settings.CODE_RUNNER_SANDBOX)
+
+
+def _sandboxed(command, spec, workdir, limits, sandbox, cpu_seconds=None):
+    """
+    The command wrapped in the sandbox and `prlimit`, which sets the rlimits and then
+    execs the program. The sandbox may use {workdir} and any of the limits, e.g. {processes}.
+    """
+    mb = 1024 * 1024
+    cpu = cpu_seconds or limits["cpu_seconds"]
+    rlimits = [f"--cpu={cpu}:{cpu + 1}", f"--fsize={limits['file_size_mb'] * mb}"]
+    if spec.get("address_space", True):
+        rlimits.append(f"--as={limits['memory_mb'] * mb}")
+    prefix = [arg.format(workdir=workdir, **limits) for arg in sandbox]
+    return [*prefix, "prlimit", *rlimits, "--", *(arg.format(**limits) for arg in command)]
+
+
+def _require(command, what):
+    """Raises OSError when the compiler or runtime isn't installed; prlimit would just exit 127."""
+    if not command[0].startswith("./") and shutil.which(command[0]) is None:
+        raise OSError(f"{what} not available: {command[0]}")
+
+
+def _kill_group(proc):
+    try:
+        # Programs run in their own session; kill any children too
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _compile_local(language, code, limits, sandbox):
+    """Writes the source into a fresh work dir and builds it under the sandbox. Returns (workdir, compile_error)."""
+    spec = LANGUAGES[language]
+    workdir = tempfile.mkdtemp(prefix="code_run_")
+
+    with open(os.path.join(workdir, spec["source"]), "w", encoding="utf-8") as f:
+        f.write(code)
+
+    if not spec["compile"]:
+        return workdir, ""
+
+    _require(spec["compile"], "Compiler")
+    command = _sandboxed(spec["compile"], spec, workdir, limits, sandbox, cpu_seconds=COMPILE_TIMEOUT_SEC)
+    try:
+        proc = subprocess.Popen(
+            command, cwd=workdir, env=_sandbox_env(workdir),
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, encoding="utf-8", errors="replace", start_new_session=True,
+        )
+    except FileNotFoundError:
+        raise OSError(f"Sandbox not available: {command[0]}")
+
+    with proc:
+        try:
+            stdout, stderr = proc.communicate(timeout=COMPILE_TIMEOUT_SEC)
+        except subprocess.TimeoutExpired:
+            # The compiler's own children (cc1, as, ld) go too
+            _kill_group(proc)
+            proc.communicate()
+            return workdir, "⏱️ Compilation timed out."
+
+    if proc.returncode != 0:
+        return workdir, stderr or stdout or "Compilation failed."
+    return workdir, ""
+
+
+def _spawn_local(language, workdir, stdin, limits, sandbox):
+    spec = LANGUAGES[language]
+    _require(spec["run"], "Runtime")
+    command = _sandboxed(spec["run"], spec, workdir, limits, sandbox)
+    try:
+        return subprocess.Popen(
+            command, cwd=workdir, env=_sandbox_env(workdir),
+            stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True,
+        )
+    except FileNotFoundError:
+        raise OSError(f"Sandbox not available: {command[0]}")
+
+
+def _collect(proc, timeout_sec, stdout, stderr, on_stdout=None):
+    """
+    Reads the program's stdout / stderr into the captures until it closes them.
+    on_stdout gets every stdout chunk and can return False to stop early.
+    The program is killed when stopped or at the deadline. Returns (timed_out, stopped).
+    """
+    timed_out = stopped = False
+    deadline = time.monotonic() + timeout_sec
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ, stdout)
+        selector.register(proc.stderr, selectors.EVENT_READ, stderr)
+
+        while selector.get_map() and not stopped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, READ_CHUNK)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                # Output past the limit is still read, so the program never blocks on a full pipe
+                key.data.add(chunk)
+                if on_stdout and key.fileobj is proc.stdout and not on_stdout(chunk):
+                    stopped = True
+
+    if stopped or timed_out:
+        _kill_group(proc)
+    proc.wait()
+    return timed_out, stopped
+
+
+def _hit_cpu_limit(proc):
+    # SIGXCPU / SIGKILL (when we didn't kill it) come from the CPU rlimit
+    return proc.returncode in (-signal.SIGXCPU, -signal.SIGKILL)
+
+
+def _run_local(language, workdir, stdin_data, timeout_sec, limits, sandbox):
+    """Runs an already compiled program from its work dir under the rlimits."""
+    stdout, stderr = (_Capture(n) for n in _output_limits(limits))
+
+    # stdin comes from a file, so a large input can't deadlock against unread output
+    with tempfile.TemporaryFile() as stdin:
+        stdin.write((stdin_data or "").encode("utf-8"))
+        stdin.seek(0)
+        proc = _spawn_local(language, workdir, stdin, limits, sandbox)
+        with proc:
+            timed_out, _ = _collect(proc, timeout_sec, stdout, stderr)
+
+    result = _captured_result(stdout, stderr)
+    # Same newlines as text mode pipes gave before
+    result["stdout"] = result["stdout"].replace("\r\n", "\n")
+    result["stderr"] = result["stderr"].replace("\r\n", "\n")
+    if timed_out or _hit_cpu_limit(proc):
+        result["error"] = "⏱️ Timed out."
+    return result
+
+
+def _run_local_checked(language, workdir, stdin_path, expected_path, timeout_sec, limits, sandbox, compare=None):
+    """
+    Runs a compiled program with a file as stdin, comparing stdout against the
+    expected file as it is produced. The program is killed at the first mismatch.
+    """
+    stdout = _Capture(CHECKED_OUTPUT_PREVIEW_BYTES)
+    stderr = _Capture(CHECKED_OUTPUT_PREVIEW_BYTES)
+
+    with open(stdin_path, "rb") as stdin, open_mapped(expected_path) as expected:
+        comparator = make_comparator(expected, **(compare or {}))
+        proc = _spawn_local(language, workdir, stdin, limits, sandbox)
+        with proc:
+            timed_out, mismatch = _collect(proc, timeout_sec, stdout, stderr, on_stdout=comparator.feed)
+
+        result = _captured_result(stdout, stderr)
+        if timed_out or (not mismatch and _hit_cpu_limit(proc)):
+            result["error"] = "⏱️ Timed out."
+        result["passed"] = not mismatch and not result["error"] and comparator.finish()
+        result["difference"] = comparator.difference
+    return result
+
+
+def _execute_local(language, code, stdin_data, timeout_sec, limits, sandbox):
+    """Compile + run in one pool task; the work dir is always removed."""
+    workdir, compile_error = _compile_local(language, code, limits, sandbox)
+    try:
+        if compile_error:
+            return _result(compile_error=compile_error)
+        return _run_local(language, workdir, stdin_data, timeout_sec, limits, sandbox)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class LocalBackend(ExecutionBackend):
+    """Compiles and runs code on this machine in a process pool, under rlimits and the sandbox."""
+
+    supports_streaming = True
+
+    def __init__(self, pool_size=None, limits=None, sandbox=None):
+        self.pool_size = pool_size or settings.CODE_RUNNER_POOL_SIZE
+        self.limits = limits or settings.CODE_RUNNER_LIMITS
+        self.sandbox = sandbox if sandbox is not None else sandbox_prefix()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Created lazily so each gunicorn worker gets its own pool after forking
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            return self._pool
+
+    def _reset_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _submit(self, fn, *args):
+        """
+        Runs fn in the pool. The program's own failures are in the result; a
+        failure of the pool or the sandbox (a crashed worker, a dead forkserver,
+        an OSError setting up the run) raises RunnerUnavailable instead, so it is
+        never recorded as the student's compile error or failed test.
+        """
+        try:
+            return self.pool.submit(fn, *args).result()
+        except BrokenProcessPool as e:
+            self._reset_pool()
+            raise RunnerUnavailable("⚠️ Runner pool crashed, please try again.", retry_after=1) from e
+        except Exception as e:
+            raise RunnerUnavailable(f"⚠️ Code runner failed: {e}") from e
+
+    def execute(self, language, code, stdin_data="", timeout_sec=5):
+        language = get_language(language)
+        return self._submit(_execute_local, language, code, stdin_data, timeout_sec, self.limits, self.sandbox)
+
+    def compile(self, language, code):
+        language = get_language(language)
+        workdir, compile_error = self._submit(_compile_local, language, code, self.limits, self.sandbox)
+        return Program(language, code, workdir, compile_error)
+
+    def run(self, program, stdin_data="", timeout_sec=5):
+        if program.compile_error:
+            return _result(compile_error=program.compile_error)
+        return self._submit(
+            _run_local, program.language, program.workdir, stdin_data, timeout_sec, self.limits, self.sandbox,
+        )
+
+    def run_checked(self, program, stdin_path, expected_path, timeout_sec=5, compare=None):
+        if program.compile_error:
+            return _result(compile_error=program.compile_error)
+        return self._submit(
+            _run_local_checked, program.language, program.workdir,
+            stdin_path, expected_path, timeout_sec, self.limits, self.sandbox, compare,
+        )
+
+    def popen_args(self, program):
+        """
+        Arguments for starting a compiled program directly, with the same sandbox as run().
+        Nothing runs in the child before exec, so it is safe to start from a threaded server.
+        Raises OSError when the runtime isn't installed.
+        """
+        spec = LANGUAGES[program.language]
+        _require(spec["run"], "Runtime")
+        return {
+            "args": _sandboxed(spec["run"], spec, program.workdir, self.limits, self.sandbox),
+            "cwd": program.workdir,
+            "env": _sandbox_env(program.workdir),
+            "start_new_session": True,
+        }
+
+    def release(self, program):
+        if program.workdir:
+            shutil.rmtree(program.workdir, ignore_errors=True)
+
+
+# ---------------- BACKEND SELECTION ---------------- #
+
+BACKENDS = {
+    "piston": "User.execution.PistonBackend",
+    "local": "User.execution.LocalBackend",
+}
+
+
+@lru_cache(maxsize=None)
+def get_backend(name=None):
+    """
+    Returns the configured backend; accepts an alias from BACKENDS or a dotted path.
+    It is wrapped so every runner call is timed and its errors counted (see metrics.py).
+    """
+    name = name or settings.CODE_RUNNER_BACKEND
+    return MeteredBackend(import_string(BACKENDS.get(name, name))())
+
+
+def execute_source(language, source_path, stdin_data="", timeout_sec=5, use_cache=True, slot_kind=None):
+    """
+    Executes a source file with the configured backend and always returns JSON-safe output.
+    Results are served from the execution cache unless use_cache is False.
+    With slot_kind, the runner call (not a cache hit) holds a runner slot of that kind.
+    """
+    with open(source_path, "r", encoding="utf-8") as f:
+        code = f.read()
+
+    backend = get_backend()
+
+    def run():
+        if slot_kind is None:
+            return backend.execute(language, code, stdin_data=stdin_data, timeout_sec=timeout_sec)
+        with runner_slot(slot_kind):
+            return backend.execute(language, code, stdin_data=stdin_data, timeout_sec=timeout_sec)
+
+    if not use_cache:
+        return run()
+    key = result_key(language, code, stdin_data, timeout_sec)
+    return cached_run(key, run, wait_sec=timeout_sec + COMPILE_TIMEOUT_SEC)
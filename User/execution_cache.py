@@ -0,0 +1,123 @@
+"""
+Content-addressed cache of execution results.
+
+Results are keyed by backend, language, time limit and the hashes of the
+source and stdin, so pressing Run/Check again on unchanged code never reaches
+the runner. Entries live in the 'execution' cache (local memory or Redis) with
+a TTL; both evict least-recently-used entries when full.
+
+Identical requests that arrive together are coalesced: one caller runs the
+code while the others wait for its result, first within this process and
+then across processes through a short-lived lock key in the shared cache.
+"""
+
+import hashlib, threading, time
+
+from django.conf import settings
+from django.core.cache import caches
+
+LOCK_POLL_SEC = 0.1
+
+
+def _cache():
+    return caches["execution"]
+
+
+def _sha256(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def result_key(language, code, stdin_data, timeout_sec):
+    return "run:{}:{}:{}:{}:{}".format(
+        settings.CODE_RUNNER_BACKEND, (language or "").lower(), timeout_sec,
+        _sha256(code), _sha256(stdin_data),
+    )
+
+
+def is_cacheable(result):
+    """Runner failures (timeouts, network errors) are retried, and huge outputs aren't worth storing."""
+    if result.get("error"):
+        return False
+    size = len(result.get("stdout") or "") + len(result.get("stderr") or "")
+    return size <= settings.EXECUTION_CACHE_MAX_BYTES
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_cached_results(keys):
+    """Returns {key: result} for the keys already in the cache."""
+    if not settings.EXECUTION_CACHE_ENABLED:
+        return {}
+    return _cache().get_many(keys)
+
+
+def cached_run(key, run, wait_sec=10):
+    """
+    Returns the cached result for key, or calls run() to produce it.
+    Concurrent callers with the same key share a single call to run().
+    """
+    if not settings.EXECUTION_CACHE_ENABLED:
+        return run()
+
+    cache = _cache()
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    # Coalesce within this process
+    with _in_flight_lock:
+        flight = _in_flight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _in_flight[key] = _InFlight()
+
+    if not leader:
+        if flight.done.wait(wait_sec) and flight.result is not None:
+            return flight.result
+        return run()
+
+    try:
+        flight.result = _run_once_across_processes(cache, key, run, wait_sec)
+        return flight.result
+    finally:
+        flight.done.set()
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+
+def _run_once_across_processes(cache, key, run, wait_sec):
+    lock_key = f"{key}:lock"
+    owns_lock = cache.add(lock_key, 1, timeout=wait_sec)
+
+    # Another worker is already running this exact input; wait for its result. When it
+    # lets go of the lock without one (the result wasn't cacheable), take over at once
+    deadline = time.monotonic() + wait_sec
+    while not owns_lock and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_SEC)
+        found = cache.get_many([key, lock_key])
+        if key in found:
+            return found[key]
+        if lock_key not in found and cache.add(lock_key, 1, timeout=wait_sec):
+            owns_lock = True
+            # The leader may have stored it between the two reads above
+            result = cache.get(key)
+            if result is not None:
+                cache.delete(lock_key)
+                return result
+
+    try:
+        result = run()
+        if is_cacheable(result):
+            cache.set(key, result)
+        return result
+    finally:
+        if owns_lock:
+            cache.delete(lock_key)
@@ -0,0 +1,118 @@
+"""
+CSV exports for the report page: class roster, submissions and per-problem scores.
+
+Rows are generated from querysets read with .iterator(chunk_size=...) and
+written straight into a StreamingHttpResponse, so memory use doesn't depend
+on how many rows a class has and the download starts right away.
+"""
+
+import csv
+from itertools import chain
+
+from django.db.models import Count, Q, Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Problem, StudentProblemResult, Submission, User
+
+EXPORT_CHUNK_SIZE = 2000
+# Spreadsheet apps run cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each formatted row back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if hasattr(value, "tzinfo"):
+        return timezone.localtime(value).strftime("%Y-%m-%d %H:%M")
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_response(rows, filename):
+    writer = csv.writer(_Echo())
+    # The BOM makes Excel open the file as UTF-8
+    lines = chain(["﻿"], (writer.writerow([_cell(value) for value in row]) for row in rows))
+    response = StreamingHttpResponse(lines, content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _students(klass):
+    return User.objects.filter(user_type__iexact="student", enrollment__class_id=klass).order_by("school_id")
+
+
+def roster_rows(klass):
+    yield ["School ID", "First Name", "Last Name", "Problems Answered", "Best Total"]
+    in_class = Q(problem_results__problem_id__class_id=klass)
+    students = _students(klass).annotate(
+        answered=Count("problem_results", filter=in_class),
+        best_total=Sum("problem_results__best_score", filter=in_class),
+    ).values_list("school_id", "first_name", "last_name", "answered", "best_total")
+    for school_id, first_name, last_name, answered, best_total in students.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [school_id, first_name, last_name, answered, best_total or 0]
+
+
+def submission_rows(klass):
+    yield [
+        "Submission ID", "School ID", "Student Name", "Problem", "Language", "Status",
+        "Score", "Passed Cases", "Total Cases", "Submitted At", "Graded At", "Code",
+    ]
+    submissions = (
+        Submission.objects.filter(problem_id__class_id=klass)
+        .order_by("submission_id")
+        .values_list(
+            "submission_id", "student_id", "student_id__first_name", "student_id__last_name",
+            "problem_id__problem_title", "language", "status", "score", "passed_cases", "total_cases",
+            "submitted_at", "graded_at", "code",
+        )
+    )
+    for row in submissions.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        submission_id, school_id, first_name, last_name, *rest = row
+        yield [submission_id, school_id, f"{first_name} {last_name}", *rest]
+
+
+def score_rows(klass):
+    """One row per student with their best score on each problem."""
+    problems = list(Problem.objects.filter(class_id=klass).order_by("problem_id").values_list("problem_id", "problem_title"))
+    yield ["School ID", "Student Name", *(title for _, title in problems), "Total"]
+
+    # Both querysets are ordered by student in the database, and results are filtered exactly
+    # like _students(), so every result belongs to a listed student and they merge in one pass
+    students = _students(klass).values_list("school_id", "first_name", "last_name")
+    results = (
+        StudentProblemResult.objects.filter(
+            problem_id__class_id=klass,
+            student_id__user_type__iexact="student",
+            student_id__enrollment__class_id=klass,
+        )
+        .order_by("student_id", "problem_id")
+        .values_list("student_id", "problem_id", "best_score")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    result = next(results, None)
+    for school_id, first_name, last_name in students.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        scores = {}
+        while result is not None and result[0] == school_id:
+            scores[result[1]] = result[2]
+            result = next(results, None)
+        yield [
+            school_id, f"{first_name} {last_name}",
+            *(scores.get(problem_id, "") for problem_id, _ in problems),
+            sum(scores.values()),
+        ]
+
+
+EXPORTS = {
+    "roster": roster_rows,
+    "submissions": submission_rows,
+    "scores": score_rows,
+}
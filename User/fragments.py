@@ -0,0 +1,58 @@
+"""
+Version tokens for the cached template fragments: the class cards on the
+dashboards and class lists, and the profile block in the sidebars.
+
+The fragments use {% cache %} with these tokens in their keys (see
+versioning.py):
+
+    classes:<school_id>   which classes a user teaches or is enrolled in
+    class:<class_id>      what a class card shows: the class and its problem count
+    user:<school_id>      the user's name and picture
+
+signals.py replaces them on post_save/post_delete of Class, Enrollment,
+Problem and User. The class IDs behind a user's list are cached under their
+classes token, so a page whose fragments are cached runs no class queries at
+all. Without VERSIONED_CACHES the fragments are rendered every time (a
+{% cache %} timeout of 0 stores nothing) and no tokens are looked up.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from .models import Class, Enrollment
+from .versioning import get_version, get_versions
+
+
+def class_ids(school_id):
+    """IDs of the classes a user teaches or is enrolled in, cached until their classes token changes."""
+    version = get_version(f"classes:{school_id}")
+    key = f"class_ids:{school_id}:{version}"
+    ids = cache.get(key)
+    if ids is None:
+        taught = Class.objects.filter(teacher_id=school_id).values_list("class_id", flat=True)
+        enrolled = Enrollment.objects.filter(student_id=school_id).values_list("class_id", flat=True)
+        ids = sorted(set(taught) | set(enrolled))
+        cache.set(key, ids, timeout=settings.FRAGMENT_CACHE_TTL)
+    return version, ids
+
+
+def class_list_version(school_id):
+    """One token for a user's class cards: changes when their classes, or anything shown on them, change."""
+    version, ids = class_ids(school_id)
+    versions = get_versions([f"class:{class_id}" for class_id in ids])
+    return ":".join([version, *versions.values()])
+
+
+def fragment_versions(request):
+    """Context processor: the fragment TTL and lazy version tokens for the logged-in user."""
+    if not settings.VERSIONED_CACHES:
+        return {"fragment_ttl": 0}
+    school_id = request.session.get("school_id") if hasattr(request, "session") else None
+    if not school_id:
+        return {"fragment_ttl": settings.FRAGMENT_CACHE_TTL}
+    return {
+        "fragment_ttl": settings.FRAGMENT_CACHE_TTL,
+        "user_version": SimpleLazyObject(lambda: get_version(f"user:{school_id}")),
+        "class_list_version": SimpleLazyObject(lambda: class_list_version(school_id)),
+    }
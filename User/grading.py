@@ -0,0 +1,372 @@
+"""
+Runs a submission against a problem's test cases.
+
+The code is compiled once and the same build is reused for every test case,
+so C/C++/Java submissions don't pay for a full compile per case. Test cases
+run concurrently, bounded per submission and per process. Each runner call
+(the compile and every test case run) takes its own slot from the global cap
+in throttling.py, so the cap counts runner calls, not submissions.
+
+Output is checked with the problem's comparator (comparators.py). Test
+cases stored as files (see testdata.py) are streamed through the backend's
+run_checked(), which compares as the output arrives; inline cases are
+compared here once the run finishes.
+
+Submissions are graded off the request path: submit_problem saves them as
+Pending and the grade_worker management command claims and grades them.
+
+Each test case's outcome is kept as a SubmissionCaseResult along with a hash
+of the case content and comparator, so grading a submission again (see
+regrade.py) only reruns the cases that changed or ended in an error.
+"""
+
+import hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .execution import COMPILE_TIMEOUT_SEC, get_backend, stdout_truncated, truncation_note
+from .comparators import compare_output
+from .execution_cache import cached_run, get_cached_results, result_key
+from .models import ProblemTestCase, Submission, SubmissionCaseResult
+from .testdata import testdata_path
+from .results import rebuild_result, record_grade
+from .runner_client import RunnerUnavailable
+from .throttling import GRADING, Throttled, runner_slot
+
+
+# Failed-case stdout kept in SubmissionCaseResult and shown in the summary
+CASE_OUTPUT_PREVIEW_CHARS = 4000
+
+
+def is_hidden_case(i, total_cases):
+    """The last test case is hidden from students."""
+    return i == total_cases
+
+
+def _compare_key(compare):
+    return ":".join(f"{k}={v}" for k, v in sorted((compare or {}).items()))
+
+
+def check_hash(tc, compare):
+    """What a case result was checked against: the test case content and the comparator."""
+    content = tc.content_hash or tc.compute_content_hash()
+    return hashlib.sha256(f"{content}:{_compare_key(compare)}".encode()).hexdigest()
+
+
+_global_runs = None
+_global_runs_lock = threading.Lock()
+
+
+def _global_run_slots():
+    """Caps test-case runs in flight across all submissions graded by this process."""
+    global _global_runs
+    with _global_runs_lock:
+        if _global_runs is None:
+            _global_runs = threading.BoundedSemaphore(settings.GRADING_MAX_CONCURRENT_RUNS)
+        return _global_runs
+
+
+def run_test_cases(language, code, test_cases, timeout_sec=5, use_cache=True, compare=None, slot_kind=GRADING):
+    """
+    Compiles the code once and runs it against every test case, up to
+    GRADING_MAX_PARALLEL_CASES at a time. Returns (compile_error, results) with one
+    execute_source-style dict per test case, in test case order; on a compile
+    error the results list is empty. Every runner call takes a slot_kind runner
+    slot; Throttled is raised when none frees up in time.
+
+    Cached results are reused, and when every test case is cached the code is not compiled at all.
+    """
+    stdins = [None if tc.is_stored else (tc.input_data or "").strip() + "\n" for tc in test_cases]
+    keys = [
+        _case_key(language, code, tc, stdin_data, timeout_sec, compare)
+        for tc, stdin_data in zip(test_cases, stdins)
+    ]
+    cached = get_cached_results(keys) if use_cache else {}
+
+    if test_cases and all(key in cached for key in keys):
+        results = [cached[key] for key in keys]
+        compile_error = _compile_error_of(results)
+        return compile_error, [] if compile_error else results
+
+    backend = get_backend()
+    with runner_slot(slot_kind):
+        program = backend.compile(language, code)
+    slots = _global_run_slots()
+
+    def run_one(i):
+        if keys[i] in cached:
+            return cached[keys[i]]
+
+        def run():
+            with slots, runner_slot(slot_kind):
+                tc = test_cases[i]
+                if tc.is_stored:
+                    return backend.run_checked(
+                        program, testdata_path(tc.input_file.name), testdata_path(tc.output_file.name),
+                        timeout_sec=timeout_sec, compare=compare,
+                    )
+                return backend.run(program, stdin_data=stdins[i], timeout_sec=timeout_sec)
+
+        if not use_cache:
+            return run()
+        return cached_run(keys[i], run, wait_sec=timeout_sec + COMPILE_TIMEOUT_SEC)
+
+    try:
+        if program.compile_error or not test_cases:
+            return program.compile_error, []
+
+        workers = min(settings.GRADING_MAX_PARALLEL_CASES, len(test_cases))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_one, range(len(test_cases))))
+
+        compile_error = _compile_error_of(results)
+        return compile_error, [] if compile_error else results
+    finally:
+        backend.release(program)
+
+
+def _case_key(language, code, tc, stdin_data, timeout_sec, compare):
+    if tc.is_stored:
+        # Stored files are named by their hash; the result also depends on the expected output and comparator
+        stdin_data = f"stored:{tc.input_file.name}:{tc.output_file.name}:{_compare_key(compare)}"
+    return result_key(language, code, stdin_data, timeout_sec)
+
+
+def check_case(tc, exec_res, compare=None):
+    """
+    Returns (passed, difference) for a run of a test case; difference describes the
+    first differing line. Stored cases were already checked by the runner.
+    """
+    if "passed" in exec_res:
+        return exec_res["passed"], exec_res.get("difference")
+    if stdout_truncated(exec_res):
+        # Test cases this big are stored as files, so a cut-off output can't be right
+        return False, f"output is {exec_res['stdout_bytes']} bytes, over the output limit"
+    return compare_output(tc.expected_output or "", exec_res.get("stdout") or "", **(compare or {}))
+
+
+def _compile_error_of(results):
+    # Backends that build on every run only report the compile error per result
+    for exec_res in results:
+        if exec_res.get("compile_error"):
+            return exec_res["compile_error"]
+    return ""
+
+
+def _case_result(tc, exec_res, compare):
+    """An unsaved SubmissionCaseResult for one run of a test case."""
+    result = SubmissionCaseResult(testcase_id=tc, check_hash=check_hash(tc, compare))
+    error = exec_res.get("error") or exec_res.get("stderr")
+    if error:
+        result.error = error
+        return result
+
+    result.passed, difference = check_case(tc, exec_res, compare)
+    result.difference = difference or ""
+    if not result.passed:
+        output = (exec_res.get("stdout") or "").strip()
+        if len(output) > CASE_OUTPUT_PREVIEW_CHARS:
+            output = output[:CASE_OUTPUT_PREVIEW_CHARS] + "…"
+        result.output = output + truncation_note(exec_res)
+    return result
+
+
+def _is_reusable(result):
+    # A timeout, a runner failure or a crash may not happen again, so those cases are always rerun
+    return not result.error
+
+
+def _reuse_result(result, tc):
+    """A copy of an earlier case result for a test case with the same check hash."""
+    return SubmissionCaseResult(
+        testcase_id=tc, check_hash=result.check_hash, passed=result.passed,
+        error=result.error, output=result.output, difference=result.difference,
+    )
+
+
+def _summary_line(i, total_cases, tc, result):
+    if result.error:
+        return f"❌ Test {i}: Error\n{result.error}"
+
+    # ✅ Hidden test case logic
+    if is_hidden_case(i, total_cases):
+        return f"✅ Test {i}: Passed (Hidden Case)" if result.passed else f"❌ Test {i}: Failed (Hidden Case)"
+    if result.passed:
+        return f"✅ Test {i}: Passed"
+
+    raw_input = (tc.input_data or "").strip()
+    expected = (tc.expected_output or "").strip()
+    return (
+        f"❌ Test {i}: Failed\nInput: {raw_input}\nExpected: {expected}\nGot: {result.output}"
+        + (f"\nFirst difference: {result.difference}" if result.difference else "")
+    )
+
+
+def grade_code(language, code, test_cases, compare=None, known=None):
+    """
+    Runs the code against the test cases and scores it (10 points per passed case).
+    compare holds the problem's comparator options. known maps check hashes to
+    case results from an earlier run of the same code; those cases aren't run again.
+    Returns a dict with score, passed_cases, total_cases, result_summary and
+    case_results (unsaved, one per test case; empty on a compile error).
+    """
+    known = known or {}
+    total_cases = len(test_cases)
+    hashes = [check_hash(tc, compare) for tc in test_cases]
+    to_run = [(tc, h) for tc, h in zip(test_cases, hashes) if h not in known]
+
+    # Compile once; a compile error is reported once instead of per test case
+    compile_error, exec_results = "", []
+    if to_run:
+        compile_error, exec_results = run_test_cases(language, code, [tc for tc, _ in to_run], compare=compare)
+
+    case_results = []
+    if compile_error:
+        results = [f"❌ Compilation Error\n{compile_error}"]
+    else:
+        fresh = {h: _case_result(tc, exec_res, compare) for (tc, h), exec_res in zip(to_run, exec_results)}
+        for tc, h in zip(test_cases, hashes):
+            case_results.append(fresh[h] if h in fresh else _reuse_result(known[h], tc))
+        results = [
+            _summary_line(i, total_cases, tc, result)
+            for i, (tc, result) in enumerate(zip(test_cases, case_results), start=1)
+        ]
+
+    passed_cases = sum(result.passed for result in case_results)
+    score = passed_cases * 10
+    result_summary = "\n".join(results) + f"\n\n{passed_cases}/{total_cases} test cases passed. Score: {score}"
+    return {
+        "score": score,
+        "passed_cases": passed_cases,
+        "total_cases": total_cases,
+        "result_summary": result_summary,
+        "case_results": case_results,
+    }
+
+
+def grade_submission(submission, test_cases=None, memo=None, requeue=True):
+    """
+    Grades a saved submission and writes the score back. Case results from its
+    last grading are reused where the test case and comparator haven't changed.
+    memo (check hash -> case result) is shared between submissions with identical
+    code, so a regrade runs each changed case once per distinct program.
+    Raises RunnerUnavailable or Throttled when the runner can't take work, after
+    requeueing the submission, or with requeue=False (no grade_worker to pick it
+    up) after marking it Error.
+    """
+    if test_cases is None:
+        test_cases = list(ProblemTestCase.objects.filter(problem_id=submission.problem_id_id).order_by("testcase_id"))
+    compare = submission.problem_id.compare_options()
+    previous = list(submission.case_results.all())
+    known = {result.check_hash: result for result in previous if _is_reusable(result)}
+    if memo is not None:
+        known.update(memo)
+    regrading = submission.graded_at is not None
+
+    try:
+        graded = grade_code(submission.language, submission.code, test_cases, compare, known)
+    except (RunnerUnavailable, Throttled) as e:
+        if requeue:
+            # Not the student's fault: put it back in the queue
+            requeue_submission(submission)
+            raise
+        submission.status = Submission.ERROR
+        submission.result_summary = f"{e} Please submit again."
+        _save_grade(submission, previous, None, regrading)
+        raise
+    except Exception as e:
+        graded = None
+        submission.status = Submission.ERROR
+        submission.result_summary = f"⚠️ Grading failed: {e}"
+    else:
+        submission.status = Submission.GRADED
+        submission.score = graded["score"]
+        submission.passed_cases = graded["passed_cases"]
+        submission.total_cases = graded["total_cases"]
+        submission.result_summary = graded["result_summary"]
+        if memo is not None:
+            memo.update((result.check_hash, result) for result in graded["case_results"] if _is_reusable(result))
+
+    _save_grade(submission, previous, graded, regrading)
+    return submission
+
+
+def _save_grade(submission, previous, graded, regrading):
+    submission.graded_at = timezone.now()
+    with transaction.atomic():
+        submission.save(update_fields=[
+            "status", "score", "passed_cases", "total_cases", "result_summary", "graded_at",
+        ])
+        if graded is not None:
+            _save_case_results(submission, previous, graded["case_results"])
+
+    if regrading:
+        # The score may have gone down, which record_grade never applies to the best score
+        rebuild_result(submission.student_id_id, submission.problem_id_id)
+    else:
+        record_grade(submission)
+
+
+def _save_case_results(submission, previous, case_results):
+    """Replaces the submission's case results, leaving rows that didn't change alone."""
+    def key(result):
+        return result.testcase_id_id, result.check_hash
+
+    current = {key(result) for result in case_results}
+    # Errored cases were rerun, so their rows are replaced even when the key is the same
+    unchanged = {key(result) for result in previous if key(result) in current and _is_reusable(result)}
+    stale = [result.pk for result in previous if key(result) not in unchanged]
+    if stale:
+        SubmissionCaseResult.objects.filter(pk__in=stale).delete()
+
+    new = [result for result in case_results if key(result) not in unchanged]
+    for result in new:
+        result.submission_id = submission
+    SubmissionCaseResult.objects.bulk_create(new)
+
+
+def requeue_submission(submission):
+    submission.status = Submission.PENDING
+    submission.claimed_at = None
+    submission.save(update_fields=["status", "claimed_at"])
+
+
+def claim_pending_submissions(batch_size=1):
+    """
+    Marks up to batch_size queued submissions as Running and returns them.
+    SKIP LOCKED lets any number of workers poll the same table without
+    grading a submission twice. Running rows whose worker died are picked up
+    again after GRADING_CLAIM_TIMEOUT seconds.
+
+    New submissions are claimed first, then stale claims, then regrades
+    (queued rows that were graded before, see regrade.queue_regrade), so a
+    regrade backlog never holds up students waiting for a score.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.GRADING_CLAIM_TIMEOUT)
+    queues = [
+        Q(status=Submission.PENDING, graded_at__isnull=True),
+        Q(status=Submission.RUNNING, claimed_at__lt=stale),
+        Q(status=Submission.PENDING, graded_at__isnull=False),
+    ]
+
+    with transaction.atomic():
+        ids = []
+        for queue in queues:
+            if len(ids) >= batch_size:
+                break
+            ids += (
+                Submission.objects.select_for_update(skip_locked=True)
+                .filter(queue)
+                .order_by("submission_id")
+                .values_list("submission_id", flat=True)[:batch_size - len(ids)]
+            )
+        Submission.objects.filter(submission_id__in=ids).update(status=Submission.RUNNING, claimed_at=now)
+
+    claimed = Submission.objects.in_bulk(ids)
+    return [claimed[pk] for pk in ids]
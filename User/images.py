@@ -0,0 +1,218 @@
+"""
+Resized variants of uploaded profile pictures and class icons.
+
+Uploads from sign-up and class creation are checked on the request from the
+image header only (format and pixel count) and saved as they are. Once the
+transaction commits, a small thread pool does the rest off the request path:
+
+- the original is re-encoded without its EXIF/XMP metadata, after applying
+  the EXIF orientation and scaling it down to IMAGE_MAX_DIMENSION
+- fixed-size WebP and JPEG variants are written next to it
+
+Files are never rewritten in place. The processed original gets a new random
+token, the field is pointed at it and the upload is deleted:
+
+    profile_pic/photo_Ab12Cd34Ef.png          upload, until processed
+    profile_pic/photo_Xy98Zw76Vu.png          processed original
+    profile_pic/photo_Xy98Zw76Vu.sm.webp
+    profile_pic/photo_Xy98Zw76Vu.sm.jpg
+    ...
+
+The sizes that were written are saved in the model's <field>_variants. Until
+then, variant_url() falls back to the original.
+"""
+
+import os, re, shutil, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.crypto import get_random_string
+from PIL import Image, ImageOps
+
+ALLOWED_FORMATS = {"JPEG", "PNG", "GIF", "WEBP"}
+# Variant sizes (longest side in pixels) per image field; profile pictures are cropped square
+VARIANT_SIZES = {
+    "user_image": {"sm": 96, "md": 256},
+    "upload_icon": {"sm": 200, "md": 400},
+}
+SQUARE_FIELDS = {"user_image"}
+# Shared defaults given to accounts without an upload; templates show their static placeholder instead
+PLACEHOLDER_IMAGES = {"profile_pic/default.png", "profile_pic/image.png"}
+# (extension, Pillow format), best first
+VARIANT_FORMATS = [("webp", "WEBP"), ("jpg", "JPEG")]
+# The random token models._random_name puts at the end of an upload's name
+TOKEN_RE = re.compile(r"_[A-Za-z0-9]{10}$")
+
+
+class ImageUploadError(ValueError):
+    """The uploaded image is rejected; the message is shown to the user."""
+
+
+def check_image(upload):
+    """Reads the image header and rejects files that aren't images of an allowed format and size."""
+    try:
+        with Image.open(upload) as img:
+            image_format, (width, height) = img.format, img.size
+    except (OSError, Image.DecompressionBombError):
+        raise ImageUploadError("The uploaded file is not an image.")
+    finally:
+        upload.seek(0)
+
+    if image_format not in ALLOWED_FORMATS:
+        raise ImageUploadError("Images must be JPEG, PNG, GIF or WebP files.")
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ImageUploadError("The image is too large.")
+
+
+def variant_name(name, size, extension):
+    root, _ = os.path.splitext(name)
+    return f"{root}.{size}.{extension}"
+
+
+def processed_name(name):
+    """A name for the processed copy of an image: the same base with a new random token."""
+    root, extension = os.path.splitext(name)
+    return f"{TOKEN_RE.sub('', root)}_{get_random_string(10)}{extension}"
+
+
+def has_variant(image, size):
+    """Whether the variants of a (non-empty) image field file have been written."""
+    return size in (getattr(image.instance, f"{image.field.name}_variants", None) or [])
+
+
+def variant_url(image, size, extension="jpg"):
+    """
+    URL of an image field's variant, falling back to the original while the
+    variants are not written yet. Returns "" for an empty field.
+    """
+    if not image:
+        return ""
+    if not has_variant(image, size):
+        return image.url
+    return image.storage.url(variant_name(image.name, size, extension))
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix="images")
+        return _pool
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def schedule_variants(instance, field_name):
+    """Processes the instance's image in the background once the current transaction commits."""
+    model, pk = type(instance), instance.pk
+
+    def run():
+        try:
+            process_image(model, pk, field_name)
+        finally:
+            # Each pool thread has its own connection
+            connections.close_all()
+
+    transaction.on_commit(lambda: _executor().submit(run))
+
+
+def _save_image(img, path, image_format):
+    """Writes the image without metadata, replacing any file at path atomically."""
+    options = {"quality": settings.IMAGE_QUALITY} if image_format in ("JPEG", "WEBP") else {}
+    if image_format == "JPEG":
+        options["optimize"] = True
+        img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+        img = img.convert("RGBA")
+
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=".image-", delete=False) as tmp:
+        try:
+            img.save(tmp, format=image_format, **options)
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+    os.replace(tmp.name, path)
+
+
+def _flatten(img):
+    """JPEG has no transparency, so transparent images are put on a white background."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def write_variants(path, target, field_name):
+    """
+    Writes the original at path, stripped, to target and the variants next to
+    target. Returns the sizes written.
+    """
+    with Image.open(path) as img:
+        image_format = img.format
+        animated = getattr(img, "is_animated", False)
+        img.seek(0)
+        original = ImageOps.exif_transpose(img)
+
+    max_dimension = settings.IMAGE_MAX_DIMENSION
+    if original.width > max_dimension or original.height > max_dimension:
+        original.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    # Animated GIFs and WebPs are kept as uploaded rather than reduced to their first frame
+    if animated:
+        shutil.copyfile(path, target)
+    else:
+        _save_image(original, target, image_format)
+
+    sizes = VARIANT_SIZES[field_name]
+    flat = _flatten(original)
+    for size, pixels in sizes.items():
+        if field_name in SQUARE_FIELDS:
+            resized = ImageOps.fit(flat, (pixels, pixels), Image.Resampling.LANCZOS)
+        else:
+            resized = flat.copy()
+            resized.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+        for extension, variant_format in VARIANT_FORMATS:
+            _save_image(resized, variant_name(target, size, extension), variant_format)
+    return list(sizes)
+
+
+def _delete_image(storage, name, sizes):
+    """Deletes an image file and the variants written for it."""
+    names = [name] + [variant_name(name, size, extension) for size in sizes for extension, _ in VARIANT_FORMATS]
+    for path in names:
+        storage.delete(path)
+
+
+def process_image(model, pk, field_name):
+    """
+    Writes the processed copy and variants of one saved image under a new
+    name, points the row at it and deletes the previous files.
+    """
+    instance = model.objects.filter(pk=pk).first()
+    image = getattr(instance, field_name, None)
+    # The shared defaults are never renamed or deleted
+    if not image or image.name in PLACEHOLDER_IMAGES:
+        return
+    name, old_sizes = image.name, getattr(instance, f"{field_name}_variants") or []
+    new_name = processed_name(name)
+
+    try:
+        sizes = write_variants(image.path, image.storage.path(new_name), field_name)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Unreadable or missing file: the templates keep using the original
+        _delete_image(image.storage, new_name, VARIANT_SIZES[field_name])
+        return
+
+    # Skip the update if the image was replaced while this one was processed
+    instance.refresh_from_db(fields=[field_name])
+    if getattr(instance, field_name).name != name:
+        _delete_image(image.storage, new_name, sizes)
+        return
+    setattr(instance, field_name, new_name)
+    setattr(instance, f"{field_name}_variants", sizes)
+    instance.save(update_fields=[field_name, f"{field_name}_variants"])
+    _delete_image(image.storage, name, old_sizes)
@@ -0,0 +1,65 @@
+import time, tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from User.comparators import COMPARATORS, make_comparator
+
+
+def _make_output(size, one_line=False):
+    """
+    About `size` bytes of lines of integers and floats, the kind of output graders see,
+    or all on one space-separated line (a program printing a whole array at once).
+    """
+    lines, total, i = [], 0, 0
+    end = " " if one_line else "\n"
+    while total < size:
+        line = f"{i} {i * 0.5:.6f} {i * 7 % 1000}{end}".encode()
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return b"".join(lines)
+
+
+def _compare(output, mode, chunk):
+    comparator = make_comparator(output, mode)
+    for offset in range(0, len(output), chunk):
+        if not comparator.feed(output[offset:offset + chunk]):
+            break
+    return comparator.finish()
+
+
+class Command(BaseCommand):
+    help = (
+        "Times each output comparator on a large matching output, fed in chunks as the runner does: "
+        "once as many lines and once as a single line."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mb", type=int, default=64, help="Size of the output in MB.")
+        parser.add_argument("--chunk", type=int, default=4096, help="Bytes per feed() call.")
+
+    def handle(self, *args, **options):
+        chunk = options["chunk"]
+        for one_line in (False, True):
+            output = _make_output(options["mb"] * 1024 * 1024, one_line=one_line)
+            self._bench(output, chunk, "one line" if one_line else "lines")
+
+    def _bench(self, output, chunk, shape):
+        size_mb = len(output) / (1024 * 1024)
+        self.stdout.write(f"{size_mb:.1f} MB as {shape}, {chunk} byte chunks")
+
+        for mode in COMPARATORS:
+            start = time.perf_counter()
+            passed = _compare(output, mode, chunk)
+            elapsed = time.perf_counter() - start
+
+            # Measured on a second run; tracing allocations slows the comparators down a lot
+            tracemalloc.start()
+            _compare(output, mode, chunk)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.stdout.write(
+                f"{mode:<20} {'ok' if passed else 'FAILED':<7} {elapsed:7.2f}s "
+                f"{size_mb / elapsed:8.1f} MB/s  peak {peak / 1024:,.0f} KB"
+            )
@@ -0,0 +1,23 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from whitenoise.compress import Compressor
+
+from User.media import is_private_media
+
+
+class Command(BaseCommand):
+    help = "Writes .gz (and .br, with brotli installed) copies of compressible media files for the media middleware to serve."
+
+    def handle(self, *args, **options):
+        compressor = Compressor(quiet=True)
+        written = 0
+        for root, dirs, files in os.walk(settings.MEDIA_ROOT):
+            for name in files:
+                path = os.path.join(root, name)
+                if is_private_media(os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, "/")):
+                    continue
+                if compressor.should_compress(name):
+                    written += sum(1 for _ in compressor.compress(path))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} compressed files."))
@@ -0,0 +1,53 @@
+import signal, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from User.grading import claim_pending_submissions, grade_submission, requeue_submission
+from User.runner_client import RunnerUnavailable
+from User.throttling import Throttled
+
+
+class Command(BaseCommand):
+    help = "Grades queued submissions. Run as many workers as needed, on any number of nodes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=1, help="Submissions to claim per poll.")
+        parser.add_argument("--once", action="store_true", help="Grade what is queued, then exit.")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.stdout.write("Grading worker started.")
+        while not self.stopping:
+            close_old_connections()
+            submissions = claim_pending_submissions(options["batch"])
+
+            if not submissions:
+                if options["once"]:
+                    break
+                time.sleep(settings.GRADING_POLL_INTERVAL)
+                continue
+
+            for i, submission in enumerate(submissions):
+                try:
+                    grade_submission(submission)
+                except (RunnerUnavailable, Throttled) as e:
+                    # Hand the rest of the batch back and wait for the runner to recover
+                    for rest in submissions[i + 1:]:
+                        requeue_submission(rest)
+                    self.stderr.write(f"{e} Retrying in {e.retry_after}s.")
+                    time.sleep(e.retry_after)
+                    break
+                self.stdout.write(
+                    f"Graded submission {submission.submission_id}: {submission.status}, score {submission.score}"
+                )
+
+        self.stdout.write("Grading worker stopped.")
+
+    def stop(self, signum, frame):
+        # Finish the submission in hand, then exit
+        self.stopping = True
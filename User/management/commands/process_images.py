@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from User.images import PLACEHOLDER_IMAGES, process_image
+from User.models import Class, User
+
+IMAGE_FIELDS = [(User, "user_image"), (Class, "upload_icon")]
+
+
+class Command(BaseCommand):
+    help = "Strips metadata from uploaded profile pictures and class icons and writes their resized variants."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Also redo images that already have variants.")
+
+    def handle(self, *args, **options):
+        for model, field_name in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{f"{field_name}__in": ["", *PLACEHOLDER_IMAGES]}).exclude(
+                **{f"{field_name}__isnull": True}
+            ).values_list("pk", f"{field_name}_variants")
+
+            processed = 0
+            for pk, variants in rows.iterator():
+                if variants and not options["all"]:
+                    continue
+                process_image(model, pk, field_name)
+                processed += 1
+            self.stdout.write(f"{model.__name__}.{field_name}: processed {processed} images.")
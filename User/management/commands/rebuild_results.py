@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from User.models import Submission
+from User.results import rebuild_results
+
+
+class Command(BaseCommand):
+    help = "Recomputes the per-student, per-problem results table from the Submission rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--class-id", type=int, help="Only rebuild results for this class.")
+
+    def handle(self, *args, **options):
+        submissions = Submission.objects.all()
+        if options["class_id"]:
+            submissions = submissions.filter(problem_id__class_id=options["class_id"])
+
+        written = rebuild_results(submissions)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} results."))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from User.models import Problem
+from User.regrade import regrade_problem
+
+
+class Command(BaseCommand):
+    help = "Regrades submissions against the current test cases, rerunning only the cases that changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("problem_ids", nargs="*", type=int, help="Problems to regrade.")
+        parser.add_argument("--class-id", type=int, help="Regrade every problem in this class.")
+        parser.add_argument("--workers", type=int, help="Submissions graded at once (default REGRADE_WORKERS).")
+
+    def handle(self, *args, **options):
+        problems = Problem.objects.order_by("problem_id")
+        if options["problem_ids"]:
+            problems = problems.filter(problem_id__in=options["problem_ids"])
+        elif options["class_id"]:
+            problems = problems.filter(class_id=options["class_id"])
+        else:
+            raise CommandError("Give problem IDs or --class-id.")
+
+        for problem in problems:
+            self.stdout.write(f"Regrading '{problem.problem_title}' (#{problem.problem_id})...")
+
+            def progress(done, total):
+                # About every 5%
+                if done == total or done % max(1, total // 20) == 0:
+                    self.stdout.write(f"  {done}/{total}")
+
+            regraded, requeued = regrade_problem(problem, workers=options["workers"], progress=progress)
+            self.stdout.write(self.style.SUCCESS(f"Regraded {regraded} submissions."))
+            if requeued:
+                self.stderr.write(f"The runner was busy; {requeued} submissions were queued for the grade_worker.")
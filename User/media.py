@@ -0,0 +1,62 @@
+"""
+Serves uploaded media (MEDIA_ROOT) with HTTP caching.
+
+MediaFilesMiddleware answers MEDIA_URL requests before the session and user
+middleware run. It uses WhiteNoise's responder, the same one that serves the
+static files, so media gets:
+
+- ETag and Last-Modified, with a 304 for If-None-Match / If-Modified-Since
+- Range requests
+- a precompressed name.br or name.gz next to the file, sent to clients that
+  accept it (see `manage.py compress_media`)
+
+Files are looked up on every request, because uploads can appear at any
+time. Resized variants (photo_Ab12Cd34Ef.sm.webp) are written once under a
+name images.py never reuses, so they are cached as immutable. Other files
+get MEDIA_MAX_AGE and are revalidated after that. That includes originals:
+a fresh upload still has its metadata until images.py replaces it with a
+stripped copy under a new name, and must not stay in caches after that.
+testdata/ holds hidden test cases and is never served.
+"""
+
+import re
+
+from django.conf import settings
+from django.http import Http404
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .testdata import TESTDATA_DIR
+
+# photo_Ab12Cd34Ef.sm.webp, photo_Ab12Cd34Ef.md.jpg, ...
+HASHED_NAME_RE = re.compile(r"_[A-Za-z0-9]{10}\.[a-z]+\.\w+$")
+
+
+class MediaFiles(WhiteNoise):
+    def immutable_file_test(self, path, url):
+        return bool(HASHED_NAME_RE.search(url))
+
+
+def is_private_media(name):
+    """Test data and hidden files (e.g. partly written uploads) are not served."""
+    parts = name.split("/")
+    return parts[0] == TESTDATA_DIR or any(part.startswith(".") for part in parts)
+
+
+class MediaFilesMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.MEDIA_URL
+        self.files = MediaFiles(None, autorefresh=True, max_age=settings.MEDIA_MAX_AGE)
+        self.files.add_files(settings.MEDIA_ROOT, prefix=self.prefix)
+
+    def __call__(self, request):
+        if not request.path_info.startswith(self.prefix):
+            return self.get_response(request)
+
+        if is_private_media(request.path_info[len(self.prefix):]):
+            raise Http404("Media file not found.")
+        media_file = self.files.find_file(request.path_info)
+        if media_file is None:
+            raise Http404("Media file not found.")
+        return WhiteNoiseMiddleware.serve(media_file, request)
@@ -0,0 +1,321 @@
+"""
+Request, database and runner metrics in the Prometheus text format.
+
+MetricsMiddleware records, per view:
+
+    paulicode_http_request_duration_seconds   histogram {view, method, status}
+    paulicode_db_queries_per_request          histogram {view}
+    paulicode_db_time_per_request_seconds     histogram {view}
+
+MeteredBackend wraps the code runner backend (see execution.get_backend),
+so playground runs, execute_source and grading are all covered:
+
+    paulicode_runner_call_duration_seconds    histogram {language, operation}
+    paulicode_runner_errors_total             counter   {language, operation, kind}
+
+Each process counts in memory, and a background thread adds the counts to
+shared counters in the 'metrics' cache every METRICS_FLUSH_INTERVAL seconds,
+so requests never wait on the cache. That cache is kept apart from the
+evicting default cache (see settings.CACHES): an evicted counter would read
+as a reset. With Redis, /metrics therefore shows totals across the gunicorn
+workers, the terminal (daphne) process and the grading workers. Durations
+are stored in microseconds so the counters stay integers.
+
+A flush and a scrape both hold the metrics lock, and every observation's
+bucket, count and sum are flushed together, so a scrape never sees half of
+a histogram update. Neither waits more than LOCK_WAIT_SEC for the lock: a
+flush keeps its counts for the next one and a scrape fails.
+
+Label values come from a fixed set (view names, known HTTP methods and
+languages, "other" for the rest), since every new value is a new series.
+"""
+
+import hashlib, os, threading, time, uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+PREFIX = "paulicode_"
+REGISTRY_KEY = "metrics:series"
+LOCK_KEY = "metrics:lock"
+# A lock held by a process that died is given up after this long
+LOCK_TIMEOUT = 10
+LOCK_POLL_SEC = 0.01
+# How long a flush or scrape waits for the lock before giving up
+LOCK_WAIT_SEC = 2
+MICROSECONDS = 1_000_000
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+# name: (type, help, buckets)
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Time from request to response, by view.", LATENCY_BUCKETS),
+    "db_queries_per_request": ("histogram", "SQL queries run while handling a request.", QUERY_BUCKETS),
+    "db_time_per_request_seconds": ("histogram", "Time spent in SQL queries while handling a request.", LATENCY_BUCKETS),
+    "runner_call_duration_seconds": ("histogram", "Code runner call latency, by language.", LATENCY_BUCKETS),
+    "runner_errors_total": ("counter", "Code runner calls that failed or raised, by language.", None),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name, labels):
+    """A sample name with its labels, e.g. 'paulicode_x_count{view="index"}'."""
+    if not labels:
+        return PREFIX + name
+    # "le" goes last, so the buckets of one label set sort together
+    items = sorted(labels.items(), key=lambda item: (item[0] == "le", item[0]))
+    return PREFIX + name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _cache_key(series):
+    return "metrics:" + hashlib.sha1(series.encode()).hexdigest()
+
+
+def _cache():
+    return caches["metrics"]
+
+
+def _language_label(language):
+    """The LANGUAGES key for a runner call's language, or "other" for a name the client made up."""
+    # get_language() would run an unknown name as python; the label keeps them apart
+    from .execution import LANGUAGE_ALIASES, LANGUAGES
+
+    language = str(language or "python").lower()
+    language = LANGUAGE_ALIASES.get(language, language)
+    return language if language in LANGUAGES else "other"
+
+
+@contextmanager
+def _shared_lock(cache):
+    """
+    Serialises flushes and scrapes across processes.
+    Yields whether the lock was taken; it isn't after LOCK_WAIT_SEC.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT_SEC
+    while not cache.add(LOCK_KEY, token, timeout=LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            yield False
+            return
+        time.sleep(LOCK_POLL_SEC)
+    try:
+        yield True
+    finally:
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+
+class _Counts:
+    """This process's counts since the last flush."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)
+        # The process that started the flush thread; a forked child starts its own
+        self.flusher_pid = None
+
+    def add(self, amounts):
+        """Adds {series: amount}; the amounts are always flushed together."""
+        with self.lock:
+            for series, amount in amounts.items():
+                self.pending[series] += amount
+            if self.flusher_pid != os.getpid():
+                self.flusher_pid = os.getpid()
+                threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+
+    def take(self):
+        pending, self.pending = self.pending, defaultdict(int)
+        return pending
+
+
+_counts = _Counts()
+
+
+def _flush(pending):
+    """Adds pending to the shared counters; False if the lock wasn't free in time."""
+    if not pending:
+        return True
+    cache = _cache()
+    keys = {series: _cache_key(series) for series in pending}
+    with _shared_lock(cache) as locked:
+        if not locked:
+            return False
+        registry = cache.get(REGISTRY_KEY) or set()
+        if not registry.issuperset(pending):
+            cache.set(REGISTRY_KEY, registry | set(pending), timeout=None)
+        totals = cache.get_many(list(keys.values()))
+        cache.set_many(
+            {key: totals.get(key, 0) + pending[series] for series, key in keys.items()},
+            timeout=None,
+        )
+    return True
+
+
+def flush():
+    """
+    Pushes this process's counts now (e.g. before /metrics is read by the same process).
+    Returns False, keeping the counts for the next flush, when the lock wasn't free in time.
+    """
+    with _counts.lock:
+        pending = _counts.take()
+    flushed = False
+    try:
+        flushed = _flush(pending)
+    finally:
+        if not flushed and pending:
+            _counts.add(pending)
+    return flushed
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            # The cache is unreachable; the counts were kept, try again next interval
+            pass
+
+
+def observe(name, value, **labels):
+    """Adds one observation to a histogram."""
+    scale = MICROSECONDS if name.endswith("_seconds") else 1
+    amounts = {
+        _series(f"{name}_bucket", {**labels, "le": bound}): 1
+        for bound in METRICS[name][2]
+        if value <= bound
+    }
+    amounts[_series(f"{name}_bucket", {**labels, "le": "+Inf"})] = 1
+    amounts[_series(f"{name}_count", labels)] = 1
+    amounts[_series(f"{name}_sum", labels)] = round(value * scale)
+    _counts.add(amounts)
+
+
+def inc(name, amount=1, **labels):
+    _counts.add({_series(name, labels): amount})
+
+
+def _family(series):
+    name = series.split("{", 1)[0][len(PREFIX):]
+    for suffix in ("_bucket", "_count", "_sum"):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def _sort_key(series):
+    # Buckets in le order, so histograms read naturally
+    if 'le="' not in series:
+        return (series, 0)
+    head, le = series.rsplit('le="', 1)
+    bound = le.split('"', 1)[0]
+    return (head, float("inf") if bound == "+Inf" else float(bound))
+
+
+def render_metrics():
+    """All shared counters in the Prometheus text exposition format, or None if the lock wasn't free in time."""
+    cache = _cache()
+    with _shared_lock(cache) as locked:
+        if not locked:
+            return None
+        registry = sorted(cache.get(REGISTRY_KEY) or set(), key=_sort_key)
+        values = cache.get_many([_cache_key(series) for series in registry])
+
+    by_family = defaultdict(list)
+    for series in registry:
+        by_family[_family(series)].append(series)
+
+    lines = []
+    for family in sorted(by_family):
+        kind, help_text, _ = METRICS.get(family, ("untyped", "", None))
+        lines.append(f"# HELP {PREFIX}{family} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{family} {kind}")
+        for series in by_family[family]:
+            value = values.get(_cache_key(series), 0)
+            if family.endswith("_seconds") and series.split("{", 1)[0].endswith("_sum"):
+                lines.append(f"{series} {value / MICROSECONDS}")
+            else:
+                lines.append(f"{series} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Times each request and counts its SQL queries on the default connection.
+    Streaming responses are timed to the first byte, without the queries run while streaming.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = {"count": 0, "time": 0.0}
+
+        def count_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries["count"] += 1
+                queries["time"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unmatched"
+        method = request.method if request.method in HTTP_METHODS else "other"
+        observe("http_request_duration_seconds", elapsed, view=view, method=method, status=response.status_code)
+        observe("db_queries_per_request", queries["count"], view=view)
+        observe("db_time_per_request_seconds", queries["time"], view=view)
+        return response
+
+
+class MeteredBackend:
+    """Wraps an execution backend, recording latency and errors of each runner call."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        # supports_streaming, popen_args, release, ...
+        return getattr(self.backend, name)
+
+    def _call(self, operation, language, method, *args, **kwargs):
+        language = _language_label(language)
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            inc("runner_errors_total", language=language, operation=operation, kind=type(e).__name__)
+            raise
+        finally:
+            observe("runner_call_duration_seconds", time.perf_counter() - start, language=language, operation=operation)
+        if isinstance(result, dict) and result.get("error"):
+            inc("runner_errors_total", language=language, operation=operation, kind="error")
+        return result
+
+    def execute(self, language, code, stdin_data="", timeout_sec=5):
+        return self._call("execute", language, self.backend.execute, language, code, stdin_data=stdin_data, timeout_sec=timeout_sec)
+
+    def compile(self, language, code):
+        return self._call("compile", language, self.backend.compile, language, code)
+
+    def run(self, program, stdin_data="", timeout_sec=5):
+        return self._call("run", program.language, self.backend.run, program, stdin_data=stdin_data, timeout_sec=timeout_sec)
+
+    def run_checked(self, program, stdin_path, expected_path, timeout_sec=5, compare=None):
+        return self._call(
+            "run_checked", program.language, self.backend.run_checked,
+            program, stdin_path, expected_path, timeout_sec=timeout_sec, compare=compare,
+        )
@@ -0,0 +1,51 @@
+"""
+Resolves the logged-in user once per request.
+
+CurrentUserMiddleware sets request.current_user to a lazy object: the User
+for the session's school_id (or None), loaded on first use. Users are cached
+under a per-user version token that is replaced whenever the row is saved or
+deleted (see signals.py), so a stale entry is never read again. Without
+VERSIONED_CACHES the row is read from the database every request.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from .models import User
+from .versioning import bump_version, get_version
+
+
+def bump_user_version(school_id):
+    """Invalidates the cached user; called after a User row changes."""
+    bump_version(f"user:{school_id}")
+
+
+def load_user(school_id):
+    """Returns the User for school_id from the cache or the database, or None."""
+    if not settings.VERSIONED_CACHES:
+        return User.objects.filter(school_id=school_id).first()
+
+    key = f"current_user:{school_id}:{get_version(f'user:{school_id}')}"
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.filter(school_id=school_id).first()
+        if user is not None:
+            cache.set(key, user, timeout=settings.CURRENT_USER_CACHE_TTL)
+    return user
+
+
+def get_current_user(request):
+    if not hasattr(request, "_cached_current_user"):
+        school_id = request.session.get("school_id")
+        request._cached_current_user = load_user(school_id) if school_id else None
+    return request._cached_current_user
+
+
+class CurrentUserMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.current_user = SimpleLazyObject(lambda: get_current_user(request))
+        return self.get_response(request)
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0003_class_problem_alter_user_user_image_submission_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='graded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='language',
+            field=models.CharField(default='python', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='passed_cases',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='result_summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Running', 'Running'), ('Graded', 'Graded'), ('Error', 'Error')], default='Graded', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='total_cases',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def populate_results(apps, schema_editor):
+    Submission = apps.get_model('User', 'Submission')
+    StudentProblemResult = apps.get_model('User', 'StudentProblemResult')
+
+    stats = (
+        Submission.objects.values('student_id', 'problem_id')
+        .annotate(
+            attempts=Count('submission_id'),
+            best_score=Max('score', filter=Q(status='Graded')),
+            last_submitted_at=Max('submitted_at'),
+            latest_id=Max('submission_id'),
+        )
+        .order_by()
+    )
+    rows = []
+    for row in stats.iterator():
+        latest = Submission.objects.only('status', 'score').get(pk=row['latest_id'])
+        rows.append(StudentProblemResult(
+            student_id_id=row['student_id'],
+            problem_id_id=row['problem_id'],
+            latest_submission_id=latest.pk,
+            latest_status=latest.status,
+            latest_score=latest.score if latest.status == 'Graded' else None,
+            best_score=row['best_score'] or 0,
+            attempts=row['attempts'],
+            last_submitted_at=row['last_submitted_at'],
+        ))
+    StudentProblemResult.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0004_submission_grading_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentProblemResult',
+            fields=[
+                ('result_id', models.AutoField(primary_key=True, serialize=False)),
+                ('latest_status', models.CharField(choices=[('Pending', 'Pending'), ('Running', 'Running'), ('Graded', 'Graded'), ('Error', 'Error')], default='Pending', max_length=10)),
+                ('latest_score', models.IntegerField(blank=True, null=True)),
+                ('best_score', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_submitted_at', models.DateTimeField(blank=True, null=True)),
+                ('latest_submission', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='User.submission')),
+                ('problem_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='User.problem')),
+                ('student_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='problem_results', to='User.user')),
+            ],
+            options={
+                'unique_together': {('student_id', 'problem_id')},
+            },
+        ),
+        migrations.RunPython(populate_results, migrations.RunPython.noop),
+    ]
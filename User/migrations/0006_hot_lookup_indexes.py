@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0005_studentproblemresult'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['student_id', 'class_id'], name='enrollment_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='problem',
+            index=models.Index(fields=['class_id', 'problem_type', '-problem_id'], name='problem_class_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['student_id', 'problem_id', '-submission_id'], name='submission_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['status', 'submission_id'], name='submission_status_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0006_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problemtestcase',
+            name='input_file',
+            field=models.FileField(blank=True, default='', upload_to='testdata/'),
+        ),
+        migrations.AddField(
+            model_name='problemtestcase',
+            name='output_file',
+            field=models.FileField(blank=True, default='', upload_to='testdata/'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0007_testcase_data_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='comparator',
+            field=models.CharField(choices=[('exact', 'Exact (ignore leading/trailing whitespace)'), ('trailing_whitespace', 'Ignore trailing whitespace per line'), ('tokens', 'Tokens (ignore spacing)'), ('float', 'Numbers within tolerance'), ('unordered_lines', 'Lines in any order')], default='exact', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='float_abs_tolerance',
+            field=models.FloatField(default=1e-06),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='float_rel_tolerance',
+            field=models.FloatField(default=1e-06),
+        ),
+    ]
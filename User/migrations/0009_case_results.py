@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:51
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def hash_test_cases(apps, schema_editor):
+    # Same as ProblemTestCase.compute_content_hash (historical models don't have it)
+    ProblemTestCase = apps.get_model('User', 'ProblemTestCase')
+    batch = []
+    for tc in ProblemTestCase.objects.all().iterator(chunk_size=1000):
+        digest = hashlib.sha256()
+        if tc.input_file.name and tc.output_file.name:
+            digest.update(f"stored:{tc.input_file.name}:{tc.output_file.name}".encode())
+        else:
+            digest.update(tc.input_data.encode())
+            digest.update(b"\0")
+            digest.update(tc.expected_output.encode())
+        tc.content_hash = digest.hexdigest()
+        batch.append(tc)
+        if len(batch) == 1000:
+            ProblemTestCase.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    ProblemTestCase.objects.bulk_update(batch, ['content_hash'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0008_problem_comparator'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problemtestcase',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='SubmissionCaseResult',
+            fields=[
+                ('case_result_id', models.AutoField(primary_key=True, serialize=False)),
+                ('check_hash', models.CharField(max_length=64)),
+                ('passed', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True, default='')),
+                ('output', models.TextField(blank=True, default='')),
+                ('difference', models.TextField(blank=True, default='')),
+                ('submission_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='case_results', to='User.submission')),
+                ('testcase_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='User.problemtestcase')),
+            ],
+            options={
+                'unique_together': {('submission_id', 'testcase_id')},
+            },
+        ),
+        migrations.RunPython(hash_test_cases, migrations.RunPython.noop),
+    ]
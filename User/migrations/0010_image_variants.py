@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0009_case_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='class',
+            name='upload_icon_variants',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='user_image_variants',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
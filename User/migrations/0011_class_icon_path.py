@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:00
+
+import User.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0010_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='class',
+            name='upload_icon',
+            field=models.ImageField(blank=True, null=True, upload_to=User.models.icon_path),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0011_class_icon_path'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='submission',
+            name='submission_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['status', 'graded_at', 'submission_id'], name='submission_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0012_submission_queue_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='feedback',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='review_status',
+            field=models.CharField(blank=True, choices=[('Accepted', 'Accepted'), ('Rejected', 'Rejected')], default='', max_length=10),
+        ),
+    ]
@@ -1,17 +1,27 @@
 from django.db import models
 from datetime import datetime
 from django.utils import timezone
-import os, random
+import hashlib, os, random
 from django.utils.html import mark_safe
+from .images import variant_url
 
 now = timezone.now()
 
 # ---------- Helper Function for Image Uploads ----------
-def image_path(instance, filename):
+def _random_name(folder, filename):
+    # The random suffix makes every upload a new URL; images.py gives the processed copy another one
     basefilename, file_extension = os.path.splitext(filename)
     chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
     randomstr = ''.join((random.choice(chars)) for x in range(10))
-    return f'profile_pic/{basefilename}_{randomstr}{file_extension}'
+    return f'{folder}/{basefilename}_{randomstr}{file_extension}'
+
+
+def image_path(instance, filename):
+    return _random_name('profile_pic', filename)
+
+
+def icon_path(instance, filename):
+    return _random_name('class_icons', filename)
 
 
 # ---------- USER MODEL ----------
@@ -21,6 +31,8 @@ class User(models.Model):
     last_name = models.CharField(max_length=50, verbose_name="Last Name")
     password = models.CharField(max_length=255, verbose_name="Password")
     user_image = models.ImageField(upload_to=image_path, default='profile_pic/image.png')
+    # Sizes of the resized copies written next to user_image (see images.py)
+    user_image_variants = models.JSONField(default=list, blank=True)
 
     STUDENT = 'Student'
     TEACHER = 'Teacher'
@@ -31,7 +43,7 @@ class User(models.Model):
     user_type = models.CharField(max_length=10, choices=USER_TYPE_CHOICES, verbose_name="User Type")
 
     def image_tag(self):
-        return mark_safe(f'<img src="{self.user_image.url}" width="50" height="50" />')
+        return mark_safe(f'<img src="{variant_url(self.user_image, "sm")}" width="50" height="50" />')
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.user_type})"
@@ -44,7 +56,8 @@ class Class(models.Model):
     title = models.CharField(max_length=150)
     description = models.TextField(blank=True, null=True)
     teacher = models.ForeignKey(User, on_delete=models.CASCADE, related_name='classes')
-    upload_icon = models.ImageField(upload_to='class_icons/', blank=True, null=True)
+    upload_icon = models.ImageField(upload_to=icon_path, blank=True, null=True)
+    upload_icon_variants = models.JSONField(default=list, blank=True)
 
     def __str__(self):
         return f"{self.title} ({self.class_code})"
@@ -58,6 +71,10 @@ class Enrollment(models.Model):
 
     class Meta:
         unique_together = ('class_id', 'student_id')
+        indexes = [
+            # "Classes this student is in"; the unique index above leads with class_id
+            models.Index(fields=['student_id', 'class_id'], name='enrollment_student_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student_id.first_name} in {self.class_id.title}"
@@ -78,6 +95,32 @@ class Problem(models.Model):
     time_limit = models.IntegerField()
     due_date = models.DateTimeField()
 
+    # How program output is checked against the expected output (see comparators.py)
+    COMPARATOR_CHOICES = [
+        ('exact', 'Exact (ignore leading/trailing whitespace)'),
+        ('trailing_whitespace', 'Ignore trailing whitespace per line'),
+        ('tokens', 'Tokens (ignore spacing)'),
+        ('float', 'Numbers within tolerance'),
+        ('unordered_lines', 'Lines in any order'),
+    ]
+    comparator = models.CharField(max_length=20, choices=COMPARATOR_CHOICES, default='exact')
+    float_abs_tolerance = models.FloatField(default=1e-6)
+    float_rel_tolerance = models.FloatField(default=1e-6)
+
+    def compare_options(self):
+        """Keyword arguments for comparators.make_comparator."""
+        return {
+            "mode": self.comparator,
+            "abs_tol": self.float_abs_tolerance,
+            "rel_tol": self.float_rel_tolerance,
+        }
+
+    class Meta:
+        indexes = [
+            # Class problem lists, filtered by type and newest first
+            models.Index(fields=['class_id', 'problem_type', '-problem_id'], name='problem_class_type_idx'),
+        ]
+
     def __str__(self):
         return f"{self.problem_title} ({self.class_id.title})"
 
@@ -88,6 +131,27 @@ class ProblemTestCase(models.Model):
     problem_id = models.ForeignKey(Problem, on_delete=models.CASCADE)
     input_data = models.TextField()
     expected_output = models.TextField()
+    # Large cases live in content-addressed files (see testdata.py); the text
+    # fields then only hold a preview for display
+    input_file = models.FileField(upload_to='testdata/', blank=True, default='')
+    output_file = models.FileField(upload_to='testdata/', blank=True, default='')
+    # SHA-256 of the input and expected output; a regrade only reruns cases whose hash changed
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+
+    @property
+    def is_stored(self):
+        return bool(self.input_file.name and self.output_file.name)
+
+    def compute_content_hash(self):
+        digest = hashlib.sha256()
+        if self.is_stored:
+            # Stored files are already named by their hash
+            digest.update(f"stored:{self.input_file.name}:{self.output_file.name}".encode())
+        else:
+            digest.update(self.input_data.encode())
+            digest.update(b"\0")
+            digest.update(self.expected_output.encode())
+        return digest.hexdigest()
 
     def __str__(self):
         return f"TestCase #{self.testcase_id} for {self.problem_id.problem_title}"
@@ -95,12 +159,96 @@ class ProblemTestCase(models.Model):
 
 # ---------- SUBMISSION MODEL ----------
 class Submission(models.Model):
+    PENDING = 'Pending'
+    RUNNING = 'Running'
+    GRADED = 'Graded'
+    ERROR = 'Error'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (GRADED, 'Graded'),
+        (ERROR, 'Error'),
+    ]
+    ACCEPTED = 'Accepted'
+    REJECTED = 'Rejected'
+    REVIEW_CHOICES = [
+        (ACCEPTED, 'Accepted'),
+        (REJECTED, 'Rejected'),
+    ]
+
     submission_id = models.AutoField(primary_key=True)
     problem_id = models.ForeignKey(Problem, on_delete=models.CASCADE)
     student_id = models.ForeignKey(User, on_delete=models.CASCADE)
     code = models.TextField()
+    language = models.CharField(max_length=20, default='python')
     submitted_at = models.DateTimeField(auto_now_add=True)
     score = models.IntegerField(default=0)
 
+    # Grading queue: submit_problem saves a Pending row, the grade_worker command grades it
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=GRADED)
+    passed_cases = models.IntegerField(default=0)
+    total_cases = models.IntegerField(default=0)
+    result_summary = models.TextField(blank=True, default='')
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    graded_at = models.DateTimeField(blank=True, null=True)
+
+    # Teacher review (review_submission); kept apart from status, which only the grading queue writes
+    review_status = models.CharField(max_length=10, choices=REVIEW_CHOICES, blank=True, default='')
+    feedback = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # A student's latest submission for a problem
+            models.Index(fields=['student_id', 'problem_id', '-submission_id'], name='submission_latest_idx'),
+            # grade_worker polling for Pending / stale Running rows; new submissions (graded_at unset) before regrades
+            models.Index(fields=['status', 'graded_at', 'submission_id'], name='submission_queue_idx'),
+        ]
+
     def __str__(self):
         return f"Submission by {self.student_id.first_name} for {self.problem_id.problem_title}"
+
+
+# ---------- SUBMISSION CASE RESULT MODEL ----------
+class SubmissionCaseResult(models.Model):
+    """
+    How a submission did on one test case. check_hash records the test case content
+    and comparator it was checked against, so regrading only reruns cases that changed.
+    """
+    case_result_id = models.AutoField(primary_key=True)
+    submission_id = models.ForeignKey(Submission, on_delete=models.CASCADE, related_name='case_results')
+    testcase_id = models.ForeignKey(ProblemTestCase, on_delete=models.CASCADE, related_name='+')
+    check_hash = models.CharField(max_length=64)
+    passed = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default='')
+    output = models.TextField(blank=True, default='')  # stdout preview, kept for failed cases
+    difference = models.TextField(blank=True, default='')
+
+    class Meta:
+        unique_together = ('submission_id', 'testcase_id')
+
+    def __str__(self):
+        return f"Submission #{self.submission_id_id}, test case #{self.testcase_id_id}: {'passed' if self.passed else 'failed'}"
+
+
+# ---------- STUDENT PROBLEM RESULT MODEL ----------
+class StudentProblemResult(models.Model):
+    """
+    One row per (student, problem), kept up to date as submissions are made and graded,
+    so pages that show "answered" and scores never have to scan Submission.
+    Rebuild with `python manage.py rebuild_results`.
+    """
+    result_id = models.AutoField(primary_key=True)
+    student_id = models.ForeignKey(User, on_delete=models.CASCADE, related_name='problem_results')
+    problem_id = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='results')
+    latest_submission = models.ForeignKey(Submission, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    latest_status = models.CharField(max_length=10, choices=Submission.STATUS_CHOICES, default=Submission.PENDING)
+    latest_score = models.IntegerField(blank=True, null=True)  # None until the latest submission is graded
+    best_score = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    last_submitted_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('student_id', 'problem_id')
+
+    def __str__(self):
+        return f"{self.student_id.first_name}: {self.best_score} on {self.problem_id.problem_title}"
@@ -0,0 +1,61 @@
+"""
+Cached payload for the problem details endpoint.
+
+The problem and its test cases are serialised once per problem version and
+kept in the default cache. Saving or deleting the problem or one of its test
+cases bumps the version (signals.py), as do the bulk writes in testcases.py.
+The payload carries its version and build time, which the view turns into
+ETag / Last-Modified so reopening a modal is answered with a 304. Without
+VERSIONED_CACHES the payload is built on every request with a fresh version,
+so it is never cached and never answered with a 304.
+"""
+
+import time, uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404
+
+from .models import Problem, ProblemTestCase
+from .versioning import get_version
+
+
+def problem_payload(problem_id):
+    """Returns {"version", "modified", "data"} for a problem; raises Http404 if it doesn't exist."""
+    if not settings.VERSIONED_CACHES:
+        return _build_payload(problem_id, uuid.uuid4().hex)
+
+    version = get_version(f"problem:{problem_id}")
+    key = f"problem_details:{problem_id}:{version}"
+
+    payload = cache.get(key)
+    if payload is None:
+        payload = _build_payload(problem_id, version)
+        cache.set(key, payload, timeout=settings.PROBLEM_DETAILS_CACHE_TTL)
+    return payload
+
+
+def _build_payload(problem_id, version):
+    problem = get_object_or_404(Problem, pk=problem_id)
+    test_cases = ProblemTestCase.objects.filter(problem_id=problem).order_by("testcase_id")
+    return {
+        "version": version,
+        "modified": time.time(),
+        "data": {
+            "problem_id": problem.problem_id,
+            "title": problem.problem_title,
+            "description": problem.problem_description,
+            "type": problem.problem_type,
+            "score": problem.total_score,
+            "time_limit": problem.time_limit,
+            "due_date": problem.due_date.strftime("%Y-%m-%d %H:%M"),
+            "comparator": problem.comparator,
+            "abs_tol": problem.float_abs_tolerance,
+            "rel_tol": problem.float_rel_tolerance,
+            "test_cases": [
+                # Stored (large) cases only carry previews of their data
+                {"id": tc.testcase_id, "input": tc.input_data, "output": tc.expected_output, "stored": tc.is_stored}
+                for tc in test_cases
+            ],
+        },
+    }
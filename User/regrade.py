@@ -0,0 +1,101 @@
+"""
+Regrading a problem's submissions after its test cases or comparator change.
+
+grade_submission keeps each test case's outcome with a hash of the case and
+comparator, so a regrade only reruns the cases that changed. regrade_problem
+(`python manage.py regrade`) groups submissions with identical code so each
+changed case runs once per distinct program, and grades the groups in
+parallel. The teacher's Regrade button queues the submissions for the
+grade_worker instead (identical code is then served by the execution cache).
+"""
+
+import hashlib, threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, F, Q
+from django.db.models.functions import Coalesce
+
+from .grading import grade_submission, requeue_submission
+from .models import ProblemTestCase, Submission
+from .runner_client import RunnerUnavailable
+from .throttling import Throttled
+
+IN_PROGRESS = [Submission.PENDING, Submission.RUNNING]
+
+
+def regrade_problem(problem, submissions=None, workers=None, progress=None):
+    """
+    Regrades the problem's graded submissions (or the given queryset of them).
+    progress(done, total) is called after each submission.
+    Returns (regraded, requeued): submissions the runner couldn't take are left for the grade_worker.
+    """
+    if submissions is None:
+        submissions = Submission.objects.filter(problem_id=problem).exclude(status__in=IN_PROGRESS)
+    test_cases = list(ProblemTestCase.objects.filter(problem_id=problem).order_by("testcase_id"))
+
+    groups = defaultdict(list)
+    for submission in submissions.select_related("problem_id").prefetch_related("case_results").order_by("submission_id"):
+        groups[(submission.language, hashlib.sha256(submission.code.encode()).hexdigest())].append(submission)
+
+    total = sum(len(group) for group in groups.values())
+    counts = {"done": 0, "requeued": 0}
+    lock = threading.Lock()
+
+    def grade_group(group):
+        memo = {}
+        try:
+            for i, submission in enumerate(group):
+                try:
+                    grade_submission(submission, test_cases=test_cases, memo=memo)
+                except (RunnerUnavailable, Throttled):
+                    # grade_submission requeued this one; hand the rest of the group over too
+                    for rest in group[i + 1:]:
+                        requeue_submission(rest)
+                    with lock:
+                        counts["requeued"] += len(group) - i
+                    return
+                with lock:
+                    counts["done"] += 1
+                    done = counts["done"]
+                if progress:
+                    progress(done, total)
+        finally:
+            # Each pool thread has its own connection
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers or settings.REGRADE_WORKERS) as pool:
+        list(pool.map(grade_group, groups.values()))
+    return counts["done"], counts["requeued"]
+
+
+def queue_regrade(problem):
+    """
+    Queues the problem's graded submissions for regrading and returns how many.
+    Without the grading queue they are regraded in a background thread.
+    """
+    submissions = Submission.objects.filter(problem_id=problem).exclude(status__in=IN_PROGRESS)
+    ids = list(submissions.values_list("submission_id", flat=True))
+    # graded_at tells grade_submission this is a regrade (rows from before the grading queue have none)
+    Submission.objects.filter(submission_id__in=ids).update(
+        status=Submission.PENDING, claimed_at=None, graded_at=Coalesce(F("graded_at"), F("submitted_at")),
+    )
+
+    if not settings.GRADING_QUEUE:
+        def run():
+            try:
+                regrade_problem(problem, Submission.objects.filter(submission_id__in=ids))
+            finally:
+                connections.close_all()
+        threading.Thread(target=run, daemon=True).start()
+    return len(ids)
+
+
+def regrade_progress(problem):
+    """{"total", "remaining"} for the problem's submissions; remaining counts those still queued or running."""
+    return Submission.objects.filter(problem_id=problem).aggregate(
+        total=Count("submission_id"),
+        remaining=Count("submission_id", filter=Q(status__in=IN_PROGRESS)),
+    )
@@ -0,0 +1,132 @@
+"""
+Maintains StudentProblemResult, the per-student, per-problem summary of submissions.
+
+submit_problem calls record_attempt in the same transaction that creates the
+Submission, grading calls record_grade, and deleting a submission recomputes
+its row from what is left. rebuild_results recomputes rows from scratch
+(`python manage.py rebuild_results`).
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Value
+from django.db.models.functions import Greatest
+
+from .models import StudentProblemResult, Submission
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def record_attempt(submission):
+    """Counts a new submission; call inside the transaction that created it."""
+    result, created = StudentProblemResult.objects.select_for_update().get_or_create(
+        student_id_id=submission.student_id_id,
+        problem_id_id=submission.problem_id_id,
+        defaults={
+            "latest_submission": submission,
+            "latest_status": submission.status,
+            "attempts": 1,
+            "last_submitted_at": submission.submitted_at,
+        },
+    )
+    if not created:
+        StudentProblemResult.objects.filter(pk=result.pk).update(
+            latest_submission=submission,
+            latest_status=submission.status,
+            latest_score=None,
+            attempts=F("attempts") + 1,
+            last_submitted_at=submission.submitted_at,
+        )
+
+
+def record_grade(submission):
+    """Applies a graded (or failed) submission to its result row."""
+    results = StudentProblemResult.objects.filter(
+        student_id_id=submission.student_id_id, problem_id_id=submission.problem_id_id
+    )
+    if submission.status == Submission.GRADED:
+        results.update(best_score=Greatest(F("best_score"), Value(submission.score)))
+
+    # A newer submission may already have replaced this one as the latest
+    results.filter(latest_submission=submission).update(
+        latest_status=submission.status,
+        latest_score=submission.score if submission.status == Submission.GRADED else None,
+    )
+
+
+def rebuild_results(submissions=None):
+    """
+    Recomputes the result rows for every (student, problem) pair in `submissions`
+    (all submissions by default). Returns the number of rows written.
+    """
+    if submissions is None:
+        submissions = Submission.objects.all()
+
+    # Rows whose latest submission was deleted outside delete_submission (e.g. in the admin)
+    StudentProblemResult.objects.filter(
+        latest_submission__isnull=True, problem_id__in=submissions.values("problem_id")
+    ).delete()
+
+    pairs = (
+        submissions.values("student_id", "problem_id")
+        .order_by("student_id", "problem_id")
+        .distinct()
+    )
+    written = 0
+    batch = []
+    for pair in pairs.iterator(chunk_size=REBUILD_BATCH_SIZE):
+        batch.append((pair["student_id"], pair["problem_id"]))
+        if len(batch) == REBUILD_BATCH_SIZE:
+            written += _rebuild_batch(batch)
+            batch = []
+    if batch:
+        written += _rebuild_batch(batch)
+    return written
+
+
+def rebuild_result(student_id, problem_id):
+    """Recomputes one row, deleting it when the student has no submissions left."""
+    with transaction.atomic():
+        StudentProblemResult.objects.filter(student_id=student_id, problem_id=problem_id).delete()
+        _rebuild_batch([(student_id, problem_id)])
+
+
+def _rebuild_batch(pairs):
+    # Rebuilding every pair among these students and problems is still exact and
+    # keeps the filter to two IN lists instead of one OR clause per pair
+    scope = Q(student_id__in={s for s, _ in pairs}, problem_id__in={p for _, p in pairs})
+
+    stats = (
+        Submission.objects.filter(scope)
+        .values("student_id", "problem_id")
+        .annotate(
+            attempts=Count("submission_id"),
+            best_score=Max("score", filter=Q(status=Submission.GRADED)),
+            last_submitted_at=Max("submitted_at"),
+            latest_id=Max("submission_id"),
+        )
+        .order_by()
+    )
+    stats = list(stats)
+    latest = Submission.objects.only("submission_id", "status", "score").in_bulk(
+        [row["latest_id"] for row in stats]
+    )
+
+    rows = []
+    for row in stats:
+        submission = latest[row["latest_id"]]
+        graded = submission.status == Submission.GRADED
+        rows.append(StudentProblemResult(
+            student_id_id=row["student_id"],
+            problem_id_id=row["problem_id"],
+            latest_submission=submission,
+            latest_status=submission.status,
+            latest_score=submission.score if graded else None,
+            best_score=row["best_score"] or 0,
+            attempts=row["attempts"],
+            last_submitted_at=row["last_submitted_at"],
+        ))
+
+    with transaction.atomic():
+        StudentProblemResult.objects.filter(scope).delete()
+        StudentProblemResult.objects.bulk_create(rows)
+    return len(rows)
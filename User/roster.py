@@ -0,0 +1,154 @@
+"""
+Bulk roster import: creates student accounts and enrolls them in a class from a CSV.
+
+The CSV has school_id, first_name, last_name and an optional password
+column, with or without a header row (the roster export from the report
+page works as is). Rows are written in batches of ROSTER_BATCH_SIZE, each in
+its own transaction: one query for the IDs that already exist, one
+bulk_create for the new accounts and one for the enrollments, so a whole
+term is a handful of statements instead of several per student. Every row
+gets a status for the report shown to the teacher.
+"""
+
+import csv, io
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.crypto import get_random_string
+
+from .models import Enrollment, User
+from .signals import bump_after_commit
+
+ROSTER_BATCH_SIZE = 500
+COLUMNS = ["school_id", "first_name", "last_name", "password"]
+# Header names accepted for each column, after lower-casing and replacing spaces with "_"
+HEADER_ALIASES = {"id": "school_id", "student_id": "school_id", "first": "first_name", "last": "last_name"}
+PASSWORD_CHARS = "abcdefghjkmnpqrstuvwxyz23456789"
+
+CREATED = "Created"
+ENROLLED = "Enrolled"
+ALREADY_ENROLLED = "Already enrolled"
+SKIPPED = "Skipped"
+
+
+class RosterImportError(ValueError):
+    """The roster file can't be read; the message is shown to the teacher."""
+
+
+class RosterRow:
+    """One roster line and what the import did with it."""
+
+    def __init__(self, line, school_id, first_name, last_name, password=""):
+        self.line = line
+        self.school_id = school_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.password = password
+        self.status = None
+        self.message = ""
+        self.generated_password = ""
+
+    def skip(self, message):
+        self.status = SKIPPED
+        self.message = message
+
+
+def parse_roster(upload):
+    """Returns a RosterRow per non-empty line of an uploaded CSV; invalid rows are already marked Skipped."""
+    # Checked before reading, and the read is bounded in case the reported size is wrong
+    too_large = RosterImportError(f"The roster file is larger than {settings.ROSTER_IMPORT_MAX_BYTES} bytes.")
+    if upload.size is not None and upload.size > settings.ROSTER_IMPORT_MAX_BYTES:
+        raise too_large
+    data = upload.read(settings.ROSTER_IMPORT_MAX_BYTES + 1)
+    if len(data) > settings.ROSTER_IMPORT_MAX_BYTES:
+        raise too_large
+
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise RosterImportError("The roster must be a UTF-8 encoded CSV file.")
+
+    lines = [(n, row) for n, row in enumerate(csv.reader(io.StringIO(text)), start=1) if any(c.strip() for c in row)]
+    if not lines:
+        raise RosterImportError("The roster file is empty.")
+
+    columns = _header_columns(lines[0][1])
+    if columns:
+        lines = lines[1:]
+    else:
+        columns = {name: i for i, name in enumerate(COLUMNS)}
+    if len(lines) > settings.ROSTER_IMPORT_MAX_ROWS:
+        raise RosterImportError(f"At most {settings.ROSTER_IMPORT_MAX_ROWS} students can be imported at once.")
+
+    rows, seen = [], set()
+    max_length = {name: User._meta.get_field(name).max_length for name in ("school_id", "first_name", "last_name")}
+    for n, cells in lines:
+        values = {name: cells[i].strip() if i < len(cells) else "" for name, i in columns.items()}
+        row = RosterRow(n, values["school_id"], values["first_name"], values["last_name"], values.get("password", ""))
+
+        if not (row.school_id and row.first_name and row.last_name):
+            row.skip("School ID, first name and last name are required.")
+        elif any(len(getattr(row, name)) > limit for name, limit in max_length.items()):
+            row.skip("A value is longer than the field allows.")
+        elif row.school_id in seen:
+            row.skip("Duplicate school ID in the file.")
+        seen.add(row.school_id)
+        rows.append(row)
+    return rows
+
+
+def _header_columns(cells):
+    """{column: index} if the first line is a header naming at least the required columns, else None."""
+    names = [cell.strip().lower().replace(" ", "_") for cell in cells]
+    names = [HEADER_ALIASES.get(name, name) for name in names]
+    columns = {name: names.index(name) for name in COLUMNS if name in names}
+    if {"school_id", "first_name", "last_name"} <= columns.keys():
+        return columns
+    return None
+
+
+def import_roster(klass, rows):
+    """Creates missing student accounts and enrolls every valid row in the class. Sets each row's status."""
+    valid = [row for row in rows if row.status is None]
+    for start in range(0, len(valid), ROSTER_BATCH_SIZE):
+        _import_batch(klass, valid[start:start + ROSTER_BATCH_SIZE])
+    return rows
+
+
+@transaction.atomic
+def _import_batch(klass, batch):
+    ids = [row.school_id for row in batch]
+    existing = dict(User.objects.filter(school_id__in=ids).values_list("school_id", "user_type"))
+
+    new_users = []
+    for row in batch:
+        if row.school_id in existing:
+            continue
+        if not row.password:
+            row.generated_password = get_random_string(8, PASSWORD_CHARS)
+        new_users.append(User(
+            school_id=row.school_id,
+            first_name=row.first_name,
+            last_name=row.last_name,
+            password=row.password or row.generated_password,
+            user_type=User.STUDENT,
+            user_image='profile_pic/default.png',
+        ))
+    # An ID taken by a signup since the query above is left as it is
+    User.objects.bulk_create(new_users, ignore_conflicts=True)
+
+    already = set(
+        Enrollment.objects.filter(class_id=klass, student_id__in=ids).values_list("student_id", flat=True)
+    )
+    enrollments = []
+    for row in batch:
+        if existing.get(row.school_id, User.STUDENT) != User.STUDENT:
+            row.skip("This school ID belongs to a teacher account.")
+        elif row.school_id in already:
+            row.status = ALREADY_ENROLLED
+        else:
+            row.status = ENROLLED if row.school_id in existing else CREATED
+            enrollments.append(Enrollment(class_id=klass, student_id_id=row.school_id))
+    Enrollment.objects.bulk_create(enrollments, ignore_conflicts=True)
+    # bulk_create sends no post_save, so the students' class lists are invalidated here
+    bump_after_commit(*(f"classes:{enrollment.student_id_id}" for enrollment in enrollments))
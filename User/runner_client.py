@@ -0,0 +1,204 @@
+"""
+HTTP client for the Piston code runner.
+
+One client is shared per process. It keeps pooled keep-alive connections,
+resolves and caches runtime versions instead of sending "*", retries
+transient failures with jittered backoff, stops calling the runner while it
+is unhealthy (circuit breaker) and caps requests in flight, so overload turns
+into a fast RunnerUnavailable (503) instead of piled-up worker threads.
+"""
+
+import random, threading, time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Responses worth retrying: the runner is rate limiting or briefly down
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class RunnerUnavailable(Exception):
+    """The runner is overloaded or failing; callers should answer 503 / retry later."""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single probe call through (half-open).
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._probe_thread = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            self._probe_thread = threading.get_ident()
+            return True
+
+    def end_call(self):
+        """Called after every allowed call, so a probe that neither succeeded nor failed lets the next one through."""
+        with self._lock:
+            if self.probing and self._probe_thread == threading.get_ident():
+                self.probing = False
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0
+        return max(1, int(self.reset_timeout - (time.monotonic() - self.opened_at)))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class RunnerClient:
+    def __init__(self, base_url, pool_size=10, max_in_flight=20, retries=2, backoff=0.2,
+                 breaker=None, runtimes_ttl=3600, runtimes_retry_ttl=30):
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.runtimes_ttl = runtimes_ttl
+        self.runtimes_retry_ttl = runtimes_retry_ttl
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        # Last known {language: version}, fetched again once _runtimes_expires passes
+        self._runtimes = None
+        self._runtimes_expires = 0
+        self._runtimes_fetching = False
+        self._runtimes_lock = threading.Lock()
+
+    # ---------------- RUNTIMES ---------------- #
+
+    def runtime_version(self, language):
+        """
+        Returns the newest installed version of a language, or "*" if it can't be resolved.
+        One caller at a time refreshes the versions; the others use the last known ones meanwhile.
+        """
+        with self._runtimes_lock:
+            refresh = not self._runtimes_fetching and time.monotonic() >= self._runtimes_expires
+            if refresh:
+                self._runtimes_fetching = True
+            runtimes = self._runtimes
+        if refresh:
+            runtimes = self._refresh_runtimes()
+        return (runtimes or {}).get(language, "*")
+
+    def _refresh_runtimes(self):
+        # A failed fetch keeps the last known versions ("*" still works, just slower)
+        # and is tried again after runtimes_retry_ttl, not on every call
+        runtimes, ttl = self._runtimes, self.runtimes_retry_ttl
+        try:
+            runtimes, ttl = self._fetch_runtimes(), self.runtimes_ttl
+        except (requests.RequestException, ValueError, RunnerUnavailable):
+            pass
+        finally:
+            with self._runtimes_lock:
+                self._runtimes = runtimes
+                self._runtimes_expires = time.monotonic() + ttl
+                self._runtimes_fetching = False
+        return runtimes
+
+    def _fetch_runtimes(self):
+        res = self.request("get", "/runtimes", timeout=5)
+        versions = {}
+        for runtime in res.json():
+            version = runtime.get("version", "")
+            for name in [runtime.get("language")] + runtime.get("aliases", []):
+                if name and _version_key(version) > _version_key(versions.get(name, "")):
+                    versions[name] = version
+        return versions
+
+    # ---------------- REQUESTS ---------------- #
+
+    def execute(self, payload, timeout):
+        return self.request("post", "/execute", json=payload, timeout=timeout)
+
+    def request(self, method, path, **kwargs):
+        """
+        Sends a request through the pooled session with retries.
+        Raises RunnerUnavailable when overloaded, when the breaker is open or when retries run out.
+        requests.Timeout is raised as is: the program may just be slow.
+        """
+        if not self._in_flight.acquire(blocking=False):
+            raise RunnerUnavailable("⚠️ Code runner is busy, please try again.", retry_after=2)
+
+        try:
+            if not self.breaker.allow():
+                raise RunnerUnavailable(
+                    "⚠️ Code runner is temporarily unavailable.", retry_after=self.breaker.retry_after()
+                )
+
+            try:
+                return self._send(method, path, **kwargs)
+            finally:
+                self.breaker.end_call()
+        finally:
+            self._in_flight.release()
+
+    def _send(self, method, path, **kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                res = self.session.request(method, self.base_url + path, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise RunnerUnavailable(
+                        "⚠️ Code runner is unreachable, please try again.", retry_after=self.breaker.retry_after() or 5
+                    ) from e
+            except requests.Timeout:
+                # Not retried, and not a breaker failure: it is usually a slow student program
+                raise
+            else:
+                if res.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return res
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise RunnerUnavailable(
+                        f"⚠️ Code runner is overloaded ({res.status_code}).",
+                        retry_after=_retry_after(res),
+                    )
+
+            # Exponential backoff with full jitter
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+
+def _version_key(version):
+    return tuple(int(part) if part.isdigit() else 0 for part in version.split("."))
+
+
+def _retry_after(res):
+    try:
+        return int(res.headers.get("Retry-After", 5))
+    except ValueError:
+        return 5
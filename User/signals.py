@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .middleware import bump_user_version
+from .models import Class, Enrollment, Problem, ProblemTestCase, User
+from .versioning import bump_versions
+
+
+def bump_after_commit(*names):
+    # After commit, so a request reading the old rows can't cache them under the new version
+    transaction.on_commit(lambda: bump_versions(names))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_current_user(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_user_version(instance.school_id))
+
+
+@receiver([post_save, post_delete], sender=Class)
+def invalidate_class(sender, instance, **kwargs):
+    bump_after_commit(f"class:{instance.class_id}", f"classes:{instance.teacher_id}")
+
+
+@receiver([post_save, post_delete], sender=Enrollment)
+def invalidate_enrollment(sender, instance, **kwargs):
+    bump_after_commit(f"classes:{instance.student_id_id}")
+
+
+@receiver([post_save, post_delete], sender=Problem)
+def invalidate_class_problems(sender, instance, **kwargs):
+    bump_after_commit(f"class:{instance.class_id_id}", f"problem:{instance.problem_id}")
+
+
+@receiver([post_save, post_delete], sender=ProblemTestCase)
+def invalidate_problem_test_cases(sender, instance, **kwargs):
+    # bulk_create/bulk_update send no signals; testcases.py bumps the version for those
+    bump_after_commit(f"problem:{instance.problem_id_id}")
@@ -0,0 +1,37 @@
+from django import template
+from django.db.models.fields.files import FieldFile
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from User.images import PLACEHOLDER_IMAGES, VARIANT_FORMATS, has_variant, variant_url
+
+register = template.Library()
+
+
+@register.filter
+def variant(image, size):
+    """{{ user.user_image|variant:"sm" }}: URL of the JPEG variant, or of the original until it exists."""
+    return variant_url(image, size) if isinstance(image, FieldFile) else ""
+
+
+@register.simple_tag
+def picture(image, size, default="", **attrs):
+    """
+    {% picture cls.upload_icon "md" default="img/classroom.png" alt="Class Icon" class="rounded" %}
+
+    A <picture> offering the WebP variant with a JPEG fallback. Without an
+    uploaded image it is an <img> of the `default` static file; before the
+    variants are written, an <img> of the original.
+    """
+    attributes = format_html_join("", ' {}="{}"', attrs.items())
+    if not isinstance(image, FieldFile) or not image or image.name in PLACEHOLDER_IMAGES:
+        return format_html('<img src="{}"{}>', static(default), attributes) if default else ""
+    if not has_variant(image, size):
+        return format_html('<img src="{}"{}>', image.url, attributes)
+
+    *preferred, (fallback, _) = VARIANT_FORMATS
+    sources = format_html_join(
+        "", '<source type="image/{}" srcset="{}">',
+        ((image_format.lower(), variant_url(image, size, extension)) for extension, image_format in preferred),
+    )
+    return format_html('<picture>{}<img src="{}"{}></picture>', sources, variant_url(image, size, fallback), attributes)
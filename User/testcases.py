@@ -0,0 +1,280 @@
+"""
+Test case parsing, bulk import and bulk writes for problems.
+
+The add/edit problem forms post any number of inputN/outputN pairs. Test
+cases can also be imported from an uploaded file:
+
+    CSV  two columns, input and output (an "input,output" header row is optional)
+    zip  files paired by name: 1.in / 1.out (or .ans), or input1.txt / output1.txt
+
+Cases are written with one bulk_create. The edit form posts idN with each
+saved case it shows, and editing matches cases by that ID: unchanged cases
+are not rewritten, edited ones are updated in place, removed ones are deleted
+and new ones are added after the rest.
+Data above TESTCASE_INLINE_MAX_BYTES is moved to content-addressed files
+(testdata.py). The edit form can't round-trip those, so it posts keepN with
+the case's ID instead of inputN/outputN.
+"""
+
+import csv, io, re, zipfile
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ProblemTestCase
+from .signals import bump_after_commit
+from .testdata import StoredData, store_testdata
+
+FIELD_RE = re.compile(r"^(input|output|keep|id)(\d+)$")
+ZIP_NAME_RE = re.compile(r"^(?:(input|output)[_-]?)?(.+?)$", re.IGNORECASE)
+INPUT_EXTENSIONS = {".in"}
+OUTPUT_EXTENSIONS = {".out", ".ans"}
+
+
+class TestCaseImportError(ValueError):
+    """The uploaded test case file can't be read; the message is shown to the teacher."""
+
+
+class KeptCase:
+    """
+    An existing test case posted back by ID, with its edited (input, output) in `pair`,
+    or pair None when the edit form leaves it as it is.
+    """
+
+    def __init__(self, testcase_id, pair=None):
+        self.testcase_id = testcase_id
+        self.pair = pair
+
+
+def parse_test_cases(post):
+    """
+    Returns [(input, output) or KeptCase, ...] from inputN/outputN/idN/keepN form fields,
+    in N order, skipping empty pairs (so an emptied saved case is deleted).
+    """
+    numbers = sorted({int(m.group(2)) for m in map(FIELD_RE.match, post.keys()) if m})
+    pairs = []
+    for n in numbers:
+        keep = post.get(f"keep{n}", "")
+        if keep.isdigit():
+            pairs.append(KeptCase(int(keep)))
+            continue
+        input_data = post.get(f"input{n}", "").strip()
+        output_data = post.get(f"output{n}", "").strip()
+        if input_data or output_data:
+            testcase_id = post.get(f"id{n}", "")
+            if testcase_id.isdigit():
+                pairs.append(KeptCase(int(testcase_id), (input_data, output_data)))
+            else:
+                pairs.append((input_data, output_data))
+    return pairs
+
+
+def parse_test_case_upload(upload):
+    """Returns [(input, output), ...] from an uploaded .csv or .zip file."""
+    name = (upload.name or "").lower()
+    if name.endswith(".zip"):
+        pairs = _parse_zip(upload)
+    elif name.endswith(".csv"):
+        pairs = _parse_csv(upload)
+    else:
+        raise TestCaseImportError("Test cases must be uploaded as a .csv or .zip file.")
+
+    if len(pairs) > settings.TESTCASE_MAX_COUNT:
+        raise TestCaseImportError(f"At most {settings.TESTCASE_MAX_COUNT} test cases can be imported.")
+    return pairs
+
+
+def _parse_csv(upload):
+    # Checked before reading, and the read is bounded in case the reported size is wrong
+    too_large = TestCaseImportError(f"{upload.name} is larger than {settings.TESTCASE_MAX_BYTES} bytes.")
+    if upload.size is not None and upload.size > settings.TESTCASE_MAX_BYTES:
+        raise too_large
+    data = upload.read(settings.TESTCASE_MAX_BYTES + 1)
+    if len(data) > settings.TESTCASE_MAX_BYTES:
+        raise too_large
+
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise TestCaseImportError("The CSV file must be UTF-8 encoded.")
+
+    pairs = []
+    for row_number, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not any(cell.strip() for cell in row):
+            continue
+        if row_number == 1 and [cell.strip().lower() for cell in row[:2]] == ["input", "output"]:
+            continue
+        if len(row) < 2:
+            raise TestCaseImportError(f"CSV row {row_number} needs an input and an output column.")
+        pairs.append((row[0].strip(), row[1].strip()))
+    return pairs
+
+
+def _parse_zip(upload):
+    try:
+        archive = zipfile.ZipFile(upload)
+    except zipfile.BadZipFile:
+        raise TestCaseImportError("The zip file is damaged or not a zip file.")
+
+    with archive:
+        members = _zip_members(archive)
+        inputs, outputs = {}, {}
+        try:
+            # Small files first and large ones stored last, so a bad file fails the import before anything is stored
+            for info, kind, key in sorted(members, key=lambda member: member[0].file_size > settings.TESTCASE_INLINE_MAX_BYTES):
+                if info.file_size > settings.TESTCASE_INLINE_MAX_BYTES:
+                    # Large files go straight to storage without being read into memory
+                    with archive.open(info) as f:
+                        content = store_testdata(f)
+                else:
+                    try:
+                        content = archive.read(info).decode("utf-8-sig").strip()
+                    except UnicodeDecodeError:
+                        raise TestCaseImportError(f"{info.filename} must be UTF-8 text.")
+                (inputs if kind == "input" else outputs)[key] = content
+        except zipfile.BadZipFile:
+            raise TestCaseImportError("The zip file is damaged or not a zip file.")
+    return [(inputs[key], outputs[key]) for key in sorted(inputs, key=_natural_key)]
+
+
+def _zip_members(archive):
+    """
+    Returns (info, kind, key) for the zip's test case files.
+    Sizes, counts and pairing are all checked from the zip's directory, so a zip bomb is
+    rejected without inflating it and a bad zip is rejected before any file is stored.
+    """
+    members, total = [], 0
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        path = PurePosixPath(info.filename)
+        if path.name.startswith(".") or "__MACOSX" in path.parts:
+            continue
+
+        kind, key = _classify_zip_name(path)
+        if kind is None:
+            continue
+        if info.file_size > settings.TESTCASE_MAX_BYTES:
+            raise TestCaseImportError(f"{info.filename} is larger than {settings.TESTCASE_MAX_BYTES} bytes.")
+        total += info.file_size
+        if total > settings.TESTCASE_IMPORT_MAX_BYTES:
+            raise TestCaseImportError(f"The test case files add up to more than {settings.TESTCASE_IMPORT_MAX_BYTES} bytes.")
+        members.append((info, kind, key))
+        # An input and an output file per case
+        if len(members) > 2 * settings.TESTCASE_MAX_COUNT:
+            raise TestCaseImportError(f"At most {settings.TESTCASE_MAX_COUNT} test cases can be imported.")
+
+    inputs = {key for _, kind, key in members if kind == "input"}
+    outputs = {key for _, kind, key in members if kind == "output"}
+    missing = sorted(inputs ^ outputs, key=_natural_key)
+    if missing:
+        raise TestCaseImportError(f"Test case '{missing[0]}' needs both an input and an output file.")
+    return members
+
+
+def _classify_zip_name(path):
+    """Returns ("input" | "output", case key) for a file in the zip, or (None, None) to skip it."""
+    suffix = path.suffix.lower()
+    if suffix in INPUT_EXTENSIONS:
+        return "input", str(path.with_suffix(""))
+    if suffix in OUTPUT_EXTENSIONS:
+        return "output", str(path.with_suffix(""))
+
+    match = ZIP_NAME_RE.match(path.stem)
+    if match.group(1):
+        return match.group(1).lower(), str(path.parent / match.group(2))
+    return None, None
+
+
+def _natural_key(name):
+    # "2" sorts before "10"
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def _build_case(problem, input_data, output_data):
+    """An unsaved ProblemTestCase; large data is stored as files with previews in the text fields."""
+    def is_large(value):
+        return isinstance(value, StoredData) or len(value.encode("utf-8")) > settings.TESTCASE_INLINE_MAX_BYTES
+
+    if not (is_large(input_data) or is_large(output_data)):
+        return ProblemTestCase(problem_id=problem, input_data=input_data, expected_output=output_data)
+
+    # Both sides become files so the runner can stream the case end to end
+    stored_input = input_data if isinstance(input_data, StoredData) else store_testdata(input_data)
+    stored_output = output_data if isinstance(output_data, StoredData) else store_testdata(output_data)
+    return ProblemTestCase(
+        problem_id=problem,
+        input_data=stored_input.preview,
+        expected_output=stored_output.preview,
+        input_file=stored_input.name,
+        output_file=stored_output.name,
+    )
+
+
+def _case_values(tc):
+    return (tc.input_data, tc.expected_output, tc.input_file.name or "", tc.output_file.name or "", tc.content_hash)
+
+
+def _new_case(problem, pair, by_id):
+    """An unsaved case for pair (a copy when it keeps a saved case as it is), or None if there's nothing to copy."""
+    if isinstance(pair, KeptCase) and pair.pair is None:
+        kept = by_id.get(pair.testcase_id)
+        if kept is None:
+            return None
+        tc = ProblemTestCase(
+            problem_id=problem, input_data=kept.input_data, expected_output=kept.expected_output,
+            input_file=kept.input_file.name, output_file=kept.output_file.name,
+        )
+    else:
+        tc = _build_case(problem, *(pair.pair if isinstance(pair, KeptCase) else pair))
+    tc.content_hash = tc.compute_content_hash()
+    return tc
+
+
+def create_test_cases(problem, pairs):
+    """Adds the cases to a problem in one INSERT."""
+    cases = [_new_case(problem, pair, {}) for pair in pairs]
+    ProblemTestCase.objects.bulk_create([tc for tc in cases if tc is not None])
+    bump_after_commit(f"problem:{problem.problem_id}")
+
+
+@transaction.atomic
+def sync_test_cases(problem, pairs):
+    """
+    Makes the problem's cases match pairs, by testcase_id: unchanged cases are left alone,
+    edited ones are updated in place, cases no longer posted are deleted and new ones inserted.
+    """
+    existing = {tc.testcase_id: tc for tc in ProblemTestCase.objects.filter(problem_id=problem)}
+    matched, changed, added = set(), [], []
+
+    for pair in pairs:
+        tc = existing.get(pair.testcase_id) if isinstance(pair, KeptCase) else None
+        if tc is None or tc.testcase_id in matched:
+            # A new case, or an ID that isn't this problem's (or was posted twice)
+            new = _new_case(problem, pair, existing)
+            if new is not None:
+                added.append(new)
+            continue
+
+        matched.add(tc.testcase_id)
+        if pair.pair is None:
+            continue
+        new = _new_case(problem, pair, existing)
+        if _case_values(tc) != _case_values(new):
+            tc.input_data, tc.expected_output = new.input_data, new.expected_output
+            tc.input_file, tc.output_file = new.input_file.name, new.output_file.name
+            tc.content_hash = new.content_hash
+            changed.append(tc)
+
+    if changed:
+        ProblemTestCase.objects.bulk_update(
+            changed, ["input_data", "expected_output", "input_file", "output_file", "content_hash"]
+        )
+
+    removed = set(existing) - matched
+    if removed:
+        ProblemTestCase.objects.filter(testcase_id__in=removed).delete()
+
+    ProblemTestCase.objects.bulk_create(added)
+    bump_after_commit(f"problem:{problem.problem_id}")
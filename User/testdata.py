@@ -0,0 +1,75 @@
+"""
+Content-addressed storage for large test case data.
+
+Inputs and expected outputs above TESTCASE_INLINE_MAX_BYTES are written to
+MEDIA_ROOT/testdata/<aa>/<sha256> instead of the database. Identical data is
+stored once, the file name doubles as the cache key for results, and the
+grader streams the input file into the program and compares its output
+against a memory map of the expected file.
+"""
+
+import hashlib, os, tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+TESTDATA_DIR = "testdata"
+COPY_CHUNK = 64 * 1024
+
+
+class StoredData:
+    """A stored test data file: its storage name plus a short text preview for display."""
+
+    def __init__(self, name, preview):
+        self.name = name
+        self.preview = preview
+
+    @property
+    def sha256(self):
+        return os.path.basename(self.name)
+
+
+def make_preview(head):
+    text = head[:settings.TESTCASE_PREVIEW_CHARS].decode("utf-8", errors="replace")
+    return text + "…" if len(head) > settings.TESTCASE_PREVIEW_CHARS else text
+
+
+def store_testdata(source):
+    """
+    Stores bytes, str or a binary file object under its SHA-256 and returns StoredData.
+    File objects are copied in chunks, so memory use doesn't depend on their size.
+    """
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+
+    root = os.path.join(settings.MEDIA_ROOT, TESTDATA_DIR)
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    head = b""
+
+    with tempfile.NamedTemporaryFile(dir=root, prefix=".upload-", delete=False) as tmp:
+        try:
+            chunks = [source] if isinstance(source, bytes) else iter(lambda: source.read(COPY_CHUNK), b"")
+            for chunk in chunks:
+                digest.update(chunk)
+                tmp.write(chunk)
+                if len(head) <= settings.TESTCASE_PREVIEW_CHARS:
+                    head += chunk[:settings.TESTCASE_PREVIEW_CHARS + 1 - len(head)]
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+
+    sha = digest.hexdigest()
+    name = f"{TESTDATA_DIR}/{sha[:2]}/{sha}"
+    path = default_storage.path(name)
+    if os.path.exists(path):
+        # Already stored by another test case
+        os.unlink(tmp.name)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp.name, path)
+    return StoredData(name, make_preview(head))
+
+
+def testdata_path(name):
+    return default_storage.path(name)
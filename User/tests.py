@@ -1,3 +1,1019 @@
-from django.test import TestCase
+import io, json, os, shutil, tempfile, threading, time, zipfile
+from datetime import timedelta
+from types import SimpleNamespace
+from concurrent.futures.process import BrokenProcessPool
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.sessions import SessionMiddlewareStack
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from . import metrics
+from .checks import check_local_runner, check_versioned_caches
+from .comparators import compare_output, make_comparator
+from .execution import LocalBackend, _compile_local, _result, get_backend
+from .execution_cache import cached_run
+from .exports import score_rows
+from .fragments import class_ids, class_list_version
+from .grading import claim_pending_submissions, grade_submission, run_test_cases
+from .images import process_image, variant_name
+from .middleware import load_user
+from .models import (
+    User, Class, Problem, ProblemTestCase, Enrollment, Submission, StudentProblemResult, SubmissionCaseResult,
+)
+from .problem_details import problem_payload
+from .regrade import queue_regrade, regrade_problem
+from .roster import ALREADY_ENROLLED, CREATED, ENROLLED, SKIPPED, RosterImportError, import_roster, parse_roster
+from .routing import websocket_urlpatterns
+from .runner_client import CircuitBreaker, RunnerClient, RunnerUnavailable
+from .testcases import KeptCase, TestCaseImportError, parse_test_case_upload, sync_test_cases
+from .throttling import GRADING, PLAYGROUND, Throttled, acquire_slot, release_slot, take_token
+from .views import review_submission
+
+
+def create_problem(teacher, klass, **fields):
+    fields = {
+        'problem_title': 'P', 'problem_description': '-', 'problem_type': 'Assignment',
+        'total_score': 10, 'time_limit': 5, 'due_date': timezone.now(), **fields,
+    }
+    return Problem.objects.create(class_id=klass, teacher_id=teacher, **fields)
+
+
+class HotQueryIndexTests(TestCase):
+    """
+    The busiest lookups must be answered from the composite indexes in
+    migration 0006. Each test runs EXPLAIN on a populated, analyzed table and
+    checks the plan names the expected index, so a model or query change that
+    falls back to a full scan fails here.
+    """
+
+    STUDENTS = 40
+    PROBLEMS_PER_CLASS = 10
+    SUBMISSIONS_PER_PAIR = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        students = User.objects.bulk_create([
+            User(school_id=f'S-{i}', first_name='S', last_name=str(i), password='x', user_type='Student')
+            for i in range(cls.STUDENTS)
+        ])
+        classes = Class.objects.bulk_create([
+            Class(class_code=f'C-{i}', title=f'Class {i}', teacher=teacher) for i in range(4)
+        ])
+        Enrollment.objects.bulk_create([
+            Enrollment(class_id=c, student_id=s) for c in classes for s in students
+        ])
+        problems = Problem.objects.bulk_create([
+            Problem(
+                class_id=c, teacher_id=teacher, problem_title=f'P{i}', problem_description='-',
+                problem_type='Quiz' if i % 2 else 'Assignment', total_score=10, time_limit=5,
+                due_date=timezone.now(),
+            )
+            for c in classes for i in range(cls.PROBLEMS_PER_CLASS)
+        ])
+        Submission.objects.bulk_create([
+            Submission(problem_id=p, student_id=s, code='print(1)', status=Submission.GRADED)
+            for p in problems for s in students for _ in range(cls.SUBMISSIONS_PER_PAIR)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        cls.student = students[7]
+        cls.klass = classes[2]
+        cls.problem = problems[25]
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f'Expected {index_name} in the query plan:\n{plan}')
+
+    def test_latest_submission_uses_composite_index(self):
+        qs = Submission.objects.filter(
+            student_id=self.student, problem_id=self.problem
+        ).order_by('-submission_id')[:1]
+        self.assertUsesIndex(qs, 'submission_latest_idx')
+
+    def test_class_problem_list_uses_composite_index(self):
+        qs = Problem.objects.filter(class_id=self.klass, problem_type='Quiz').order_by('-problem_id')
+        self.assertUsesIndex(qs, 'problem_class_type_idx')
+
+    def test_student_enrollments_use_student_index(self):
+        qs = Enrollment.objects.filter(student_id=self.student).values_list('class_id', flat=True)
+        self.assertUsesIndex(qs, 'enrollment_student_idx')
+
+    def test_grading_queue_poll_uses_queue_index(self):
+        qs = Submission.objects.filter(status=Submission.PENDING, graded_at__isnull=True).order_by('submission_id')[:1]
+        self.assertUsesIndex(qs, 'submission_queue_idx')
+
+
+class TerminalConsumerTests(TransactionTestCase):
+    """Connecting to the playground terminal with and without a logged-in session."""
+
+    def setUp(self):
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        User.objects.create(school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student')
+        klass = Class.objects.create(class_code='C-1', title='Class', teacher=teacher)
+        self.problem = create_problem(teacher, klass)
+        self.application = SessionMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    def communicator(self, session_key=None):
+        headers = []
+        if session_key:
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()))
+        return WebsocketCommunicator(self.application, f'/ws/playground/{self.problem.pk}/', headers=headers)
+
+    async def test_logged_in_user_connects(self):
+        communicator = self.communicator(await self.login())
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+    async def login(self):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session['school_id'] = 'S-1'
+        await session.asave()
+        return session.session_key
+
+    async def test_streamed_output_is_capped(self):
+        limits = {**settings.CODE_RUNNER_LIMITS, 'stdout_max_bytes': 10000}
+        with override_settings(CODE_RUNNER_BACKEND='local', CODE_RUNNER_LIMITS=limits):
+            get_backend.cache_clear()
+            self.addCleanup(get_backend.cache_clear)
+            communicator = self.communicator(await self.login())
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'run', 'language': 'python', 'code': "while True: print('x' * 1000)"})
+
+            messages = []
+            while not messages or messages[-1]['type'] != 'exit':
+                messages.append(await communicator.receive_json_from(timeout=30))
+            await communicator.disconnect()
+
+        stdout = ''.join(m['data'] for m in messages if m['type'] == 'stdout')
+        self.assertEqual(len(stdout), 10000)
+        self.assertTrue(any(m['type'] == 'error' and 'truncated' in m['data'] for m in messages))
+
+    async def test_failed_spawn_releases_the_slot_and_work_dir(self):
+        with override_settings(CODE_RUNNER_BACKEND='local'):
+            get_backend.cache_clear()
+            self.addCleanup(get_backend.cache_clear)
+            backend = get_backend()
+            released = []
+            backend.release = lambda program: (released.append(program.workdir), shutil.rmtree(program.workdir))
+            communicator = self.communicator(await self.login())
+            await communicator.connect()
+            with mock.patch('User.consumers.asyncio.create_subprocess_exec', side_effect=FileNotFoundError('prlimit')):
+                await communicator.send_json_to({'type': 'run', 'language': 'python', 'code': 'print(1)'})
+                error = await communicator.receive_json_from(timeout=30)
+                exit = await communicator.receive_json_from(timeout=30)
+            await communicator.disconnect()
+
+        self.assertEqual((error['type'], exit['type']), ('error', 'exit'))
+        self.assertEqual(len(released), 1)
+        self.assertFalse(os.path.exists(released[0]))
+        # Every playground slot is free again
+        self.assertFalse(await sync_to_async(cache.get_many)([f'runner:slot:{i}' for i in range(settings.RUNNER_MAX_CONCURRENCY)]))
+
+    async def test_anonymous_user_is_rejected(self):
+        communicator = self.communicator()
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4403)
+
+
+class RunnerFailureTests(TestCase):
+    """A failure of the runner itself must never be graded as the student's mistake."""
+
+    @classmethod
+    def setUpTestData(cls):
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        cls.student = User.objects.create(school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student')
+        klass = Class.objects.create(class_code='C-1', title='Class', teacher=teacher)
+        cls.problem = create_problem(teacher, klass)
+        ProblemTestCase.objects.create(problem_id=cls.problem, input_data='1', expected_output='1')
+
+    def broken_backend(self):
+        backend = LocalBackend(pool_size=1)
+        backend._pool = mock.Mock(submit=mock.Mock(side_effect=BrokenProcessPool()))
+        return backend
+
+    def test_broken_pool_raises_runner_unavailable(self):
+        backend = self.broken_backend()
+        with self.assertRaises(RunnerUnavailable):
+            backend.compile('python', 'print(1)')
+        # The next call starts a fresh pool
+        self.assertIsNone(backend._pool)
+
+    def test_runner_failure_requeues_instead_of_grading(self):
+        submission = Submission.objects.create(
+            problem_id=self.problem, student_id=self.student, code='print(1)', status=Submission.RUNNING,
+        )
+        with mock.patch('User.grading.get_backend', return_value=self.broken_backend()):
+            with self.assertRaises(RunnerUnavailable):
+                grade_submission(submission)
+
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, Submission.PENDING)
+        self.assertIsNone(submission.graded_at)
+        self.assertEqual(submission.result_summary, '')
+
+
+@override_settings(METRICS_FLUSH_INTERVAL=3600, METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        caches['metrics'].clear()
+        metrics.flush()
+
+    def samples(self):
+        samples = {}
+        for line in metrics.render_metrics().splitlines():
+            if line and not line.startswith('#'):
+                series, value = line.rsplit(' ', 1)
+                samples[series] = float(value)
+        return samples
+
+    def test_histograms_stay_consistent_with_many_series(self):
+        # Far more keys than a default LocMemCache holds before culling
+        for view in range(60):
+            for value in (0.003, 0.2, 4):
+                metrics.observe('http_request_duration_seconds', value, view=f'v{view}', method='GET', status=200)
+        metrics.flush()
+
+        samples = self.samples()
+        for view in range(60):
+            labels = f'method="GET",status="200",view="v{view}"'
+            buckets = [
+                samples[f'paulicode_http_request_duration_seconds_bucket{{{labels},le="{bound}"}}']
+                for bound in (*metrics.LATENCY_BUCKETS, '+Inf')
+            ]
+            self.assertEqual(buckets, sorted(buckets))
+            self.assertEqual(buckets[-1], 3)
+            self.assertEqual(samples[f'paulicode_http_request_duration_seconds_count{{{labels}}}'], 3)
+            self.assertAlmostEqual(samples[f'paulicode_http_request_duration_seconds_sum{{{labels}}}'], 4.203)
+
+    def test_flushes_add_up(self):
+        metrics.inc('runner_errors_total', language='python', operation='run', kind='error')
+        metrics.flush()
+        metrics.inc('runner_errors_total', 2, language='python', operation='run', kind='error')
+        metrics.flush()
+        key = 'paulicode_runner_errors_total{kind="error",language="python",operation="run"}'
+        self.assertEqual(self.samples()[key], 3)
+
+    def test_endpoint_requires_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'paulicode_http_request_duration_seconds_bucket', response.content)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_endpoint_is_off_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_labels_come_from_a_fixed_set(self):
+        backend = metrics.MeteredBackend(mock.Mock(execute=mock.Mock(return_value={'error': 'x'})))
+        for language in ('Python3', 'made-up-1', 'made-up-2', None):
+            backend.execute(language, 'code')
+        self.client.generic('PROPFIND', '/metrics')
+        metrics.flush()
+
+        samples = self.samples()
+        self.assertEqual(samples['paulicode_runner_errors_total{kind="error",language="python",operation="execute"}'], 2)
+        self.assertEqual(samples['paulicode_runner_errors_total{kind="error",language="other",operation="execute"}'], 2)
+        self.assertFalse(any('made-up' in series or 'PROPFIND' in series for series in samples))
+        self.assertTrue(any('method="other"' in series for series in samples))
+
+    def test_observing_never_flushes_inline(self):
+        with mock.patch.object(metrics, '_flush') as flush:
+            metrics.inc('runner_errors_total', language='python', operation='run', kind='error')
+        flush.assert_not_called()
+
+    @mock.patch.object(metrics, 'LOCK_WAIT_SEC', 0.05)
+    def test_held_lock_is_given_up_on(self):
+        caches['metrics'].add(metrics.LOCK_KEY, 'another process')
+        metrics.inc('runner_errors_total', language='python', operation='run', kind='error')
+        self.assertFalse(metrics.flush())
+        self.assertIsNone(metrics.render_metrics())
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 503)
+
+        # The counts were kept for the next flush
+        caches['metrics'].delete(metrics.LOCK_KEY)
+        self.assertTrue(metrics.flush())
+        key = 'paulicode_runner_errors_total{kind="error",language="python",operation="run"}'
+        self.assertEqual(self.samples()[key], 1)
+
+
+class ImageProcessingTests(TestCase):
+    """Uploads are stripped into a new file, and only never-rewritten names are cached as immutable."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self):
+        exif = Image.Exif()
+        exif[0x8825] = {2: (14.0, 35.0, 0.0)}  # GPS latitude
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(buffer, format='JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_processed_copy_replaces_upload(self):
+        user = User.objects.create(
+            school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student', user_image=self.upload(),
+        )
+        uploaded = user.user_image.name
+        process_image(User, user.pk, 'user_image')
+
+        user.refresh_from_db()
+        self.assertNotEqual(user.user_image.name, uploaded)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, uploaded)))
+        with Image.open(user.user_image.path) as img:
+            self.assertFalse(img.getexif())
+        self.assertEqual(user.user_image_variants, ['sm', 'md'])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, variant_name(user.user_image.name, 'sm', 'webp'))))
+
+    def test_only_variants_are_immutable(self):
+        user = User.objects.create(
+            school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student', user_image=self.upload(),
+        )
+        upload_response = self.client.get(user.user_image.url)
+        self.assertEqual(upload_response.status_code, 200)
+        self.assertNotIn('immutable', upload_response['Cache-Control'])
+
+        process_image(User, user.pk, 'user_image')
+        user.refresh_from_db()
+        self.assertNotIn('immutable', self.client.get(user.user_image.url)['Cache-Control'])
+        variant = self.client.get(user.user_image.storage.url(variant_name(user.user_image.name, 'sm', 'webp')))
+        self.assertIn('immutable', variant['Cache-Control'])
+
+    def test_testdata_is_not_served(self):
+        os.makedirs(os.path.join(self.media_root, 'testdata'))
+        with open(os.path.join(self.media_root, 'testdata', 'case.in'), 'w') as f:
+            f.write('secret')
+        self.assertEqual(self.client.get('/media/testdata/case.in').status_code, 404)
+
+
+@override_settings(GRADING_QUEUE=True)
+class GradingQueueTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        cls.student = User.objects.create(school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student')
+        klass = Class.objects.create(class_code='C-1', title='Class', teacher=teacher)
+        cls.problem = create_problem(teacher, klass)
+
+    def submit(self, **fields):
+        return Submission.objects.create(problem_id=self.problem, student_id=self.student, code='print(1)', **fields)
+
+    def test_claims_oldest_pending_once(self):
+        first, second = self.submit(status=Submission.PENDING), self.submit(status=Submission.PENDING)
+        self.assertEqual(claim_pending_submissions(1), [first])
+        self.assertEqual(claim_pending_submissions(5), [second])
+        self.assertEqual(claim_pending_submissions(5), [])
+        first.refresh_from_db()
+        self.assertEqual(first.status, Submission.RUNNING)
+
+    def test_new_submissions_go_before_regrades(self):
+        old = [self.submit(status=Submission.GRADED, graded_at=timezone.now()) for _ in range(3)]
+        self.assertEqual(queue_regrade(self.problem), 3)
+        fresh = self.submit(status=Submission.PENDING)
+
+        self.assertEqual(claim_pending_submissions(2), [fresh, old[0]])
+        self.assertEqual(claim_pending_submissions(5), old[1:])
+
+    @override_settings(GRADING_CLAIM_TIMEOUT=60)
+    def test_stale_claims_are_picked_up_again(self):
+        stuck = self.submit(status=Submission.RUNNING, claimed_at=timezone.now() - timedelta(minutes=5))
+        self.submit(status=Submission.RUNNING, claimed_at=timezone.now())
+        self.assertEqual(claim_pending_submissions(5), [stuck])
+
+    @mock.patch('User.views.messages')
+    def test_review_never_touches_the_queue_status(self, messages):
+        submission = self.submit(status=Submission.PENDING)
+        for value in ('Graded', 'x' * 50, ''):
+            review_submission(RequestFactory().post('/', {'status': value, 'feedback': 'no'}), submission.pk)
+        submission.refresh_from_db()
+        self.assertEqual((submission.status, submission.review_status, submission.feedback), (Submission.PENDING, '', ''))
+
+        review_submission(RequestFactory().post('/', {'status': Submission.ACCEPTED, 'feedback': 'Nice'}), submission.pk)
+        submission.refresh_from_db()
+        self.assertEqual((submission.status, submission.review_status, submission.feedback), (Submission.PENDING, 'Accepted', 'Nice'))
+
+
+class RunnerClientTests(SimpleTestCase):
+
+    def client_with(self, *outcomes, threshold=3):
+        client = RunnerClient('http://runner', retries=1, backoff=0, breaker=CircuitBreaker(threshold, reset_timeout=60))
+        client.session.request = mock.Mock(side_effect=outcomes)
+        return client
+
+    def response(self, status):
+        return mock.Mock(status_code=status, headers={})
+
+    def test_retries_connection_errors(self):
+        client = self.client_with(requests.ConnectionError(), self.response(200))
+        self.assertEqual(client.request('get', '/').status_code, 200)
+
+    def test_connection_errors_past_retries_raise_runner_unavailable(self):
+        client = self.client_with(requests.ConnectionError(), requests.ConnectionError())
+        with self.assertRaises(RunnerUnavailable):
+            client.request('get', '/')
+        self.assertEqual(client.breaker.failures, 1)
+
+    def test_timeouts_do_not_open_the_breaker(self):
+        client = self.client_with(*[requests.Timeout()] * 5)
+        for _ in range(5):
+            with self.assertRaises(requests.Timeout):
+                client.request('post', '/execute')
+        self.assertIsNone(client.breaker.opened_at)
+
+    def test_breaker_opens_and_rejects(self):
+        client = self.client_with(*[self.response(503)] * 6, threshold=3)
+        for _ in range(3):
+            with self.assertRaises(RunnerUnavailable):
+                client.request('get', '/')
+        self.assertIsNotNone(client.breaker.opened_at)
+        with self.assertRaises(RunnerUnavailable):
+            client.request('get', '/')
+        # The open breaker answered without calling the runner
+        self.assertEqual(client.session.request.call_count, 6)
+
+    def test_failed_probe_does_not_block_later_probes(self):
+        client = self.client_with(ValueError('bad'), self.response(200))
+        client.breaker.opened_at = -1000  # open, and past reset_timeout
+        with self.assertRaises(ValueError):
+            client.request('get', '/')
+        self.assertFalse(client.breaker.probing)
+        self.assertEqual(client.request('get', '/').status_code, 200)
+        self.assertIsNone(client.breaker.opened_at)
+
+    def test_failed_runtime_fetch_is_not_retried_on_every_call(self):
+        runtimes = mock.Mock(status_code=200, headers={})
+        runtimes.json.return_value = [{'language': 'python', 'version': '3.12.0', 'aliases': []}]
+        client = self.client_with(runtimes, requests.ConnectionError(), requests.ConnectionError())
+        self.assertEqual(client.runtime_version('python'), '3.12.0')
+
+        # Expired: the failed refresh keeps the last known version and waits runtimes_retry_ttl
+        client._runtimes_expires = 0
+        for _ in range(5):
+            self.assertEqual(client.runtime_version('python'), '3.12.0')
+        self.assertEqual(client.session.request.call_count, 3)
+
+    def test_one_caller_fetches_the_runtimes(self):
+        fetching, release = threading.Event(), threading.Event()
+
+        def fetch():
+            fetching.set()
+            release.wait(5)
+            return {'python': '3.12.0'}
+
+        client = RunnerClient('http://runner')
+        client._fetch_runtimes = mock.Mock(side_effect=fetch)
+        first = threading.Thread(target=client.runtime_version, args=('python',))
+        first.start()
+        fetching.wait(5)
+        # Served at once while the first caller is still fetching
+        self.assertEqual(client.runtime_version('python'), '*')
+        release.set()
+        first.join()
+        self.assertEqual(client.runtime_version('python'), '3.12.0')
+        client._fetch_runtimes.assert_called_once()
+
+
+@override_settings(RUNNER_MAX_CONCURRENCY=4, RUNNER_RESERVED_FOR_GRADING=1)
+class ThrottlingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_requests_share_one_bucket(self):
+        passed = []
+        barrier = threading.Barrier(20)
+
+        def request():
+            barrier.wait()
+            passed.append(take_token('throttle:user:S-1', per_minute=1, burst=5) == 0)
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(passed), 5)
+
+    def test_playground_cannot_use_reserved_slots(self):
+        slots = [acquire_slot(PLAYGROUND) for _ in range(3)]
+        with self.assertRaises(Throttled):
+            acquire_slot(PLAYGROUND)
+        grading = acquire_slot(GRADING)
+        with self.assertRaises(Throttled):
+            acquire_slot(GRADING)
+
+        release_slot(slots.pop())
+        slots.append(acquire_slot(PLAYGROUND))
+        for slot in slots + [grading]:
+            release_slot(slot)
+
+    def test_expired_lease_frees_the_slot(self):
+        with mock.patch('User.throttling.time.sleep'):
+            stale = acquire_slot(GRADING)
+            cache.delete(stale[0])  # the lease ran out
+            fresh = acquire_slot(GRADING)
+            self.assertEqual(fresh[0], stale[0])
+            # Releasing the expired slot leaves its new holder alone
+            release_slot(stale)
+            self.assertEqual(cache.get(fresh[0]), fresh[1])
+
+    @override_settings(GRADING_QUEUE=False, GRADING_SLOT_WAIT=0, RUNNER_RESERVED_FOR_GRADING=0)
+    def test_inline_grading_without_capacity_marks_error(self):
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        User.objects.create(school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student')
+        problem = create_problem(teacher, Class.objects.create(class_code='C-1', title='Class', teacher=teacher))
+        ProblemTestCase.objects.create(problem_id=problem, input_data='1', expected_output='1')
+        session = self.client.session
+        session['school_id'] = 'S-1'
+        session.save()
+
+        slots = [acquire_slot(GRADING) for _ in range(4)]
+        response = self.client.post(
+            f'/submit_problem/{problem.pk}/', json.dumps({'code': 'print(1)', 'language': 'python'}),
+            content_type='application/json',
+        )
+        for slot in slots:
+            release_slot(slot)
+
+        self.assertEqual(response.status_code, 429)
+        submission = Submission.objects.get()
+        self.assertEqual(submission.status, Submission.ERROR)
+        self.assertIn('submit again', submission.result_summary)
+
+    @override_settings(EXECUTION_CACHE_ENABLED=False, GRADING_MAX_PARALLEL_CASES=4, GRADING_SLOT_WAIT=5)
+    def test_each_runner_call_holds_its_own_slot(self):
+        keys = [f'runner:slot:{i}' for i in range(4)]
+        held, barrier = [], threading.Barrier(4)
+
+        def run(program, stdin_data='', timeout_sec=5):
+            barrier.wait(5)
+            held.append(len(cache.get_many(keys)))
+            barrier.wait(5)
+            return _result(stdout=stdin_data)
+
+        backend = mock.Mock(run=mock.Mock(side_effect=run))
+        backend.compile.return_value = mock.Mock(compile_error='')
+        cases = [ProblemTestCase(input_data=str(i), expected_output=str(i)) for i in range(4)]
+        with mock.patch('User.grading.get_backend', return_value=backend):
+            _, results = run_test_cases('python', 'code', cases)
+
+        # Four cases ran at once, each under a slot of its own, and all were released
+        self.assertEqual(held, [4] * 4)
+        self.assertEqual([r['stdout'] for r in results], ['0\n', '1\n', '2\n', '3\n'])
+        self.assertEqual(cache.get_many(keys), {})
+
+
+class ExportTests(TestCase):
+
+    def test_scores_skip_results_of_non_students(self):
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        klass = Class.objects.create(class_code='C-1', title='Class', teacher=teacher)
+        problem = create_problem(teacher, klass)
+        # A teacher enrolled in their own class sorts before the student and has a result
+        admin = User.objects.create(school_id='A-1', first_name='A', last_name='A', password='x', user_type='Teacher')
+        student = User.objects.create(school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student')
+        for user, score in [(admin, 3), (student, 7)]:
+            Enrollment.objects.create(class_id=klass, student_id=user)
+            StudentProblemResult.objects.create(student_id=user, problem_id=problem, best_score=score)
+
+        rows = list(score_rows(klass))
+
+        self.assertEqual(rows[1:], [['S-1', 'S S', 7, 7]])
+
+
+class TestCaseImportTests(TestCase):
+
+    @override_settings(TESTCASE_MAX_BYTES=100)
+    def test_oversized_csv_is_rejected(self):
+        upload = SimpleUploadedFile('cases.csv', b'1,2\n' * 100, content_type='text/csv')
+        with self.assertRaises(TestCaseImportError):
+            parse_test_case_upload(upload)
+
+    @override_settings(TESTCASE_MAX_BYTES=100)
+    def test_csv_read_is_bounded_when_the_size_is_wrong(self):
+        upload = SimpleUploadedFile('cases.csv', b'1,2\n' * 100, content_type='text/csv')
+        upload.size = 4
+        with self.assertRaises(TestCaseImportError):
+            parse_test_case_upload(upload)
+
+    def zip_upload(self, files):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+        return SimpleUploadedFile('cases.zip', buffer.getvalue())
+
+    @override_settings(TESTCASE_INLINE_MAX_BYTES=10, TESTCASE_IMPORT_MAX_BYTES=1000, TESTCASE_MAX_COUNT=3)
+    def test_bad_zips_are_rejected_before_anything_is_stored(self):
+        large = b'1' * 400
+        uploads = {
+            'add up to more than': {f'{i}.in': large for i in range(3)} | {f'{i}.out': b'1' for i in range(3)},
+            'At most 3': {f'{i}.{ext}': b'1' for i in range(4) for ext in ('in', 'out')},
+            'must be UTF-8': {'1.in': large, '1.out': b'1', '2.in': b'\xff', '2.out': b'1'},
+            'needs both': {'1.in': large, '1.out': b'1', '2.in': b'1'},
+        }
+        with mock.patch('User.testcases.store_testdata') as store:
+            for message, files in uploads.items():
+                with self.assertRaisesMessage(TestCaseImportError, message):
+                    parse_test_case_upload(self.zip_upload(files))
+            store.assert_not_called()
+
+            pairs = parse_test_case_upload(self.zip_upload({'1.in': large, '1.out': b'one', '2.in': b'2', '2.out': b'two'}))
+        self.assertEqual([output for _, output in pairs], ['one', 'two'])
+        store.assert_called_once()
+
+    def test_sync_matches_cases_by_id(self):
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        problem = create_problem(teacher, Class.objects.create(class_code='C-1', title='Class', teacher=teacher))
+        first, second, third = (
+            ProblemTestCase.objects.create(problem_id=problem, input_data=str(i), expected_output=str(i))
+            for i in range(3)
+        )
+
+        # The second case is removed and the third edited; nothing shifts into the gap
+        sync_test_cases(problem, [
+            KeptCase(first.testcase_id, ('0', '0')), KeptCase(third.testcase_id, ('2', 'two')), ('3', '3'),
+        ])
+
+        cases = list(ProblemTestCase.objects.filter(problem_id=problem).order_by('testcase_id'))
+        self.assertEqual([tc.testcase_id for tc in cases[:2]], [first.testcase_id, third.testcase_id])
+        self.assertEqual(
+            [(tc.input_data, tc.expected_output) for tc in cases], [('0', '0'), ('2', 'two'), ('3', '3')]
+        )
+
+
+@override_settings(VERSIONED_CACHES=True)
+class ProblemDetailsCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        self.problem = create_problem(teacher, Class.objects.create(class_code='C-1', title='Class', teacher=teacher))
+
+    def test_saving_a_test_case_outside_the_views_refreshes_the_payload(self):
+        self.assertEqual(problem_payload(self.problem.pk)['data']['test_cases'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            tc = ProblemTestCase.objects.create(problem_id=self.problem, input_data='1', expected_output='2')
+        self.assertEqual(len(problem_payload(self.problem.pk)['data']['test_cases']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tc.delete()
+        self.assertEqual(problem_payload(self.problem.pk)['data']['test_cases'], [])
+
+    def test_saving_the_problem_refreshes_the_payload(self):
+        problem_payload(self.problem.pk)
+        self.problem.problem_title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.save()
+        self.assertEqual(problem_payload(self.problem.pk)['data']['title'], 'Renamed')
+
+    def test_bulk_writes_refresh_the_payload(self):
+        problem_payload(self.problem.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            sync_test_cases(self.problem, [('1', '2')])
+        self.assertEqual(len(problem_payload(self.problem.pk)['data']['test_cases']), 1)
+
+
+class VersionedCacheSettingsTests(TestCase):
+    locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://redis'}}
+
+    def test_versioned_caches_need_a_shared_cache(self):
+        with override_settings(VERSIONED_CACHES=True, CACHES=self.locmem):
+            self.assertEqual([e.id for e in check_versioned_caches(None)], ['User.E001'])
+        with override_settings(VERSIONED_CACHES=True, CACHES=self.redis):
+            self.assertEqual(check_versioned_caches(None), [])
+        with override_settings(VERSIONED_CACHES=False, CACHES=self.locmem):
+            self.assertEqual(check_versioned_caches(None), [])
+
+    @override_settings(VERSIONED_CACHES=False)
+    def test_disabled_caches_read_the_database(self):
+        cache.clear()
+        user = User.objects.create(school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student')
+        self.assertEqual(load_user('S-1').first_name, 'S')
+        # Changed behind the signals' back, as another process with its own cache would
+        User.objects.filter(pk=user.pk).update(first_name='Renamed')
+        self.assertEqual(load_user('S-1').first_name, 'Renamed')
+
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        problem = create_problem(teacher, Class.objects.create(class_code='C-1', title='Class', teacher=teacher))
+        Problem.objects.filter(pk=problem.pk).update(problem_title='Renamed')
+        self.assertEqual(problem_payload(problem.pk)['data']['title'], 'Renamed')
+        self.assertNotEqual(problem_payload(problem.pk)['version'], problem_payload(problem.pk)['version'])
+
+
+class ComparatorTests(SimpleTestCase):
+
+    def test_modes(self):
+        cases = [
+            ('exact', '1 2\n3', '  1 2\n3\n\n', True),
+            ('exact', '1 2', '1  2', False),
+            ('trailing_whitespace', 'a\nb', 'a  \nb\t\n\n', True),
+            ('trailing_whitespace', 'a\nb', ' a\nb', False),
+            ('tokens', '1 2\n3', '1\n2   3', True),
+            ('tokens', '1 2 3', '1 2', False),
+            ('unordered_lines', 'a\nb\nb', 'b\n\na\nb', True),
+            ('unordered_lines', 'a\nb\nb', 'a\na\nb', False),
+        ]
+        for mode, expected, actual, passed in cases:
+            with self.subTest(mode=mode, actual=actual):
+                self.assertEqual(compare_output(expected, actual, mode=mode)[0], passed)
+
+    def test_float_tolerance(self):
+        self.assertTrue(compare_output('0.3333333', '0.33333334', mode='float', abs_tol=1e-6, rel_tol=0)[0])
+        self.assertFalse(compare_output('0.3333', '0.3334', mode='float', abs_tol=1e-6, rel_tol=1e-6)[0])
+        self.assertFalse(compare_output('1.0', 'one', mode='float')[0])
+
+    def test_chunks_split_anywhere(self):
+        for mode in ['exact', 'trailing_whitespace', 'tokens', 'float', 'unordered_lines']:
+            with self.subTest(mode=mode):
+                comparator = make_comparator(b'10 20\n30', mode=mode)
+                for chunk in [b'1', b'0 2', b'0\n', b'3', b'0\n']:
+                    self.assertTrue(comparator.feed(chunk))
+                self.assertTrue(comparator.finish())
+
+    def test_mismatch_stops_early_and_names_the_line(self):
+        comparator = make_comparator(b'a\nb\nc', mode='trailing_whitespace')
+        self.assertFalse(comparator.feed(b'a\nx\n'))
+        self.assertIn('line 2', comparator.difference)
+
+    def test_long_single_line_is_streamed(self):
+        output = b' '.join(str(i).encode() for i in range(200000)) + b'\n'
+        for mode in ['tokens', 'float']:
+            with self.subTest(mode=mode):
+                comparator = make_comparator(output, mode=mode)
+                for offset in range(0, len(output), 4096):
+                    self.assertTrue(comparator.feed(output[offset:offset + 4096]))
+                    # Only the token cut off by the chunk is held, never the line so far
+                    self.assertLess(comparator.partial_bytes, 16)
+                self.assertTrue(comparator.finish())
+
+    @mock.patch('User.comparators.MAX_LINE_BYTES', 100)
+    def test_unfinished_line_is_capped(self):
+        for mode in ['trailing_whitespace', 'tokens', 'unordered_lines']:
+            with self.subTest(mode=mode):
+                comparator = make_comparator(b'x', mode=mode)
+                self.assertTrue(comparator.feed(b'y' * 60))
+                self.assertFalse(comparator.feed(b'y' * 60))
+                self.assertIn('longer than 100 bytes', comparator.difference)
+
+
+class LocalSandboxTests(SimpleTestCase):
+
+    def setUp(self):
+        self.backend = LocalBackend(pool_size=1, sandbox=['jail', '--root', '{workdir}', '--pids', '{processes}'])
+        self.addCleanup(self.backend._reset_pool)
+
+    def test_programs_start_through_prlimit_inside_the_sandbox(self):
+        popen = self.backend.popen_args(mock.Mock(language='python', workdir='/tmp/w'))
+
+        args = popen['args']
+        self.assertEqual(args[:5], ['jail', '--root', '/tmp/w', '--pids', str(settings.CODE_RUNNER_LIMITS['processes'])])
+        self.assertEqual(args[5], 'prlimit')
+        self.assertEqual(args[args.index('--') + 1:], ['python3', 'main.py'])
+        self.assertTrue(popen['start_new_session'])
+        self.assertNotIn('preexec_fn', popen)
+
+    @mock.patch('User.execution.COMPILE_TIMEOUT_SEC', 7)
+    def test_compiler_runs_under_the_limits(self):
+        with mock.patch('User.execution.subprocess.Popen') as popen, mock.patch('User.execution.shutil.which'):
+            popen.return_value.communicate.return_value = ('', '')
+            popen.return_value.returncode = 0
+            workdir, error = _compile_local('c', 'int main(){}', settings.CODE_RUNNER_LIMITS, [])
+        shutil.rmtree(workdir)
+        self.assertEqual(error, '')
+
+        args = popen.call_args.args[0]
+        self.assertEqual(args[0], 'prlimit')
+        self.assertIn('--cpu=7:8', args)
+        self.assertEqual(args[args.index('--') + 1], 'gcc')
+        self.assertTrue(popen.call_args.kwargs['start_new_session'])
+
+    def test_missing_runtime_is_a_runner_failure(self):
+        with mock.patch('User.execution.shutil.which', return_value=None):
+            with self.assertRaises(OSError):
+                self.backend.popen_args(mock.Mock(language='python', workdir='/tmp/w'))
+
+    def test_local_runner_needs_a_sandbox_in_production(self):
+        with override_settings(CODE_RUNNER_BACKEND='local', CODE_RUNNER_SANDBOX='', DEBUG=False):
+            self.assertEqual([e.id for e in check_local_runner(None)], ['User.E002'])
+        with override_settings(CODE_RUNNER_BACKEND='local', CODE_RUNNER_SANDBOX='nsjail --', DEBUG=False):
+            self.assertEqual(check_local_runner(None), [])
+        with override_settings(CODE_RUNNER_BACKEND='local', CODE_RUNNER_SANDBOX='', DEBUG=True):
+            self.assertEqual(check_local_runner(None), [])
+
+
+class FakeBackend:
+    """Echoes the test case input; counts compiles per program."""
+
+    def __init__(self):
+        self.compiled = []
+
+    def compile(self, language, code):
+        self.compiled.append(code)
+        return SimpleNamespace(compile_error='')
+
+    def run(self, program, stdin_data='', timeout_sec=5):
+        return _result(stdout=stdin_data)
+
+    def release(self, program):
+        pass
+
+
+@override_settings(EXECUTION_CACHE_ENABLED=False, GRADING_QUEUE=True)
+class RegradeTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        self.problem = create_problem(teacher, Class.objects.create(class_code='C-1', title='Class', teacher=teacher))
+        ProblemTestCase.objects.create(problem_id=self.problem, input_data='1', expected_output='1')
+        for i, code in enumerate(['a', 'a', 'b']):
+            student = User.objects.create(school_id=f'S-{i}', first_name='S', last_name='S', password='x', user_type='Student')
+            Submission.objects.create(
+                problem_id=self.problem, student_id=student, code=code,
+                status=Submission.GRADED, graded_at=timezone.now(),
+            )
+
+    def test_identical_code_runs_once_and_unchanged_cases_are_reused(self):
+        backend = FakeBackend()
+        with mock.patch('User.grading.get_backend', return_value=backend):
+            self.assertEqual(regrade_problem(self.problem, workers=1), (3, 0))
+            self.assertEqual(sorted(backend.compiled), ['a', 'b'])
+
+            backend.compiled.clear()
+            self.assertEqual(regrade_problem(self.problem, workers=1), (3, 0))
+            self.assertEqual(backend.compiled, [])
+
+        self.assertEqual(set(Submission.objects.values_list('score', flat=True)), {10})
+
+    def test_unavailable_runner_requeues_the_rest(self):
+        backend = FakeBackend()
+        backend.compile = mock.Mock(side_effect=RunnerUnavailable('down'))
+        with mock.patch('User.grading.get_backend', return_value=backend):
+            self.assertEqual(regrade_problem(self.problem, workers=1), (0, 3))
+        self.assertEqual(set(Submission.objects.values_list('status', flat=True)), {Submission.PENDING})
+
+    def test_timed_out_cases_are_run_again(self):
+        backend = FakeBackend()
+        with mock.patch('User.grading.get_backend', return_value=backend):
+            with mock.patch.object(backend, 'run', return_value=_result(error='⏱️ Timed out.')):
+                self.assertEqual(regrade_problem(self.problem, workers=1), (3, 0))
+            self.assertEqual(set(Submission.objects.values_list('score', flat=True)), {0})
+
+            backend.compiled.clear()
+            self.assertEqual(regrade_problem(self.problem, workers=1), (3, 0))
+            self.assertEqual(sorted(backend.compiled), ['a', 'b'])
+
+        self.assertEqual(set(Submission.objects.values_list('score', flat=True)), {10})
+        self.assertFalse(SubmissionCaseResult.objects.exclude(error='').exists())
+
+
+@override_settings(VERSIONED_CACHES=True)
+class FragmentVersionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        self.student = User.objects.create(school_id='S-1', first_name='S', last_name='S', password='x', user_type='Student')
+        self.klass = Class.objects.create(class_code='C-1', title='Class', teacher=self.teacher)
+
+    def test_enrolling_changes_the_class_list(self):
+        before = class_list_version('S-1')
+        self.assertEqual(class_ids('S-1')[1], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            import_roster(self.klass, self.parse('S-1,S,S'))
+
+        self.assertNotEqual(class_list_version('S-1'), before)
+        self.assertEqual(class_ids('S-1')[1], [self.klass.class_id])
+
+    def test_new_problem_changes_the_class_card(self):
+        before, unrelated = class_list_version('T-1'), class_list_version('S-1')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_problem(self.teacher, self.klass)
+        self.assertNotEqual(class_list_version('T-1'), before)
+        # The student isn't in the class, so their cards are untouched
+        self.assertEqual(class_list_version('S-1'), unrelated)
+
+    def parse(self, text):
+        return parse_roster(SimpleUploadedFile('roster.csv', text.encode('utf-8')))
+
+
+class ExecutionCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['execution'].clear()
+
+    def test_concurrent_identical_runs_are_coalesced(self):
+        calls = []
+        barrier = threading.Barrier(5)
+
+        def run():
+            calls.append(1)
+            time.sleep(0.2)
+            return _result(stdout='42')
+
+        def caller(results):
+            barrier.wait()
+            results.append(cached_run('run:test', run))
+
+        results = []
+        threads = [threading.Thread(target=caller, args=(results,)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result['stdout'] for result in results], ['42'] * 5)
+        self.assertEqual(cached_run('run:test', run)['stdout'], '42')
+        self.assertEqual(len(calls), 1)
+
+    def test_waits_for_another_process_holding_the_lock(self):
+        caches['execution'].add('run:test:lock', 1, timeout=10)
+        threading.Timer(0.2, lambda: caches['execution'].set('run:test', _result(stdout='42'))).start()
+        run = mock.Mock(return_value=_result(stdout='mine'))
+
+        self.assertEqual(cached_run('run:test', run)['stdout'], '42')
+        run.assert_not_called()
+
+    def test_runner_errors_are_not_cached(self):
+        run = mock.Mock(return_value=_result(error='⏱️ Timed out.'))
+        cached_run('run:test', run)
+        cached_run('run:test', run)
+        self.assertEqual(run.call_count, 2)
+
+    def test_takes_over_when_the_other_process_caches_nothing(self):
+        caches['execution'].add('run:test:lock', 1, timeout=10)
+        threading.Timer(0.2, lambda: caches['execution'].delete('run:test:lock')).start()
+        run = mock.Mock(return_value=_result(stdout='mine'))
+
+        start = time.monotonic()
+        self.assertEqual(cached_run('run:test', run, wait_sec=10)['stdout'], 'mine')
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertIsNone(caches['execution'].get('run:test:lock'))
+
+
+class RosterImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create(school_id='T-1', first_name='T', last_name='T', password='x', user_type='Teacher')
+        cls.klass = Class.objects.create(class_code='C-1', title='Class', teacher=cls.teacher)
+
+    def parse(self, text):
+        return parse_roster(SimpleUploadedFile('roster.csv', text.encode('utf-8')))
+
+    def test_header_aliases_and_invalid_rows(self):
+        rows = self.parse('Last,First,Student ID\nDoe,Jane,S-1\nRoe,,S-2\nDoe,John,S-1\n')
+        self.assertEqual([(r.school_id, r.first_name, r.last_name) for r in rows[:1]], [('S-1', 'Jane', 'Doe')])
+        self.assertEqual([r.status for r in rows], [None, SKIPPED, SKIPPED])
+
+    def test_import_creates_and_enrolls(self):
+        existing = User.objects.create(school_id='S-2', first_name='S', last_name='S', password='x', user_type='Student')
+        enrolled = User.objects.create(school_id='S-3', first_name='S', last_name='S', password='x', user_type='Student')
+        Enrollment.objects.create(class_id=self.klass, student_id=enrolled)
+        rows = self.parse('S-1,New,Student\nS-2,S,S\nS-3,S,S\nT-1,T,T\n')
+
+        import_roster(self.klass, rows)
+
+        self.assertEqual([r.status for r in rows], [CREATED, ENROLLED, ALREADY_ENROLLED, SKIPPED])
+        self.assertTrue(rows[0].generated_password)
+        self.assertEqual(User.objects.get(school_id='S-1').password, rows[0].generated_password)
+        self.assertEqual(
+            set(Enrollment.objects.filter(class_id=self.klass).values_list('student_id', flat=True)),
+            {'S-1', existing.school_id, enrolled.school_id},
+        )
+
+    @override_settings(ROSTER_IMPORT_MAX_BYTES=20)
+    def test_large_files_are_rejected_before_parsing(self):
+        text = 'S-1,Jane,Doe\nS-2,John,Doe\n'
+        with self.assertRaisesMessage(RosterImportError, 'larger than 20 bytes'):
+            self.parse(text)
+        # A reported size can be wrong; only limit + 1 bytes are read
+        upload = mock.Mock(size=None, read=mock.Mock(wraps=io.BytesIO(text.encode('utf-8')).read))
+        with self.assertRaises(RosterImportError):
+            parse_roster(upload)
+        upload.read.assert_called_once_with(21)
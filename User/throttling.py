@@ -0,0 +1,140 @@
+"""
+Admission control for runner calls.
+
+Playground runs pass two token buckets, one per student (school_id) and one
+per class, then take a slot from a global cap on concurrent runner calls.
+Graded submissions may use every slot while playground runs are limited to
+RUNNER_MAX_CONCURRENCY - RUNNER_RESERVED_FOR_GRADING, so a class hammering
+Run can never starve submissions.
+
+State lives in the default cache so limits hold across workers when it is
+Redis. Each bucket update holds a short per-bucket lock (cache.add), so
+concurrent requests can't all spend the same token. A runner slot is a lease
+key of its own, taken with cache.add and expiring after its lease, so a
+crashed worker's slot frees itself and no shared counter can be reset while
+slots are held.
+"""
+
+import math, time, uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+PLAYGROUND = "playground"
+GRADING = "grading"
+
+SLOT_WAIT_POLL_SEC = 0.2
+# A bucket's lock is only held for one get and one set
+BUCKET_LOCK_TTL_SEC = 2
+BUCKET_LOCK_WAIT_SEC = 1
+BUCKET_LOCK_POLL_SEC = 0.005
+
+
+class Throttled(Exception):
+    """Over a rate limit or out of runner capacity; answer 429 with Retry-After."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def _bucket_lock(key):
+    """Yields whether the lock was taken within BUCKET_LOCK_WAIT_SEC."""
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + BUCKET_LOCK_WAIT_SEC
+    while not cache.add(lock_key, token, timeout=BUCKET_LOCK_TTL_SEC):
+        if time.monotonic() >= deadline:
+            yield False
+            return
+        time.sleep(BUCKET_LOCK_POLL_SEC)
+    try:
+        yield True
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def take_token(key, per_minute, burst):
+    """Takes one token from a bucket refilled at per_minute; returns 0 or the seconds to wait."""
+    rate = per_minute / 60.0
+    with _bucket_lock(key) as locked:
+        if not locked:
+            # Only a flood of concurrent requests on one bucket keeps the lock busy this long
+            return 1
+        now = time.time()
+        tokens, updated = cache.get(key, (burst, now))
+
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            return max(1, math.ceil((1 - tokens) / rate))
+
+        # Long enough for an idle bucket to refill completely
+        cache.set(key, (tokens - 1, now), timeout=math.ceil(burst / rate) + 1)
+        return 0
+
+
+def check_playground_rate(school_id, class_id):
+    """Raises Throttled when the student or their class is over its run rate."""
+    wait = take_token(f"throttle:user:{school_id}", settings.THROTTLE_USER_PER_MINUTE, settings.THROTTLE_USER_BURST)
+    if wait:
+        raise Throttled("⚠️ You're running code too often. Please wait a moment.", retry_after=wait)
+
+    wait = take_token(f"throttle:class:{class_id}", settings.THROTTLE_CLASS_PER_MINUTE, settings.THROTTLE_CLASS_BURST)
+    if wait:
+        raise Throttled("⚠️ Your class is running a lot of code right now. Please try again shortly.", retry_after=wait)
+
+
+def _slot_keys(kind):
+    """
+    The slot keys a kind of call may take, in the order it tries them.
+    Playground runs only get the first RUNNER_MAX_CONCURRENCY - RUNNER_RESERVED_FOR_GRADING;
+    grading tries the reserved ones first, so it leaves the shared ones free.
+    """
+    keys = [f"runner:slot:{i}" for i in range(settings.RUNNER_MAX_CONCURRENCY)]
+    if kind == GRADING:
+        return keys[::-1]
+    return keys[:settings.RUNNER_MAX_CONCURRENCY - settings.RUNNER_RESERVED_FOR_GRADING]
+
+
+def acquire_slot(kind, wait=0, lease=None):
+    """
+    Takes a slot from the global runner concurrency cap, waiting up to `wait` seconds,
+    and returns it for release_slot(). The slot is freed after `lease` seconds
+    (RUNNER_SLOT_TTL by default) even if it is never released.
+    Raises Throttled if none frees up in time.
+    """
+    deadline = time.monotonic() + wait
+    keys = _slot_keys(kind)
+    token = uuid.uuid4().hex
+
+    while True:
+        taken = cache.get_many(keys)
+        for key in keys:
+            if key not in taken and cache.add(key, token, timeout=lease or settings.RUNNER_SLOT_TTL):
+                return key, token
+
+        if time.monotonic() >= deadline:
+            raise Throttled("⚠️ The code runner is at capacity. Please try again shortly.", retry_after=2)
+        time.sleep(SLOT_WAIT_POLL_SEC)
+
+
+def release_slot(slot):
+    key, token = slot
+    # A slot whose lease ran out may already belong to someone else
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+@contextmanager
+def runner_slot(kind, wait=None, lease=None):
+    """Holds a slot for one runner call; waits GRADING_SLOT_WAIT or PLAYGROUND_SLOT_WAIT by default."""
+    if wait is None:
+        wait = settings.GRADING_SLOT_WAIT if kind == GRADING else settings.PLAYGROUND_SLOT_WAIT
+    slot = acquire_slot(kind, wait=wait, lease=lease)
+    try:
+        yield
+    finally:
+        release_slot(slot)
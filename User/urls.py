@@ -16,10 +16,14 @@ urlpatterns = [
     path('delete-class/<int:class_id>/', views.delete_class, name='delete_class'),
     path('class/<int:class_id>/', views.classDetails, name='classDetails'),
     path('class/<int:class_id>/add-problem/', views.add_problem, name='add_problem'),
+    path('class/<int:class_id>/import-roster/', views.import_class_roster, name='import_class_roster'),
     path("problem/<int:problem_id>/details/", views.get_problem_details, name="get_problem_details"),
     path("problem/<int:problem_id>/edit/", views.edit_problem, name="edit_problem"),
     path("problem/<int:problem_id>/delete/", views.delete_problem, name="delete_problem"),
+    path("problem/<int:problem_id>/regrade/", views.regrade_problem, name="regrade_problem"),
+    path("problem/<int:problem_id>/regrade/status/", views.regrade_status, name="regrade_status"),
     path('report/', views.report, name='report'),  # Reports dashboard
+    path('report/<int:class_id>/export/<str:kind>.csv', views.export_report, name='export_report'),
     path('delete_student/<str:school_id>/', views.delete_student, name='delete_student'),
     path('delete_submission/<int:submission_id>/', views.delete_submission, name='delete_submission'),
    
@@ -39,6 +43,9 @@ urlpatterns = [
     path('playground/<int:problem_id>/', views.playground, name='playground'),
     path('run_playground_code/', views.run_playground_code, name='run_playground_code'),
     path('submit_problem/<int:problem_id>/', views.submit_problem, name='submit_problem'),
+    path('submission/<int:submission_id>/status/', views.submission_status, name='submission_status'),
+
+    path('metrics', views.metrics, name='metrics'),
 
 
 
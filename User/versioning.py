@@ -0,0 +1,47 @@
+"""
+Version tokens for cache invalidation.
+
+Cached values are stored under keys that include the current token for
+whatever they were built from (a user, a problem, ...). Replacing the token
+makes every older entry unreachable at once; they simply expire.
+
+The tokens only work if every process shares the default cache, so the
+caches built on them are skipped unless VERSIONED_CACHES is on (see the
+User.E001 check in checks.py).
+"""
+
+import uuid
+
+from django.core.cache import cache
+
+
+def _key(name):
+    return f"version:{name}"
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(_key(name), version, timeout=None):
+            # Another request created it first
+            version = cache.get(_key(name), version)
+    return version
+
+
+def bump_version(name):
+    cache.set(_key(name), uuid.uuid4().hex, timeout=None)
+
+
+def get_versions(names):
+    """{name: version} for several names in one cache round trip."""
+    found = cache.get_many([_key(name) for name in names])
+    versions = {}
+    for name in names:
+        version = found.get(_key(name))
+        versions[name] = version if version is not None else get_version(name)
+    return versions
+
+
+def bump_versions(names):
+    cache.set_many({_key(name): uuid.uuid4().hex for name in names}, timeout=None)
@@ -1,14 +1,35 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import User, Class, Problem, Enrollment, ProblemTestCase, Submission
+from .models import User, Class, Problem, Enrollment, ProblemTestCase, Submission, StudentProblemResult
 from django.contrib import messages
-from datetime import datetime
-from django.http import JsonResponse 
-import json, requests, subprocess, tempfile, os, shutil
+from datetime import datetime, timezone as dt_timezone
+from django.http import Http404, HttpResponse, JsonResponse 
+import json, subprocess, tempfile, os, shutil
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from django.utils.cache import patch_vary_headers
 from django.utils import timezone
 from django.urls import reverse
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, Count, Sum, F, FilteredRelation
+from django.db.models.functions import Substr
 from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from .execution import execute_source, truncation_note
+from .grading import run_test_cases, is_hidden_case, grade_submission, check_case
+from .results import record_attempt, rebuild_result
+from .problem_details import problem_payload
+from .regrade import queue_regrade, regrade_progress
+from .exports import EXPORTS, csv_response
+from .images import ImageUploadError, check_image, schedule_variants, variant_url
+from .metrics import flush as flush_metrics, render_metrics
+from .roster import CREATED, ENROLLED, ALREADY_ENROLLED, SKIPPED, RosterImportError, import_roster, parse_roster
+from .testcases import (
+    TestCaseImportError, create_test_cases, parse_test_case_upload, parse_test_cases, sync_test_cases,
+)
+from .runner_client import RunnerUnavailable
+from .throttling import PLAYGROUND, Throttled, check_playground_rate
 
 
 # ---------------- LOGIN & DASHBOARD ---------------- #
@@ -37,7 +58,7 @@ def login_view(request):
             request.session['school_id'] = user.school_id
             request.session['first_name'] = user.first_name
             request.session['last_name'] = user.last_name
-            request.session['user_image'] = user.user_image.url if user.user_image else None
+            request.session['user_image'] = variant_url(user.user_image, 'sm') or None
             request.session['user_type'] = user.user_type
 
             messages.success(request, f"Welcome back, {user.first_name}!")
@@ -58,17 +79,16 @@ def login_view(request):
 
 #-------------TEACHER DASHBOARD----------------------#
 def dashboard(request):
-    school_id = request.session.get('school_id')
+    user = request.current_user
 
-    if not school_id:
+    if not user:
         # Redirect to login if not logged in
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    user = User.objects.filter(school_id=school_id).first()
-
     # Get classes created by the teacher
-    classes = Class.objects.filter(teacher=user).order_by('-class_id')
+    # Only evaluated when the cached class cards are rebuilt (see fragments.py)
+    classes = Class.objects.filter(teacher=user).annotate(problem_count=Count('problem')).order_by('-class_id')
 
     return render(request, 'User/dashboard.html', {
         'currentpage': 'dashboard',
@@ -116,6 +136,13 @@ def signup(request):
             messages.error(request, "School ID already exists.")
             return render(request, 'User/sign-up.html', context)
 
+        if user_image:
+            try:
+                check_image(user_image)
+            except ImageUploadError as e:
+                messages.error(request, str(e))
+                return render(request, 'User/sign-up.html', context)
+
         # ✅ Create new user
         user = User.objects.create(
             school_id=school_id,
@@ -125,6 +152,8 @@ def signup(request):
             user_type=user_type.capitalize(),
             user_image=user_image if user_image else 'profile_pic/default.png'
         )
+        if user_image:
+            schedule_variants(user, 'user_image')
 
         messages.success(request, "Account created successfully! Please log in.")
         return redirect('index')  # ✅ Redirect to index.html (login page)
@@ -142,7 +171,10 @@ def create_class(request):
         description = request.POST.get("description")
         upload_icon = request.FILES.get("upload_icon")
 
-        teacher = User.objects.get(school_id=request.session.get("school_id"))
+        teacher = request.current_user
+        if not teacher:
+            messages.warning(request, "Please log in first.")
+            return redirect('index')
 
         # Prevent duplicate class codes
         if Class.objects.filter(class_code=class_code).exists():
@@ -153,14 +185,25 @@ def create_class(request):
                 return redirect('MyClasses')
             return redirect('dashboard')
 
+        if upload_icon:
+            try:
+                check_image(upload_icon)
+            except ImageUploadError as e:
+                messages.error(request, str(e))
+                if 'MyClasses' in request.META.get('HTTP_REFERER', ''):
+                    return redirect('MyClasses')
+                return redirect('dashboard')
+
         # Create the class
-        Class.objects.create(
+        new_class = Class.objects.create(
             class_code=class_code,
             title=title,
             description=description,
             upload_icon=upload_icon,
             teacher=teacher
         )
+        if upload_icon:
+            schedule_variants(new_class, 'upload_icon')
         messages.success(request, "Class created successfully!")
 
         # Redirect to the same page where the request came from
@@ -172,13 +215,12 @@ def create_class(request):
     return redirect('dashboard')
 
 def MyClasses(request):
-    school_id = request.session.get('school_id')
-    if not school_id:
+    teacher = request.current_user
+    if not teacher:
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    teacher = User.objects.filter(school_id=school_id).first()
-    classes = Class.objects.filter(teacher=teacher).order_by('-class_id')  # use class_id
+    classes = Class.objects.filter(teacher=teacher).annotate(problem_count=Count('problem')).order_by('-class_id')  # use class_id
 
     return render(request, 'User/MyClasses.html', {
         'currentpage': 'MyClasses',
@@ -212,14 +254,11 @@ def delete_class(request, class_id):
 
 def classDetails(request, class_id):
     # Check if user is logged in
-    school_id = request.session.get('school_id')
-    if not school_id:
+    teacher = request.current_user
+    if not teacher:
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    # Get teacher info
-    teacher = get_object_or_404(User, school_id=school_id)
-
     # Get the class object
     class_obj = get_object_or_404(Class, class_id=class_id, teacher=teacher)
 
@@ -281,14 +320,25 @@ def classDetails(request, class_id):
 
     # ---- ADD PROBLEM------------
 
+def _comparator_options(post):
+    """(comparator, abs tolerance, rel tolerance) from the problem form; raises ValueError if invalid."""
+    comparator = post.get("comparator", "exact").strip() or "exact"
+    if comparator not in dict(Problem.COMPARATOR_CHOICES):
+        raise ValueError(f"Unknown comparator '{comparator}'.")
+    abs_tol = float(post.get("float_abs_tolerance", "").strip() or 1e-6)
+    rel_tol = float(post.get("float_rel_tolerance", "").strip() or 1e-6)
+    if abs_tol < 0 or rel_tol < 0:
+        raise ValueError("Tolerances cannot be negative.")
+    return comparator, abs_tol, rel_tol
+
+
 def add_problem(request, class_id):
     # Ensure user is logged in
-    school_id = request.session.get('school_id')
-    if not school_id:
+    teacher = request.current_user
+    if not teacher:
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    teacher = get_object_or_404(User, school_id=school_id)
     class_obj = get_object_or_404(Class, class_id=class_id, teacher=teacher)
 
     if request.method == "POST":
@@ -299,47 +349,45 @@ def add_problem(request, class_id):
         time_limit = request.POST.get("time_limit", "").strip()
         due_date = request.POST.get("due_date", "").strip()
 
-        # Test cases
-        inputs = [
-            request.POST.get(f"input{i}", "").strip() for i in range(1, 4)
-        ]
-        outputs = [
-            request.POST.get(f"output{i}", "").strip() for i in range(1, 4)
-        ]
-
         # Validation
         if not all([title, description, problem_type, total_score, time_limit, due_date]):
             messages.error(request, "Please fill in all fields.")
             return redirect('classDetails', class_id=class_id)
 
+        # Test cases: any number of inputN/outputN fields, plus an optional CSV/zip import
+        try:
+            test_cases = parse_test_cases(request.POST)
+            if request.FILES.get("test_case_file"):
+                test_cases += parse_test_case_upload(request.FILES["test_case_file"])
+        except TestCaseImportError as e:
+            messages.error(request, str(e))
+            return redirect('classDetails', class_id=class_id)
+
         try:
             total_score = int(total_score)
             time_limit = int(time_limit)
             due_date = datetime.fromisoformat(due_date)
+            comparator, abs_tol, rel_tol = _comparator_options(request.POST)
         except ValueError:
             messages.error(request, "Invalid input values.")
             return redirect('classDetails', class_id=class_id)
 
-        # Create Problem
-        problem = Problem.objects.create(
-            class_id=class_obj,
-            teacher_id=teacher,
-            problem_title=title,
-            problem_description=description,
-            problem_type=problem_type,
-            total_score=total_score,
-            time_limit=time_limit,
-            due_date=due_date,
-        )
-
-        # Add test cases
-        for i in range(3):
-            if inputs[i] or outputs[i]:
-                ProblemTestCase.objects.create(
-                    problem_id=problem,
-                    input_data=inputs[i],
-                    expected_output=outputs[i]
-                )
+        # Create Problem and its test cases (one INSERT for all cases)
+        with transaction.atomic():
+            problem = Problem.objects.create(
+                class_id=class_obj,
+                teacher_id=teacher,
+                problem_title=title,
+                problem_description=description,
+                problem_type=problem_type,
+                total_score=total_score,
+                time_limit=time_limit,
+                due_date=due_date,
+                comparator=comparator,
+                float_abs_tolerance=abs_tol,
+                float_rel_tolerance=rel_tol,
+            )
+            create_test_cases(problem, test_cases)
 
         messages.success(request, f"Problem '{title}' created successfully!")
         return redirect('classDetails', class_id=class_id)
@@ -350,37 +398,42 @@ def add_problem(request, class_id):
 
                 #Works for both Students and Teachers
 
-def get_problem_details(request, problem_id):
-    """Return problem details as JSON (used in both Teacher and Student modals)."""
-    problem = get_object_or_404(Problem, pk=problem_id)
-    test_cases = ProblemTestCase.objects.filter(problem_id=problem)
+def _problem_details(request, problem_id):
+    """The cached problem payload and this user's answered flag, looked up once per request."""
+    if not hasattr(request, '_problem_details'):
+        payload = problem_payload(problem_id)
 
-    # Default value
-    answered = False
-
-    # Check if the logged-in user is a student and has submitted this problem
-    school_id = request.session.get('school_id')
-    if school_id:
-        user = User.objects.filter(school_id=school_id).first()
+        # Check if the logged-in user is a student and has submitted this problem
+        answered = False
+        user = request.current_user
         if user and user.user_type == "Student":
-            answered = Submission.objects.filter(problem_id=problem, student_id=user).exists()
+            answered = StudentProblemResult.objects.filter(problem_id=problem_id, student_id=user).exists()
 
-    # Prepare data
-    data = {
-        "problem_id": problem.problem_id,
-        "title": problem.problem_title,
-        "description": problem.problem_description,
-        "type": problem.problem_type,
-        "score": problem.total_score,
-        "time_limit": problem.time_limit,
-        "due_date": problem.due_date.strftime("%Y-%m-%d %H:%M"),
-        "answered": answered,  # ✅ Student-specific info only if applicable
-        "test_cases": [
-            {"input": tc.input_data, "output": tc.expected_output} for tc in test_cases
-        ]
-    }
+        request._problem_details = (payload, answered)
+    return request._problem_details
+
+
+def _problem_details_etag(request, problem_id):
+    payload, answered = _problem_details(request, problem_id)
+    return f"{payload['version']}-{int(answered)}"
 
-    return JsonResponse(data)
+
+def _problem_details_last_modified(request, problem_id):
+    payload, _ = _problem_details(request, problem_id)
+    return datetime.fromtimestamp(payload['modified'], tz=dt_timezone.utc)
+
+
+@condition(etag_func=_problem_details_etag, last_modified_func=_problem_details_last_modified)
+def get_problem_details(request, problem_id):
+    """Return problem details as JSON (used in both Teacher and Student modals)."""
+    payload, answered = _problem_details(request, problem_id)
+
+    data = dict(payload['data'], answered=answered)  # ✅ Student-specific info only if applicable
+    response = JsonResponse(data)
+    # Browsers keep the copy but revalidate every time, getting a 304 while it's current
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Cookie'])
+    return response
 
 
 #----------------------Problem Deletion------------------------------------#
@@ -406,25 +459,24 @@ def edit_problem(request, problem_id):
         due_date = request.POST.get("due_date", "").strip()
 
         try:
+            test_cases = parse_test_cases(request.POST)
+            if request.FILES.get("test_case_file"):
+                test_cases += parse_test_case_upload(request.FILES["test_case_file"])
+
             problem.problem_title = title
             problem.problem_description = description
             problem.problem_type = problem_type
             problem.total_score = int(total_score)
             problem.time_limit = int(time_limit)
             problem.due_date = datetime.fromisoformat(due_date)
-            problem.save()
-
-            # Update only this problem's test cases
-            ProblemTestCase.objects.filter(problem_id=problem.problem_id).delete()
-            for i in range(3):
-                input_data = request.POST.get(f"input{i+1}", "").strip()
-                output_data = request.POST.get(f"output{i+1}", "").strip()
-                if input_data or output_data:
-                    ProblemTestCase.objects.create(
-                        problem_id=problem,
-                        input_data=input_data,
-                        expected_output=output_data
-                    )
+            problem.comparator, problem.float_abs_tolerance, problem.float_rel_tolerance = (
+                _comparator_options(request.POST)
+            )
+
+            with transaction.atomic():
+                problem.save()
+                # Update only this problem's test cases; unchanged ones keep their IDs
+                sync_test_cases(problem, test_cases)
 
             messages.success(request, f"Problem '{problem.problem_title}' updated successfully!")
         except Exception as e:
@@ -433,14 +485,41 @@ def edit_problem(request, problem_id):
     return redirect('classDetails', class_id=class_id)
 
 
+#----------------------Regrade Problem-----------------------------------------#
+def regrade_problem(request, problem_id):
+    """Queues the problem's submissions to be regraded against its current test cases."""
+    teacher = request.current_user
+    if not teacher:
+        return JsonResponse({"success": False, "message": "Please log in first."}, status=401)
+    if request.method != "POST":
+        return JsonResponse({"success": False, "message": "Invalid request method."}, status=400)
+
+    problem = get_object_or_404(Problem, pk=problem_id, teacher_id=teacher)
+    queued = queue_regrade(problem)
+    return JsonResponse({"success": True, "queued": queued, **regrade_progress(problem)})
+
+
+def regrade_status(request, problem_id):
+    """Polled by the edit problem modal while a regrade runs."""
+    teacher = request.current_user
+    if not teacher:
+        return JsonResponse({"success": False, "message": "Please log in first."}, status=401)
+
+    problem = get_object_or_404(Problem, pk=problem_id, teacher_id=teacher)
+    return JsonResponse({"success": True, **regrade_progress(problem)})
+
+
 # ---------- REPORT DASHBOARD ----------  
+REPORT_PAGE_SIZE = 50
+# One past the 80 shown so truncatechars still marks cut-off code
+REPORT_CODE_PREVIEW_CHARS = 81
+
 def report(request):
-    if not request.session.get('school_id'):
+    user = request.current_user
+    if not user:
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    user = User.objects.get(school_id=request.session['school_id'])
-
     # Filter only the teacher’s own classes
     if user.user_type.lower() == 'teacher':
         classes = Class.objects.filter(teacher=user).order_by('class_id')
@@ -456,39 +535,71 @@ def report(request):
             Q(title__icontains=search_query) | Q(class_code__icontains=search_query)
         ).first()
 
-    # Problems and submissions for the selected class
-    problems = Problem.objects.filter(class_id__in=classes).select_related('class_id').order_by('problem_id')
-    submissions = Submission.objects.select_related(
-        'student_id', 'problem_id', 'problem_id__class_id'
-    ).filter(problem_id__in=problems).exclude(submission_id__isnull=True)
+    problems = Problem.objects.none()
+    enrolled_students = User.objects.none()
+    submissions = []
+    next_cursor = None
 
-    # Students in the teacher’s classes
-    students = User.objects.filter(
-        user_type__iexact='student',
-        enrollment__class_id__in=classes
-    ).distinct().order_by('school_id')
-
-    # Students enrolled in the selected class
-    enrolled_students = []
     if selected_class:
-        enrolled_students = students.filter(enrollment__class_id=selected_class).distinct()
+        # Everything below is filtered to the selected class in SQL
+        problems = (
+            Problem.objects.filter(class_id=selected_class)
+            .only('problem_id', 'problem_title', 'time_limit', 'due_date')
+            .order_by('problem_id')
+        )
+        in_class = Q(problem_results__problem_id__class_id=selected_class)
+        enrolled_students = (
+            User.objects.filter(user_type__iexact='student', enrollment__class_id=selected_class)
+            .only('school_id', 'first_name', 'last_name')
+            .annotate(
+                problems_answered=Count('problem_results', filter=in_class),
+                best_total=Sum('problem_results__best_score', filter=in_class),
+            )
+            .order_by('school_id')
+        )
 
-    # Counts for summary
-    total_students = students.count()
-    total_submissions = submissions.count()
-    pending_reviews = submissions.filter(score__isnull=True).count()
+        # Keyset pagination, newest first; the code itself is never loaded, only a preview
+        submissions = (
+            Submission.objects.filter(problem_id__class_id=selected_class)
+            .select_related('student_id', 'problem_id')
+            .only(
+                'submission_id', 'score', 'status',
+                'student_id__school_id', 'student_id__first_name', 'student_id__last_name',
+                'problem_id__problem_title',
+            )
+            .annotate(code_preview=Substr('code', 1, REPORT_CODE_PREVIEW_CHARS))
+            .order_by('-submission_id')
+        )
+        cursor = request.GET.get('after', '')
+        if cursor.isdigit():
+            submissions = submissions.filter(submission_id__lt=int(cursor))
+
+        submissions = list(submissions[:REPORT_PAGE_SIZE + 1])
+        if len(submissions) > REPORT_PAGE_SIZE:
+            submissions = submissions[:REPORT_PAGE_SIZE]
+            next_cursor = submissions[-1].submission_id
+
+    # Counts for summary (one aggregate query each)
+    total_students = Enrollment.objects.filter(class_id__in=classes).aggregate(
+        total=Count('student_id', distinct=True)
+    )['total']
+    submission_counts = Submission.objects.filter(problem_id__class_id__in=classes).aggregate(
+        total=Count('submission_id'),
+        pending=Count('submission_id', filter=Q(status__in=[Submission.PENDING, Submission.RUNNING])),
+    )
 
     context = {
         'user': user,
         'classes': classes,
         'problems': problems,
-        'students': students,
         'enrolled_students': enrolled_students,
         'submissions': submissions,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after'),
         'selected_class': selected_class,
         'total_students': total_students,
-        'total_submissions': total_submissions,
-        'pending_reviews': pending_reviews,
+        'total_submissions': submission_counts['total'],
+        'pending_reviews': submission_counts['pending'],
         'currentpage': 'report',
         'search_query': search_query,
     }
@@ -496,6 +607,19 @@ def report(request):
     return render(request, 'User/report.html', context)
 
 
+def export_report(request, class_id, kind):
+    """Streams the roster, submissions or per-problem scores of one of the teacher's classes as CSV."""
+    user = request.current_user
+    if not user:
+        messages.warning(request, "Please log in first.")
+        return redirect('index')
+
+    selected_class = get_object_or_404(Class, class_id=class_id, teacher=user)
+    if kind not in EXPORTS:
+        raise Http404("Unknown export.")
+    return csv_response(EXPORTS[kind](selected_class), f"{selected_class.class_code}_{kind}.csv")
+
+
 # ---------- DELETE STUDENT ----------
 def delete_student(request, school_id):
     student = get_object_or_404(User, school_id=school_id, user_type__iexact='student')
@@ -511,11 +635,14 @@ def review_submission(request, submission_id):
     submission = get_object_or_404(Submission, submission_id=submission_id)
 
     if request.method == 'POST':
-        new_status = request.POST.get('status')
-        feedback = request.POST.get('feedback')
-        submission.status = new_status
-        submission.feedback = feedback
-        submission.save()
+        review_status = request.POST.get('status', '')
+        if review_status not in dict(Submission.REVIEW_CHOICES):
+            messages.error(request, "Invalid review status.")
+            return redirect('report')
+        submission.review_status = review_status
+        submission.feedback = request.POST.get('feedback', '')
+        # Only the review fields: a full save would overwrite a grade the worker is writing
+        submission.save(update_fields=['review_status', 'feedback'])
         messages.success(request, '✅ Submission review updated successfully!')
         return redirect('report')
 
@@ -526,6 +653,7 @@ def review_submission(request, submission_id):
 def delete_submission(request, submission_id):
     submission = get_object_or_404(Submission, submission_id=submission_id)
     submission.delete()
+    rebuild_result(submission.student_id_id, submission.problem_id_id)
     messages.success(request, 'Student submission deleted successfully!')
     return redirect('report')
 
@@ -536,19 +664,17 @@ def delete_submission(request, submission_id):
 
 #---------------Student Dashboard--------------------#
 def StudentDashboard(request):  # for student
-    school_id = request.session.get('school_id')
+    student = request.current_user
 
-    if not school_id:
+    if not student:
         # Redirect to login if not logged in
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    student = User.objects.filter(school_id=school_id).first()
-
     # Get all classes the student is enrolled in
     enrolled_classes = Class.objects.filter(
         enrollment__student_id=student
-    ).order_by('-class_id').distinct()
+    ).annotate(problem_count=Count('problem', distinct=True)).order_by('-class_id').distinct()
 
     return render(request, 'Students/StudentDashboard.html', {
         'currentpage': 'StudentDashboard',
@@ -559,17 +685,15 @@ def StudentDashboard(request):  # for student
 
 #---------------Student Enrolled Classes----------------#
 def StudentClass(request):
-    school_id = request.session.get('school_id')
-    if not school_id:
+    student = request.current_user
+    if not student:
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    student = User.objects.filter(school_id=school_id).first()
-
     # Get classes the student is enrolled in
     enrolled_classes = Class.objects.filter(
         enrollment__student_id=student
-    ).order_by('-class_id').distinct()
+    ).annotate(problem_count=Count('problem', distinct=True)).order_by('-class_id').distinct()
 
     return render(request, 'Students/StudentClass.html', {
         'currentpage': 'StudentClass',
@@ -578,14 +702,43 @@ def StudentClass(request):
     })
 
 # ---------------- JOIN CLASS (STUDENT) ---------------- #
+def import_class_roster(request, class_id):
+    """Creates and enrolls the students in an uploaded CSV roster, then shows what happened to each row."""
+    teacher = request.current_user
+    if not teacher:
+        messages.warning(request, "Please log in first.")
+        return redirect('index')
+
+    class_obj = get_object_or_404(Class, class_id=class_id, teacher=teacher)
+    upload = request.FILES.get("roster_file")
+    if request.method != "POST" or not upload:
+        messages.error(request, "Please choose a roster CSV file.")
+        return redirect('classDetails', class_id=class_id)
+
+    try:
+        rows = import_roster(class_obj, parse_roster(upload))
+    except RosterImportError as e:
+        messages.error(request, str(e))
+        return redirect('classDetails', class_id=class_id)
+
+    statuses = {'created': CREATED, 'enrolled': ENROLLED, 'already_enrolled': ALREADY_ENROLLED, 'skipped': SKIPPED}
+    counts = {key: sum(row.status == status for row in rows) for key, status in statuses.items()}
+    return render(request, 'User/roster_import.html', {
+        'currentpage': 'MyClasses',
+        'user': teacher,
+        'class': class_obj,
+        'rows': rows,
+        'counts': counts,
+    })
+
+
 def join_class(request):
     if request.method == "POST":
-        school_id = request.session.get('school_id')
-        if not school_id:
+        student = request.current_user
+        if not student:
             messages.warning(request, "Please log in first.")
             return redirect('index')
 
-        student = User.objects.get(school_id=school_id)
         class_code = request.POST.get('class_code', '').strip()
 
         if not class_code:
@@ -615,21 +768,27 @@ def join_class(request):
 
 def student_class_details(request, class_id):
     # Make sure the student is logged in
-    school_id = request.session.get('school_id')
-    if not school_id:
+    student = request.current_user
+    if not student:
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    # Get student and class instance
-    enrollment = get_object_or_404(Enrollment, student_id__school_id=school_id, class_id=class_id)
-    student = enrollment.student_id
-    class_instance = get_object_or_404(Class, pk=class_id)
+    # Get class instance (one query)
+    enrollment = get_object_or_404(
+        Enrollment.objects.select_related('class_id'), student_id=student, class_id=class_id
+    )
+    class_instance = enrollment.class_id
 
     # Search and filter handling
     query = request.GET.get('q', '').strip()
     filter_type = request.GET.get('filter', '').strip()
 
-    problems = Problem.objects.filter(class_id=class_instance).order_by('-problem_id')
+    # The student's result row comes back with the problem list in the same query
+    problems = Problem.objects.filter(class_id=class_instance).annotate(
+        result=FilteredRelation('results', condition=Q(results__student_id=student)),
+        latest_score=F('result__latest_score'),
+        latest_status=F('result__latest_status'),
+    ).order_by('-problem_id')
     if query:
         problems = problems.filter(problem_title__icontains=query)
     if filter_type:
@@ -638,18 +797,13 @@ def student_class_details(request, class_id):
     # Prepare problems + submission info
     problem_data = []
     for p in problems:
-        submission = Submission.objects.filter(
-            student_id=student,
-            problem_id=p
-            
-        ).order_by('-submission_id').first()
-
+        graded = p.latest_status == Submission.GRADED
         half_score = p.total_score / 2
 
         problem_data.append({
             'problem': p,
-            'score': submission.score if submission else None,
-            'answered': submission is not None,
+            'score': p.latest_score if graded else None,
+            'answered': p.latest_status is not None,
             'half_score': half_score, 
         })
 
@@ -666,12 +820,11 @@ def student_class_details(request, class_id):
 
 #------------------Unenroll Function--------------------#
 def unenroll_class(request, class_id):
-    school_id = request.session.get('school_id')
-    if not school_id:
+    student = request.current_user
+    if not student:
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    student = get_object_or_404(User, school_id=school_id)
     enrollment = Enrollment.objects.filter(class_id=class_id, student_id=student).first()
     if enrollment:
         enrollment.delete()
@@ -681,28 +834,27 @@ def unenroll_class(request, class_id):
 
     return redirect('StudentClass')
 
-# External code runner API
-PISTON_URL = "https://emkc.org/api/v2/piston/execute"
-
 # ---------------- PLAYGROUND PAGE ---------------- #
 def playground(request, problem_id):
     """Renders the coding playground for a student"""
-    school_id = request.session.get('school_id')
-    if not school_id:
+    student = request.current_user
+    if not student:
         messages.warning(request, "Please log in first.")
         return redirect('index')
 
-    student = get_object_or_404(User, school_id=school_id)
     problem = get_object_or_404(Problem, pk=problem_id)
 
     return render(request, 'Students/StudentPlayGround.html', {
         'user': student,
-        'problem': problem
+        'problem': problem,
+        'test_cases': list(problem.problemtestcase_set.order_by('testcase_id')),
+        'terminal_ws_url': settings.TERMINAL_WS_URL,
     })
 
 
 # ---------------- RUN & CHECK CODE ---------------- #
 @csrf_exempt
+@gzip_page
 def run_playground_code(request):
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request method."}, status=400)
@@ -715,11 +867,19 @@ def run_playground_code(request):
         check_mode = data.get("check_mode", False)
         problem_id = data.get("problem_id")
         stdin_data = data.get("stdin", "")
+        # Opt out of the result cache for programs using randomness, time, etc.
+        use_cache = not data.get("no_cache", False)
 
         if not code.strip():
             return JsonResponse({"error": "Code cannot be empty."}, status=400)
 
         problem = get_object_or_404(Problem, pk=problem_id)
+
+        # Admission control: per-student and per-class rate limits, then a runner slot per
+        # runner call (graded submissions keep a reserved share of the slots)
+        school_id = request.session.get('school_id') or request.META.get('REMOTE_ADDR')
+        check_playground_rate(school_id, problem.class_id_id)
+
         tmp_dir = tempfile.mkdtemp(prefix="code_run_")
 
         extensions = {"python": "main.py", "c": "main.c", "cpp": "main.cpp", "java": "Main.java"}
@@ -730,17 +890,26 @@ def run_playground_code(request):
 
         # ✅ Test case checking mode
         if check_mode:
-            testcases = list(ProblemTestCase.objects.filter(problem_id=problem))
+            testcases = list(ProblemTestCase.objects.filter(problem_id=problem).order_by("testcase_id"))
             total_cases = len(testcases)
             results = []
             passed_count = 0
 
-            for i, tc in enumerate(testcases, start=1):
+            # Compile once, then run the same build against every test case
+            compare = problem.compare_options()
+            compile_error, exec_results = run_test_cases(
+                language, code, testcases, use_cache=use_cache, compare=compare, slot_kind=PLAYGROUND
+            )
+            if compile_error:
+                return JsonResponse({
+                    "result_summary": f"❌ Compilation Error\n{compile_error}",
+                    "total_score": 0,
+                })
+
+            for i, (tc, exec_res) in enumerate(zip(testcases, exec_results), start=1):
                 expected = (tc.expected_output or "").strip()
                 raw_input = (tc.input_data or "").strip()
 
-                exec_res = execute_source(language, source_path, stdin_data=raw_input + "\n")
-
                 if exec_res.get("error"):
                     results.append(f"❌ Test {i}: {exec_res['error']}")
                     continue
@@ -748,25 +917,24 @@ def run_playground_code(request):
                 output = (exec_res.get("stdout") or "").strip()
 
                 # ✅ Hidden test case logic
-                is_hidden = (
-                    (total_cases == 1) or
-                    (total_cases == 2 and i == 2) or
-                    (total_cases == 3 and i == 3)
-                )
+                is_hidden = is_hidden_case(i, total_cases)
 
+                passed, difference = check_case(tc, exec_res, compare)
                 if is_hidden:
-                    if output == expected:
+                    if passed:
                         results.append(f"✅ Test {i}: Passed (Hidden Case)")
                         passed_count += 1
                     else:
                         results.append(f"❌ Test {i}: Failed (Hidden Case)")
                 else:
-                    if output == expected:
+                    if passed:
                         results.append(f"✅ Test {i}: Passed")
                         passed_count += 1
                     else:
                         results.append(
                             f"❌ Test {i}: Failed\nInput: {raw_input}\nExpected: {expected}\nGot: {output}"
+                            + truncation_note(exec_res)
+                            + (f"\nFirst difference: {difference}" if difference else "")
                         )
 
             return JsonResponse({
@@ -775,14 +943,27 @@ def run_playground_code(request):
             })
 
         # Manual Run Mode
-        exec_res = execute_source(language, source_path, stdin_data=stdin_data + "\n")
+        exec_res = execute_source(
+            language, source_path, stdin_data=stdin_data + "\n", use_cache=use_cache, slot_kind=PLAYGROUND
+        )
         return JsonResponse({
             "output": exec_res.get("stdout", "No output."),
             "stderr": exec_res.get("stderr", ""),
             "compile_error": exec_res.get("compile_error", ""),
-            "error": exec_res.get("error", "")
+            "error": exec_res.get("error", ""),
+            "truncated": exec_res.get("truncated", False),
+            "stdout_bytes": exec_res.get("stdout_bytes", 0),
+            "stderr_bytes": exec_res.get("stderr_bytes", 0),
         })
 
+    except Throttled as e:
+        response = JsonResponse({"error": str(e)}, status=429)
+        response["Retry-After"] = str(e.retry_after)
+        return response
+    except RunnerUnavailable as e:
+        response = JsonResponse({"error": str(e)}, status=503)
+        response["Retry-After"] = str(e.retry_after)
+        return response
     except Exception as e:
         return JsonResponse({"error": f"Server error: {str(e)}"}, status=500)
     finally:
@@ -794,7 +975,8 @@ def run_playground_code(request):
 def submit_problem(request, problem_id):
     """
     Handles code submission from students.
-    Runs test cases, hides hidden ones, gives score, and returns JSON response for modal display.
+    Saves the submission as Pending for the grade_worker command and returns right away;
+    the browser polls submission_status for the score. With GRADING_QUEUE off it is graded inline.
     """
     if request.method != "POST":
         return JsonResponse({"success": False, "message": "Invalid request method."}, status=400)
@@ -806,86 +988,78 @@ def submit_problem(request, problem_id):
     except Exception:
         return JsonResponse({"success": False, "message": "Invalid JSON received."}, status=400)
 
+    student = request.current_user
+    if not student:
+        return JsonResponse({"success": False, "message": "Please log in first."}, status=401)
     problem = get_object_or_404(Problem, pk=problem_id)
-    student = get_object_or_404(User, pk=request.session["school_id"])
-
-    test_cases = ProblemTestCase.objects.filter(problem_id=problem)
-    total_cases = test_cases.count()
-    passed_cases = 0
-    score = 0
-    results = []
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        ext_map = {"python": ".py", "c": ".c", "cpp": ".cpp", "java": ".java"}
-        ext = ext_map.get(language)
-        if not ext:
-            return JsonResponse({"success": False, "message": "Unsupported language selected."}, status=400)
-
-        source_path = os.path.join(tmp_dir, f"Main{ext}")
-        with open(source_path, "w") as src:
-            src.write(code)
-
-        for i, tc in enumerate(test_cases, start=1):
-            raw_input = (tc.input_data or "").strip()
-            expected = (tc.expected_output or "").strip()
-
-            try:
-                exec_res = execute_source(language, source_path, stdin_data=raw_input + ("\n" if raw_input else "\n"))
+    ext_map = {"python": ".py", "c": ".c", "cpp": ".cpp", "java": ".java"}
+    if language not in ext_map:
+        return JsonResponse({"success": False, "message": "Unsupported language selected."}, status=400)
 
-                # Handle compile/runtime errors
-                if exec_res.get("compile_error") or exec_res.get("timeout") or exec_res.get("stderr"):
-                    results.append(f"❌ Test {i}: Error\n{exec_res.get('compile_error') or exec_res.get('stderr') or exec_res.get('timeout')}")
-                    continue
+    # ✅ Save submission (queued for grading) and count the attempt together
+    with transaction.atomic():
+        submission = Submission.objects.create(
+            problem_id=problem,
+            student_id=student,
+            code=code,
+            language=language,
+            status=Submission.PENDING,
+            submitted_at=timezone.now()
+        )
+        record_attempt(submission)
 
-                out = (exec_res.get("stdout") or "").strip()
+    redirect_url = reverse("student_class_details", args=[problem.class_id_id])
 
-                # ✅ Hidden test case logic
-                # Hide details for last test case or based on count rules
-                is_hidden = (
-                    (total_cases == 1) or
-                    (total_cases == 2 and i == 2) or
-                    (total_cases == 3 and i == 3)
-                )
-
-                if out == expected:
-                    passed_cases += 1
-                    score += 10
-                    if is_hidden:
-                        results.append(f"✅ Test {i}: Passed (Hidden Case)")
-                    else:
-                        results.append(f"✅ Test {i}: Passed")
-                else:
-                    if is_hidden:
-                        results.append(f"❌ Test {i}: Failed (Hidden Case)")
-                    else:
-                        results.append(f"❌ Test {i}: Failed\nInput: {raw_input}\nExpected: {expected}\nGot: {out}")
-
-            except Exception as e:
-                results.append(f"❌ Test {i}: Exception\n{str(e)}")
-                continue
-
-    # ✅ Save submission
-    Submission.objects.create(
-        problem_id=problem,
-        student_id=student,
-        code=code,
-        score=score,
-        submitted_at=timezone.now()
-    )
-
-    result_summary = "\n".join(results) + f"\n\n{passed_cases}/{total_cases} test cases passed. Score: {score}"
-    redirect_url = reverse("student_class_details", args=[problem.class_id.class_id])
+    if settings.GRADING_QUEUE:
+        return JsonResponse({
+            "success": True,
+            "pending": True,
+            "submission_id": submission.submission_id,
+            "status_url": reverse("submission_status", args=[submission.submission_id]),
+            "redirect_url": redirect_url
+        }, status=202)
 
+    try:
+        # No worker will pick it up again, so a runner failure marks it Error
+        grade_submission(submission, requeue=False)
+    except (RunnerUnavailable, Throttled) as e:
+        status = 429 if isinstance(e, Throttled) else 503
+        response = JsonResponse({"success": False, "message": str(e)}, status=status)
+        response["Retry-After"] = str(e.retry_after)
+        return response
     return JsonResponse({
         "success": True,
-        "result_summary": result_summary,
-        "score": score,
-        "passed_cases": passed_cases,
-        "total_cases": total_cases,
+        "result_summary": submission.result_summary,
+        "score": submission.score,
+        "passed_cases": submission.passed_cases,
+        "total_cases": submission.total_cases,
         "redirect_url": redirect_url
     })
 
 
+def submission_status(request, submission_id):
+    """Polled by the playground after submitting; returns the score once the worker has graded it."""
+    school_id = request.session.get('school_id')
+    if not school_id:
+        return JsonResponse({"success": False, "message": "Please log in first."}, status=401)
+
+    submission = get_object_or_404(Submission, pk=submission_id, student_id=school_id)
+    data = {
+        "success": True,
+        "status": submission.status,
+        "pending": submission.status in (Submission.PENDING, Submission.RUNNING),
+    }
+    if not data["pending"]:
+        data.update({
+            "result_summary": submission.result_summary,
+            "score": submission.score,
+            "passed_cases": submission.passed_cases,
+            "total_cases": submission.total_cases,
+        })
+    return JsonResponse(data)
+
+
 def count_expected_inputs(test_output):
     """
     Estimate number of inputs based on output prompts.
@@ -905,67 +1079,18 @@ def find_executable(names):
             return path
     return None
 
-def execute_source(language, source_path, stdin_data="", timeout_sec=5):
-    """Executes code safely via Piston API and always returns JSON-safe output."""
-    PISTON_URL = "https://emkc.org/api/v2/piston/execute"
-
-    with open(source_path, "r", encoding="utf-8") as f:
-        code = f.read()
-
-    # Correct language mapping for Piston
-    lang_map = {
-        "python": "python3",
-        "python3": "python3",
-        "c": "c",
-        "cpp": "cpp",
-        "java": "java",
-    }
-    lang = lang_map.get(language.lower(), "python3")
-
-    payload = {
-        "language": lang,
-        "version": "*",
-        "files": [{"name": "main", "content": code}],
-        "stdin": stdin_data or "",
-    }
-
-    try:
-        res = requests.post(PISTON_URL, json=payload, timeout=timeout_sec + 2)
-
-        # Ensure JSON response
-        if "application/json" not in res.headers.get("Content-Type", ""):
-            return {
-                "stdout": "",
-                "stderr": "",
-                "compile_error": "",
-                "error": f"⚠️ Non-JSON from Piston ({res.status_code}): {res.text[:200]}"
-            }
-
-        data = res.json()
-
-        if res.status_code != 200:
-            return {
-                "stdout": "",
-                "stderr": "",
-                "compile_error": "",
-                "error": f"⚠️ Piston API error {res.status_code}: {data}"
-            }
-
-        # Defensive key access
-        run_data = data.get("run", {})
-        compile_data = data.get("compile", {})
-
-        return {
-            "stdout": run_data.get("stdout", ""),
-            "stderr": run_data.get("stderr", ""),
-            "compile_error": compile_data.get("stderr", ""),
-            "error": "",
-        }
-
-    except requests.Timeout:
-        return {"stdout": "", "stderr": "", "compile_error": "", "error": "⏱️ Timed out."}
-    except requests.RequestException as e:
-        return {"stdout": "", "stderr": "", "compile_error": "", "error": f"🌐 Request error: {e}"}
-    except Exception as e:
-        return {"stdout": "", "stderr": "", "compile_error": "", "error": f"⚠️ Unexpected: {e}"}
 
+# ---------------- METRICS ---------------- #
+def metrics(request):
+    """Prometheus scrape endpoint; needs "Authorization: Bearer <METRICS_TOKEN>"."""
+    if not settings.METRICS_TOKEN:
+        raise Http404("Metrics are disabled.")
+    auth = request.headers.get("Authorization", "")
+    if not constant_time_compare(auth, f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponse("Invalid metrics token.", status=401, content_type="text/plain")
+
+    flush_metrics()
+    body = render_metrics()
+    if body is None:
+        return HttpResponse("Metrics are busy, try again.", status=503, content_type="text/plain")
+    return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")